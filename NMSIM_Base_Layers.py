@@ -0,0 +1,405 @@
+#-----------------------------------------------------------------------------#
+# NMSIM_Base_Layers.py
+#
+# NPS Natural Sounds Program
+#
+# Prepare the elevation base layer of an NMSIM project without ArcGIS, as
+# `NMSIM_Create_Base_Layers.py` does within it: select the park's regional
+# DEM, clip it to the study area, reproject it, and save the .tif, .flt and
+# .hdr (and .prj) into the project's 01_ELEVATION folder. It runs headless,
+# with GDAL alone, e.g. on a Linux batch node:
+#
+#	python NMSIM_Base_Layers.py DENA study_area.shp D:\NMSIM_Projects\DENAUWBT D:\NPS_DEM
+#
+# Only the part of the regional DEM under the study area is ever read, and
+# it is reprojected in tiles of a fixed grid (`tile_pixels` cells on a side,
+# aligned to multiples of the tile size). Each tile is kept in a cache named
+# by the content of everything that made it - the regional DEM's hash, the
+# coordinate reference system, cell size, resampling and the tile's place -
+# so study areas that overlap in the same park reuse tiles already built.
+# A project's elevation is then a mosaic of its tiles, cut to the study area.
+#
+# As with the ArcGIS tool, the elevation is in NAD83 longitude/latitude by
+# default (the file name records the project's UTM zone), or NAD83 / UTM.
+#
+# History:
+#	D. Halyn Betchkal -- Created
+#
+#-----------------------------------------------------------------------------#
+
+# ================ Import Libraries =======================
+
+import os
+import json
+import math
+import hashlib
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+
+from NMSIM_Projections import NAD83, utm_zone, nad83_utm_crs, transform_bounds
+from NMSIM_Manifest import load_manifest, save_manifest, file_fingerprint
+
+
+# a cache of reprojected DEM tiles shared by every project built on this computer
+default_tile_cache = os.path.join(os.path.expanduser("~"), "NMSIM_tile_cache")
+
+# the subfolders of a canonical NMSIM project directory
+project_subfolders = [os.path.join(*p) for p in
+                      [["Input_Data"], ["Input_Data", "01_ELEVATION"], ["Input_Data", "02_IMPEDANCE"],
+                       ["Input_Data", "03_TRAJECTORY"], ["Input_Data", "04_LAYERS"], ["Input_Data", "05_SITES"],
+                       ["Input_Data", "06_AMBIENCE"], ["Input_Data", "07_WEATHER"], ["Input_Data", "08_TREES"],
+                       ["Output_Data"], ["Output_Data", "ASCII"], ["Output_Data", "IMAGES"], ["Output_Data", "SITE"],
+                       ["Output_Data", "TIG_TIS"]]]
+
+# the value of cells outside the study area (as the ArcGIS tool clips)
+elevation_nodata = -99999.0
+
+# creation options of every GeoTIFF written here
+tiff_options = ["TILED=YES", "COMPRESS=DEFLATE", "PREDICTOR=3", "BIGTIFF=IF_SAFER"]
+
+
+# ===========================  Define functions  =======================================
+
+def import_gdal():
+
+    """
+    Import GDAL (on first use), raising Python exceptions rather than returning error codes.
+    """
+
+    from osgeo import gdal, ogr, osr
+
+    gdal.UseExceptions()
+
+    return gdal, ogr, osr
+
+
+def make_NMSIM_project_dir(project_dir):
+
+    """
+    Create a canonical NMSIM project directory (any folders that already exist are kept).
+    """
+
+    for folder in project_subfolders:
+        os.makedirs(os.path.join(project_dir, folder), exist_ok=True)
+
+
+def DEM_selector(alpha_code, raster_folder, column="DEM_Name"):
+
+    """
+    The regional DEM (or, with column="LC_Name", landcover) raster of a park unit,
+    from `NPS_Unit_to_DEM.csv` beside this script.
+    """
+
+    NPS_units = pd.read_csv(os.path.join(os.path.dirname(os.path.realpath(__file__)), "NPS_Unit_to_DEM.csv"),
+                            encoding="ISO-8859-1")
+
+    names = NPS_units.loc[NPS_units["UNIT_CODE"] == alpha_code, column].values
+
+    if(len(names) == 0):
+        raise KeyError("No regional raster is listed for the unit " + alpha_code + " in NPS_Unit_to_DEM.csv")
+
+    return os.path.join(raster_folder, names[0])
+
+
+def study_area_bounds(study_area):
+
+    """
+    The NAD83 longitude/latitude bounds of a study area.
+
+    Inputs
+    ------
+    study_area (str, path, or tuple): a vector file any GDAL/OGR driver reads (e.g., a shapefile),
+                                      or (west, south, east, north) in NAD83 decimal degrees
+
+    Returns
+    -------
+    bounds (tuple): (west, south, east, north)
+    cutline (str): the vector file, to clip to its shape (None if bounds were given)
+
+    """
+
+    if(isinstance(study_area, (tuple, list))):
+        return tuple(float(b) for b in study_area), None
+
+    gdal, ogr, osr = import_gdal()
+
+    layer = ogr.Open(study_area).GetLayer(0)
+    xmin, xmax, ymin, ymax = layer.GetExtent()
+
+    srs = layer.GetSpatialRef()
+    src = srs.ExportToWkt() if srs is not None else NAD83
+
+    return transform_bounds(src, NAD83, (xmin, ymin, xmax, ymax)), study_area
+
+
+def source_fingerprint(source_path, cache_dir):
+
+    """
+    The content hash of a regional DEM, remembered in the tile cache (and only recomputed when the file changes).
+    """
+
+    memo_path = os.path.join(cache_dir, "sources.json")
+
+    memo = load_manifest(memo_path)
+    fingerprint = file_fingerprint(source_path, memo)
+
+    if(fingerprint is None):
+        raise FileNotFoundError("The regional DEM does not exist: " + source_path)
+
+    save_manifest(memo, memo_path)
+
+    return fingerprint
+
+
+def output_cell_size(source_path, crs):
+
+    """
+    The (square) cell size GDAL would choose to reproject a whole raster into `crs`.
+    (Only a virtual raster is made, so no cells are read.)
+    """
+
+    gdal, ogr, osr = import_gdal()
+
+    suggested = gdal.Warp("", source_path, format="VRT", dstSRS=crs).GetGeoTransform()
+
+    return min(abs(suggested[1]), abs(suggested[5]))
+
+
+def tile_grid(bounds, cell_size, tile_pixels):
+
+    """
+    The tiles of the fixed grid (tiles `tile_pixels` cells on a side, aligned to multiples
+    of the tile size) covering a bounding box (xmin, ymin, xmax, ymax).
+
+    Returns
+    -------
+    tiles (list of tuples): (column, row, tile bounds) of every tile
+    """
+
+    size = tile_pixels*cell_size
+    xmin, ymin, xmax, ymax = bounds
+
+    # (a box ending exactly on a tile edge does not need the next tile)
+    columns = range(math.floor(xmin/size), math.ceil(xmax/size))
+    rows = range(math.floor(ymin/size), math.ceil(ymax/size))
+
+    return [(i, j, (i*size, j*size, (i + 1)*size, (j + 1)*size)) for i in columns for j in rows]
+
+
+def tile_key(fingerprint, crs, cell_size, tile_pixels, resampling, i, j):
+
+    """
+    The cache name of one reprojected tile: a hash of everything that determines its cells.
+    """
+
+    content = {"source": fingerprint,
+               "crs": crs,
+               "cell_size": repr(float(cell_size)),
+               "tile_pixels": tile_pixels,
+               "resampling": resampling,
+               "nodata": elevation_nodata,
+               "tile": [i, j]}
+
+    return hashlib.sha1(json.dumps(content, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def cached_tile(source_path, key, tile_bounds, crs, tile_pixels, resampling, cache_dir):
+
+    """
+    Reproject one tile of a regional DEM into the cache, unless it is already there.
+
+    GDAL reads only the blocks of the source that fall under the tile.
+
+    Returns
+    -------
+    path (str): the cached tile (.tif)
+    built (bool): True if the tile was made now, False if it was reused
+    """
+
+    path = os.path.join(cache_dir, key[:2], key + ".tif")
+
+    if(os.path.exists(path)):
+        return path, False
+
+    gdal, ogr, osr = import_gdal()
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    # written under a temporary name, so another process never reads half a tile
+    tmp = path[:-4] + ".{0}.tmp.tif".format(os.getpid())
+    gdal.Warp(tmp, source_path, format="GTiff", dstSRS=crs, outputBounds=tile_bounds,
+              width=tile_pixels, height=tile_pixels, resampleAlg=resampling,
+              dstNodata=elevation_nodata, outputType=gdal.GDT_Float32, creationOptions=tiff_options,
+              multithread=True, warpMemoryLimit=256)
+
+    os.replace(tmp, path)
+
+    return path, True
+
+
+def write_gridfloat(tif_path, flt_path, block_rows=1024):
+
+    """
+    Copy a single-band raster to the GridFloat format NMSIM reads (.flt, .hdr and .prj), a block of rows at a time.
+
+    Inputs
+    ------
+    tif_path (str, path): a raster with square cells, north up
+    flt_path (str, path): the GridFloat file to write (the .hdr and .prj are written beside it)
+    block_rows (int): how many rows are copied at once [default 1024]
+
+    Returns
+    -------
+    None
+
+    """
+
+    gdal, ogr, osr = import_gdal()
+
+    raster = gdal.Open(tif_path)
+    band = raster.GetRasterBand(1)
+    ncols, nrows = raster.RasterXSize, raster.RasterYSize
+    x0, dx, rx, y0, ry, dy = raster.GetGeoTransform()
+
+    if((rx != 0) or (ry != 0) or (not math.isclose(dx, -dy, rel_tol=1e-9))):
+        raise ValueError("GridFloat needs square, north-up cells: " + tif_path)
+
+    nodata = band.GetNoDataValue()
+    stem = os.path.splitext(flt_path)[0]
+
+    tmp = flt_path + ".{0}.tmp".format(os.getpid())
+    with open(tmp, "wb") as f:
+        for r0 in range(0, nrows, block_rows):
+            band.ReadAsArray(0, r0, ncols, min(block_rows, nrows - r0)).astype("<f4").tofile(f)
+    os.replace(tmp, flt_path)
+
+    with open(stem + ".hdr", "w") as hdr:
+        hdr.write("ncols         {0:d}\n".format(ncols))
+        hdr.write("nrows         {0:d}\n".format(nrows))
+        hdr.write("xllcorner     {0!r}\n".format(x0))
+        hdr.write("yllcorner     {0!r}\n".format(y0 + nrows*dy))
+        hdr.write("cellsize      {0!r}\n".format(dx))
+        hdr.write("NODATA_value  {0!r}\n".format(elevation_nodata if nodata is None else nodata))
+        hdr.write("byteorder     LSBFIRST\n")
+
+    # (the ESRI flavor of well-known text, as ArcGIS writes beside a .flt)
+    srs = osr.SpatialReference(wkt=raster.GetProjection())
+    srs.MorphToESRI()
+    with open(stem + ".prj", "w") as prj:
+        prj.write(srs.ExportToWkt())
+
+    raster = None
+
+
+def build_elevation(alpha_code, study_area, project_dir, raster_folder, utm=False, cell_size=None,
+                    resampling="near", tile_pixels=1024, cache_dir=default_tile_cache, threads=1):
+
+    """
+    Clip and reproject a park's regional DEM to a study area, and save it as an NMSIM project's elevation.
+
+    Inputs
+    ------
+    alpha_code (str): standard NPS four-letter code for the park you are modelling
+    study_area (str, path, or tuple): the area to model, see `study_area_bounds`
+    project_dir (str, path): the NMSIM project directory (created if need be)
+    raster_folder (str, path): the folder holding the regional DEMs, see `DEM_selector`
+    utm (bool): save the elevation in NAD83 / UTM rather than NAD83 longitude/latitude [default False]
+    cell_size (float): [optional] cell size, in degrees (or meters with `utm`)
+                       [default: as GDAL would choose for the whole regional DEM, so every project
+                       of a park shares one grid of tiles]
+    resampling (str): the GDAL resampling method, e.g. "near", "bilinear" or "cubic" [default "near", as ArcGIS]
+    tile_pixels (int): cells on a side of each cached tile [default 1024]
+    cache_dir (str, path): the tile cache [default `default_tile_cache`]
+    threads (int): how many tiles are reprojected at once [default 1]
+
+    Returns
+    -------
+    elevation (dict): "flt" and "tif" (paths), "zone", "crs", "cell_size", "tiles" (how many cover the
+                      study area) and "tiles_built" (how many were not already in the cache)
+
+    """
+
+    gdal, ogr, osr = import_gdal()
+
+    make_NMSIM_project_dir(project_dir)
+    os.makedirs(cache_dir, exist_ok=True)
+
+    source_path = DEM_selector(alpha_code, raster_folder)
+
+    # NMSIM references a project to the UTM zone of the western edge of the study area
+    bounds, cutline = study_area_bounds(study_area)
+    zone = utm_zone(bounds[0])
+
+    crs = nad83_utm_crs(zone) if utm else NAD83
+
+    if(cell_size is None):
+        cell_size = output_cell_size(source_path, crs)
+
+    # ======= (1) every tile under the study area, from the cache if possible ================
+
+    target = transform_bounds(NAD83, crs, bounds)
+    fingerprint = source_fingerprint(source_path, cache_dir)
+
+    tiles = tile_grid(target, cell_size, tile_pixels)
+
+    def make(tile):
+        i, j, tile_bounds = tile
+        key = tile_key(fingerprint, crs, cell_size, tile_pixels, resampling, i, j)
+        return cached_tile(source_path, key, tile_bounds, crs, tile_pixels, resampling, cache_dir)
+
+    with ThreadPoolExecutor(max_workers=max(threads, 1)) as pool:
+        made = list(pool.map(make, tiles))
+
+    # ======= (2) a mosaic of the tiles, cut to the study area ================
+
+    elev_path = os.path.join(project_dir, "Input_Data", "01_ELEVATION", "elevation_nad83_utm" + str(zone))
+
+    # the study area's bounds, snapped outward to the cells of the tiles
+    xmin, ymin, xmax, ymax = target
+    snapped = (math.floor(xmin/cell_size)*cell_size, math.floor(ymin/cell_size)*cell_size,
+               math.ceil(xmax/cell_size)*cell_size, math.ceil(ymax/cell_size)*cell_size)
+
+    mosaic = gdal.BuildVRT("", [path for path, built in made])
+
+    tmp = elev_path + ".{0}.tmp.tif".format(os.getpid())
+    gdal.Warp(tmp, mosaic, format="GTiff", outputBounds=snapped, xRes=cell_size, yRes=cell_size,
+              cutlineDSName=cutline, srcNodata=elevation_nodata, dstNodata=elevation_nodata,
+              resampleAlg="near", creationOptions=tiff_options)
+    os.replace(tmp, elev_path + ".tif")
+
+    mosaic = None
+
+    # ======= (3) the GridFloat NMSIM reads ================
+
+    write_gridfloat(elev_path + ".tif", elev_path + ".flt")
+
+    return {"flt": elev_path + ".flt",
+            "tif": elev_path + ".tif",
+            "zone": zone,
+            "crs": crs,
+            "cell_size": cell_size,
+            "tiles": len(made),
+            "tiles_built": sum(built for path, built in made)}
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Build the elevation base layer of an NMSIM project (no ArcGIS needed).")
+    parser.add_argument("alpha_code", help="the park's four-letter code, e.g. DENA")
+    parser.add_argument("study_area", help="a vector file (e.g., a shapefile) of the area to model")
+    parser.add_argument("project_dir", help="the NMSIM project directory (created if need be)")
+    parser.add_argument("raster_folder", help="the folder holding the regional DEMs")
+    parser.add_argument("--utm", action="store_true", help="save the elevation in NAD83 / UTM rather than longitude/latitude")
+    parser.add_argument("--cell-size", type=float, default=None, help="cell size (degrees, or meters with --utm)")
+    parser.add_argument("--resampling", default="near", help="GDAL resampling method [default near]")
+    parser.add_argument("--cache-dir", default=default_tile_cache, help="the tile cache")
+    parser.add_argument("--threads", type=int, default=1, help="tiles reprojected at once")
+    args = parser.parse_args()
+
+    elevation = build_elevation(args.alpha_code, args.study_area, args.project_dir, args.raster_folder,
+                                utm=args.utm, cell_size=args.cell_size, resampling=args.resampling,
+                                cache_dir=args.cache_dir, threads=args.threads)
+
+    print("Saved", elevation["flt"], "(UTM zone {0:d}; {1:d} of {2:d} tiles reused from the cache)".format(
+          elevation["zone"], elevation["tiles"] - elevation["tiles_built"], elevation["tiles"]))
@@ -0,0 +1,389 @@
+#-----------------------------------------------------------------------------#
+# NMSIM_Batch.py
+#
+# NPS Natural Sounds Program
+#
+# This module runs the NMSIM command line program (`Nord2000batch.exe`)
+# for many jobs at once. Each job receives its own scratch folder holding
+# a private control file (.nms) and batch file (.txt), so that concurrent
+# solver processes can never overwrite one another's inputs.
+#
+# The solver command is configurable: on Linux (or for testing) any
+# stand-in program that accepts the path of a batch file can be used,
+# e.g. `NMSIM_Standin_Solver.py`.
+#
+# History:
+#	D. Halyn Betchkal -- Created
+#
+#-----------------------------------------------------------------------------#
+
+# ================ Import Libraries =======================
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+
+from NMSIM_Timing import record_duration, count
+from NMSIM_Manifest import load_manifest, save_manifest, job_fingerprint, is_up_to_date, record_output, output_path
+
+
+# ===========================  Define functions  =======================================
+
+def find_Nord2000batch(NMSIMpath=None):
+
+    '''
+    Return the solver command as a list suitable for `subprocess`.
+
+    Inputs
+    ------
+    NMSIMpath (str, path, or list): [optional] an alternate location of the program `Nord2000batch.exe`,
+                                    or a full command prefix such as [sys.executable, "NMSIM_Standin_Solver.py"]
+
+    Returns
+    -------
+    command (list): the solver command, to which the batch file path will be appended
+
+    '''
+
+    if(NMSIMpath is None):
+
+        # NMSIM is packaged right along with these scripts
+        # so by default we look for `Nord2000batch.exe` relative to this file
+        one_dir_up = os.path.dirname(os.path.abspath(__file__))
+
+        return [os.path.join(one_dir_up, "NMSIM", "Nord2000batch.exe")]
+
+    elif(isinstance(NMSIMpath, (list, tuple))):
+
+        return list(NMSIMpath)
+
+    elif(NMSIMpath.endswith(".py")):
+
+        # a Python stand-in is run with the current interpreter
+        return [sys.executable, NMSIMpath]
+
+    else:
+
+        return [NMSIMpath]
+
+
+def write_control_file(control_path, elev_file, site_file, trj_file, source_path,
+                       imped_file=None, contour_interval=500.0):
+
+    '''
+    Write an NMSIM control file (.nms). See Appendix G of the NMSIM manual.
+
+    Inputs
+    ------
+    control_path (str, path): where the control file will be written
+    elev_file (str, path): the elevation file (.flt)
+    site_file (str, path): the receiver site file (.sit)
+    trj_file (str, path): the trajectory file (.trj)
+    source_path (str, path): the noise source file (.src)
+    imped_file (str, path): [optional] the impedance file
+    contour_interval (float): contour interval in meters [default 500.0]
+
+    Returns
+    -------
+    None
+
+    '''
+
+    with open(control_path, 'w') as nms:
+
+        nms.write(elev_file+"\n") # elevation path
+
+        if(imped_file is not None):
+            nms.write(imped_file+"\n") # impedance path
+        else:
+            nms.write("-\n")
+
+        nms.write(site_file+"\n") # site path
+        nms.write(trj_file+"\n")
+        nms.write("-\n")
+        nms.write("-\n")
+        nms.write(source_path+"\n")
+        nms.write("{0:11.4f}   \n".format(contour_interval))
+        nms.write("-\n")
+        nms.write("-")
+
+
+def write_site_file(site_path, x, y, heights, names, elev_file):
+
+    '''
+    Write an NMSIM receiver site file (.sit) holding any number of receivers.
+
+    Inputs
+    ------
+    site_path (str, path): where the site file will be written
+    x (array): receiver eastings in the NMSIM project's UTM zone (m)
+    y (array): receiver northings (m)
+    heights (float or array): receiver heights above ground (m)
+    names (list of str): one name per receiver
+    elev_file (str, path): the project's elevation file (.flt)
+
+    Returns
+    -------
+    None
+
+    '''
+
+    x = np.atleast_1d(np.asarray(x, dtype="float64"))
+    y = np.atleast_1d(np.asarray(y, dtype="float64"))
+    heights = np.broadcast_to(np.asarray(heights, dtype="float64"), x.shape)
+
+    with open(site_path, 'w') as site_file:
+
+        site_file.write("    0\n")
+        site_file.write("{0:5d}\n".format(len(x)))
+        site_file.writelines("{0:19.0f}.{1:9.0f}.{2:10.5f} {3:20}\n".format(e, n, h, name)
+                             for e, n, h, name in zip(x, y, heights, names))
+        site_file.write(elev_file+"\n")
+
+
+def write_batch_file(batch_path, control_path, out_path, analysis="site", grid=None):
+
+    '''
+    Write an NMSIM batch file. See Appendix F of the NMSIM manual.
+
+    Inputs
+    ------
+    batch_path (str, path): where the batch file will be written
+    control_path (str, path): the control file (.nms) this batch file opens
+    out_path (str, path): the output file *without extension* (NMSIM appends .tis or .tig)
+    analysis (str): the NMSIM analysis keyword [default "site"]
+    grid (dict): [optional] for a "grid" analysis, the number of grid points ("ii_max", "jj_max")
+                 and the part of the grid to compute ("ii_left", "ii_right", "jj_bottom", "jj_top");
+                 see `NMSIM_Grid.grid_spec`
+
+    Returns
+    -------
+    None
+
+    '''
+
+    with open(batch_path, 'w') as batch:
+
+        batch.write("open\n")
+        batch.write(control_path+"\n")
+        batch.write(analysis+"\n")
+        batch.write(out_path+"\n")
+
+        # the resolution of the full grid, and the sub-grid this run computes
+        if(grid is not None):
+            batch.write("ii: {0:3d}\n".format(grid["ii_max"]))
+            batch.write("set:{0:4d}{1:4d}\n".format(grid["ii_left"], grid["ii_right"]))
+            batch.write("jj: {0:3d}\n".format(grid["jj_max"]))
+            batch.write("set:{0:4d}{1:4d}\n".format(grid["jj_bottom"], grid["jj_top"]))
+
+        batch.write("dbf: no\n")
+        batch.write("hrs: 0\n")
+        batch.write("min: 0\n")
+        batch.write("sec: 0.0")
+
+
+def parse_NMSIM_output(stdout):
+
+    '''
+    Split the raw console output of NMSIM into a list of non-empty lines.
+    '''
+
+    text = stdout.decode("utf-8", errors="replace") if isinstance(stdout, bytes) else stdout
+
+    return [s.strip() for s in text.splitlines() if s.strip() != '']
+
+
+def solver_job(name, out_path, elev_file, site_file, trj_file, source_path,
+               imped_file=None, contour_interval=500.0, analysis="site", grid=None):
+
+    '''
+    Describe a single NMSIM run as a dictionary for `run_solver_jobs`.
+
+    Inputs
+    ------
+    name (str): a unique name for the job (used to label its scratch folder)
+    out_path (str, path): the output file *without extension*
+    [all other arguments as for `write_control_file` and `write_batch_file`]
+
+    Returns
+    -------
+    job (dict)
+
+    '''
+
+    return {"name": name,
+            "out_path": out_path,
+            "analysis": analysis,
+            "elev_file": elev_file,
+            "site_file": site_file,
+            "trj_file": trj_file,
+            "source_path": source_path,
+            "imped_file": imped_file,
+            "contour_interval": contour_interval,
+            "grid": grid}
+
+
+def run_solver_job(job, command, timeout=None, retries=0, scratch_dir=None, keep_scratch=False):
+
+    '''
+    Run one job in an isolated scratch folder, retrying on failure.
+
+    A job fails if the solver cannot be started, exits with a non-zero code,
+    exceeds `timeout`, or finishes without producing its output file.
+
+    Inputs
+    ------
+    job (dict): as returned by `solver_job`
+    command (list): the solver command from `find_Nord2000batch`
+    timeout (float): [optional] seconds before an attempt is killed
+    retries (int): how many times to re-run a failed job [default 0]
+    scratch_dir (str, path): [optional] parent folder for scratch folders (defaults to the system temp folder)
+    keep_scratch (bool): keep the scratch folder even when the job succeeds [default False]
+
+    Returns
+    -------
+    record (dict): name, out_path, exit_code, timed_out, attempts, duration_s, ok, skipped, scratch, messages
+
+    '''
+
+    output = output_path(job)
+
+    # a private folder so concurrent jobs never share control or batch files
+    scratch = tempfile.mkdtemp(prefix=job["name"] + "_", dir=scratch_dir)
+    control_file = os.path.join(scratch, "control.nms")
+    batch_file = os.path.join(scratch, "batch.txt")
+
+    write_control_file(control_file, job["elev_file"], job["site_file"], job["trj_file"], job["source_path"],
+                       imped_file=job["imped_file"], contour_interval=job["contour_interval"])
+    write_batch_file(batch_file, control_file, job["out_path"], analysis=job["analysis"], grid=job.get("grid"))
+
+    t0 = time.perf_counter()
+    for attempt in range(1, retries + 2):
+
+        timed_out = False
+
+        # a stale output file would make a failed attempt look successful
+        if(os.path.exists(output)):
+            os.remove(output)
+
+        try:
+            process = subprocess.run(command + [batch_file], stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                     timeout=timeout)
+            exit_code = process.returncode
+            messages = parse_NMSIM_output(process.stdout)
+
+        except subprocess.TimeoutExpired as e:
+            timed_out = True
+            exit_code = None
+            messages = parse_NMSIM_output(e.stdout or b"")
+
+        except OSError as e:
+            # the solver could not be started at all (e.g., missing or not executable)
+            exit_code = None
+            messages = [str(e)]
+
+        ok = (exit_code == 0) and os.path.exists(output)
+
+        if(ok):
+            break
+
+    duration = time.perf_counter() - t0
+
+    if(ok and not keep_scratch):
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    return {"name": job["name"],
+            "out_path": output,
+            "exit_code": exit_code,
+            "timed_out": timed_out,
+            "attempts": attempt,
+            "duration_s": duration,
+            "ok": ok,
+            "skipped": False,
+            "scratch": None if (ok and not keep_scratch) else scratch,
+            "messages": messages}
+
+
+def run_solver_jobs(jobs, NMSIMpath=None, processes=None, timeout=None, retries=0, scratch_dir=None, keep_scratch=False,
+                    manifest=None, force=False):
+
+    '''
+    Run many NMSIM jobs concurrently.
+
+    Each job is an independent solver process; a pool of threads launches
+    and waits on them, so at most `processes` solvers run at once.
+
+    With a `manifest`, a job is skipped when its output already exists and
+    was built from identical inputs (see `NMSIM_Manifest`); each successful
+    run is recorded as soon as it finishes.
+
+    Inputs
+    ------
+    jobs (list of dict): as returned by `solver_job`
+    NMSIMpath (str, path, or list): [optional] the solver command, see `find_Nord2000batch`
+    processes (int): the number of solvers to run at once [default: the number of CPUs]
+    timeout (float): [optional] seconds before an attempt is killed
+    retries (int): how many times to re-run a failed job [default 0]
+    scratch_dir (str, path): [optional] parent folder for per-job scratch folders
+    keep_scratch (bool): keep scratch folders of successful jobs [default False]
+    manifest (str, path): [optional] a build manifest (.json) used to skip up-to-date jobs
+    force (bool): run every job, even those the manifest says are up to date [default False]
+
+    Returns
+    -------
+    results (pandas DataFrame): one row per job, in the order given
+
+    '''
+
+    command = find_Nord2000batch(NMSIMpath)
+
+    if(processes is None):
+        processes = os.cpu_count() or 1
+
+    if(scratch_dir is not None):
+        os.makedirs(scratch_dir, exist_ok=True)
+
+    # fingerprint every job's inputs up front (each distinct input file is hashed once)
+    if(manifest is not None):
+        built = load_manifest(manifest)
+        fingerprints = [job_fingerprint(job, built) for job in jobs]
+    else:
+        fingerprints = [None for job in jobs]
+
+    lock = threading.Lock()
+
+    def run(job, fingerprint):
+
+        if((fingerprint is not None) and (not force) and is_up_to_date(job, built, fingerprint=fingerprint)):
+
+            return {"name": job["name"], "out_path": output_path(job), "exit_code": None, "timed_out": False,
+                    "attempts": 0, "duration_s": 0.0, "ok": True, "skipped": True, "scratch": None,
+                    "messages": ["up to date"]}
+
+        record = run_solver_job(job, command, timeout=timeout, retries=retries,
+                                scratch_dir=scratch_dir, keep_scratch=keep_scratch)
+
+        record_duration("solve", record["duration_s"], ok=record["ok"], job=job["name"], attempts=record["attempts"])
+        count("solver_runs")
+        if(record["ok"]):
+            count("bytes_written", os.path.getsize(record["out_path"]))
+
+        if(record["ok"] and (fingerprint is not None)):
+            with lock:
+                record_output(job, fingerprint, built)
+                save_manifest(built, manifest)
+
+        return record
+
+    with ThreadPoolExecutor(max_workers=processes) as pool:
+        records = list(pool.map(run, jobs, fingerprints))
+
+    return pd.DataFrame(records, columns=["name", "out_path", "exit_code", "timed_out", "attempts",
+                                          "duration_s", "ok", "skipped", "scratch", "messages"])
@@ -0,0 +1,449 @@
+#-----------------------------------------------------------------------------#
+# NMSIM_Benchmarks.py
+#
+# NPS Natural Sounds Program
+#
+# Timing comparisons between the original (row-by-row) implementations
+# used in the notebooks and the array-based replacements in this repository.
+# All inputs are synthetic, so these run anywhere - no NMSIM project,
+# database connection, or acoustic archive is required.
+#
+# Usage:
+#	python NMSIM_Benchmarks.py
+#
+# History:
+#	D. Halyn Betchkal -- Created
+#
+#-----------------------------------------------------------------------------#
+
+# ================ Import Libraries =======================
+
+import os
+import re
+import sys
+import time
+import importlib
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import tempfile
+from itertools import islice
+import numpy as np
+import pandas as pd
+
+from NMSIM_Trajectories import densify_trajectory, closest_approaches, write_trajectory, read_trajectory
+from NMSIM_Results import read_tis, iter_tis, columns, tig_columns
+from NMSIM_Metrics import grid_metrics
+from NMSIM_Standin_Solver import synthetic_levels, write_site_block
+
+
+# ===========================  Define functions  =======================================
+
+def timed(function, *args, repeat=3, **kwargs):
+
+    """
+    Return the best wall-clock time (in seconds) of several calls to `function`.
+    """
+
+    best = np.inf
+    for r in range(repeat):
+
+        t0 = time.perf_counter()
+        function(*args, **kwargs)
+        best = min(best, time.perf_counter() - t0)
+
+    return best
+
+
+def synthetic_flight(n_points=2000, mean_gap_s=8.0, seed=0):
+
+    """
+    A random-walk flight with irregular GPS fix spacing, as a `pandas` DataFrame
+    with the same column names `tracks_within` uses.
+    """
+
+    rng = np.random.default_rng(seed)
+
+    t = np.cumsum(rng.uniform(0.5, 2*mean_gap_s, n_points))
+    t -= t[0]
+
+    data = pd.DataFrame({"time_elapsed": t,
+                         "long_UTM": 400000 + np.cumsum(rng.normal(0, 50, n_points)),
+                         "lat_UTM": 7000000 + np.cumsum(rng.normal(0, 50, n_points)),
+                         "altitude_ft": 3000 + np.cumsum(rng.normal(0, 10, n_points)),
+                         "heading": rng.uniform(0, 360, n_points),
+                         "knots": rng.uniform(80, 120, n_points),
+                         "ClimbAngle": rng.normal(0, 2, n_points)})
+
+    return data
+
+
+def legacy_interpolate_heading(start_heading, end_heading, num_points):
+
+    """
+    A copy of `interpolate_heading` from `NMSIM_DENA_Flight_Tracks`
+    (importing that module requires network shares to be reachable).
+    """
+
+    if(np.abs(end_heading - start_heading) > 180):
+
+        headings = np.linspace(np.maximum(start_heading, end_heading), np.minimum(start_heading, end_heading) + 360, num_points)%360
+
+        if(headings[0] != start_heading):
+            headings = headings[::-1]
+
+        return headings
+
+    else:
+        return np.linspace(start_heading, end_heading, num_points)
+
+
+def legacy_densify(data):
+
+    """
+    A faithful replica of the per-row densification loop formerly in `tracks_within`
+    (without `shapely` geometry, so it *understates* the original cost).
+    `GeoDataFrame.append` was removed from `pandas`, so `pd.concat` stands in for it.
+    """
+
+    new_points = pd.DataFrame([])
+    for row in data.itertuples():
+
+        try:
+            next_ind = data.index[np.argwhere(data.index == row.Index)+1][0][0]
+
+            interpSteps = int(1.1*(data.loc[next_ind, "time_elapsed"] - row.time_elapsed))
+
+            d = {"time_elapsed": np.linspace(row.time_elapsed, data.loc[next_ind, "time_elapsed"], interpSteps)[1:-1],
+                 "long_UTM": np.linspace(row.long_UTM, data.loc[next_ind, "long_UTM"], interpSteps)[1:-1],
+                 "lat_UTM": np.linspace(row.lat_UTM, data.loc[next_ind, "lat_UTM"], interpSteps)[1:-1],
+                 "altitude_ft": np.linspace(row.altitude_ft, data.loc[next_ind, "altitude_ft"], interpSteps)[1:-1],
+                 "ClimbAngle": np.linspace(row.ClimbAngle, data.loc[next_ind, "ClimbAngle"], interpSteps)[1:-1],
+                 "heading": legacy_interpolate_heading(row.heading, data.loc[next_ind, "heading"], interpSteps)[1:-1],
+                 "knots": np.linspace(row.knots, data.loc[next_ind, "knots"], interpSteps)[1:-1]}
+
+            new_points = pd.concat([new_points,
+                                    pd.DataFrame(d, index=np.linspace(row.Index, next_ind, interpSteps)[1:-1])])
+
+        except IndexError:
+            pass
+
+    return pd.concat([data, new_points]).sort_index()
+
+
+def benchmark_densify(n_points=2000):
+
+    """
+    Densification of one long flight: the legacy loop vs. `densify_trajectory`.
+    """
+
+    data = synthetic_flight(n_points)
+
+    def vectorized():
+        densify_trajectory(data["time_elapsed"].values, data["long_UTM"].values, data["lat_UTM"].values,
+                           0.3048*data["altitude_ft"].values, data["heading"].values, data["knots"].values,
+                           extra={"ClimbAngle": data["ClimbAngle"].values})
+
+    legacy = timed(legacy_densify, data, repeat=1)
+    fast = timed(vectorized)
+
+    print("densify {0:d} fixes: legacy loop {1:.3f} s, vectorized {2:.4f} s ({3:.0f}x)".format(n_points, legacy, fast, legacy/fast))
+
+
+def legacy_trj_write(trj_path, dense):
+
+    """
+    A replica of the row-by-row data section formerly written by `tracks_within`.
+    """
+
+    with open(trj_path, 'w') as trajectory:
+
+        for ind, point in dense.iterrows():
+
+            trajectory.write("{0:15.3f}".format(point["time_elapsed"]) + \
+                             "{0:15.3f}".format(point["x"]) + \
+                             "{0:15.3f}".format(point["y"]) + \
+                             "{0:15.3f}".format(point["z"]) + \
+                             "{0:15.3f}".format(point["heading"]) + \
+                             "{0:15.3f}".format(point["ClimbAngle"]) + \
+                             "{0:15.3f}".format(point["speed"]) + \
+                             "{0:15.3f}".format(95) + \
+                             "{0:15.3f}".format(0) + "\n")
+
+
+def benchmark_trj_writer(n_points=2000):
+
+    """
+    Writing one densified flight: the legacy iterrows loop vs. `write_trajectory`, and reading it back.
+    """
+
+    data = synthetic_flight(n_points)
+    dense = densify_trajectory(data["time_elapsed"].values, data["long_UTM"].values, data["lat_UTM"].values,
+                               0.3048*data["altitude_ft"].values, data["heading"].values, data["knots"].values,
+                               extra={"ClimbAngle": data["ClimbAngle"].values})
+
+    with tempfile.TemporaryDirectory() as scratch:
+
+        trj_path = os.path.join(scratch, "synthetic.trj")
+
+        legacy = timed(legacy_trj_write, trj_path, dense, repeat=1)
+        bulk = timed(write_trajectory, trj_path, dense["time_elapsed"].values, dense["x"].values, dense["y"].values,
+                     dense["z"].values, dense["heading"].values, dense["ClimbAngle"].values, dense["speed"].values,
+                     zone=6, title="SYNTHETIC")
+        read = timed(read_trajectory, trj_path)
+
+    print("write {0:d}-point .trj: legacy {1:.2f} s, write_trajectory {2:.3f} s ({3:.0f}x); read_trajectory {4:.3f} s".format(
+          len(dense), legacy, bulk, legacy/bulk, read))
+
+
+def synthetic_tis(tis_path, hours=6, seed=0):
+
+    """
+    Write a synthetic one-receiver .tis with one time step per second.
+    """
+
+    rng = np.random.default_rng(seed)
+
+    n = int(3600*hours)
+    times = np.arange(n, dtype="float")
+    distance = np.abs(np.cumsum(rng.normal(0, 30, n))) + 500
+
+    with open(tis_path, 'w') as out:
+
+        out.write(" synthetic.tis\n")
+        out.write("---End File Header---\n")
+        write_site_block(out, "SYNTH", 0, 0, times, synthetic_levels(distance))
+
+
+def legacy_tis_parse(tis_path):
+
+    """
+    A replica of the parsing formerly done by `tis_resampler` (before resampling).
+    """
+
+    with open(tis_path) as f:
+        content = list(islice(f, 18 + (3600*24)))
+
+    splitBegin = content.index('---End File Header---\n')
+
+    # (the '---End of This Data Section---' line is sliced off rather than dropped after parsing)
+    spectral_data = [re.split(r'\s+',c) for c in content[splitBegin+10:-1]]
+    spectral_data = [d[1:-2] for d in spectral_data]
+
+    tis = pd.DataFrame(spectral_data, columns=columns[:-1], dtype='float')
+
+    tis["TIME"] = tis["TIME"].astype('float')
+    tis["SP#"] = tis["SP#"].astype('float').apply(lambda f: int(f))
+    tis["F"] = tis["F"].astype('int')
+    tis.loc[:,'A':'12500'] *= 0.1
+
+    return tis
+
+
+def benchmark_tis_reader(hours=6):
+
+    """
+    Parsing a multi-hour .tis: the legacy regex/pandas path vs. `read_tis` and `iter_tis`.
+    """
+
+    with tempfile.TemporaryDirectory() as scratch:
+
+        tis_path = os.path.join(scratch, "synthetic.tis")
+        synthetic_tis(tis_path, hours=hours)
+        size_MB = os.path.getsize(tis_path)/1e6
+
+        def stream():
+            for chunk in iter_tis(tis_path):
+                chunk.max(axis=0)
+
+        legacy = timed(legacy_tis_parse, tis_path, repeat=1)
+        bulk = timed(read_tis, tis_path)
+        chunked = timed(stream)
+
+    print("parse {0:.0f} h .tis ({1:.0f} MB): legacy {2:.2f} s, read_tis {3:.2f} s ({4:.0f} MB/s), iter_tis {5:.2f} s".format(
+          hours, size_MB, legacy, bulk, size_MB/bulk, chunked))
+
+
+def synthetic_grid(n_sites=14400, n_steps=120, seed=0):
+
+    """
+    A synthetic (site, time step, column) array, as `read_tig` returns, for a flight over a grid.
+    """
+
+    rng = np.random.default_rng(seed)
+
+    distance = rng.uniform(200, 20000, n_sites)[:, np.newaxis] + 30*np.arange(n_steps)[np.newaxis, :]
+    levels = synthetic_levels(distance.ravel()).reshape(n_sites, n_steps, -1)[:, :, :-1]*0.1
+
+    grid = np.empty((n_sites, n_steps, len(tig_columns)), dtype="float32")
+    grid[:, :, 0] = np.arange(n_steps) + rng.uniform(0, 0.05, (n_sites, n_steps))
+    grid[:, :, 1:-1] = levels
+    grid[:, :, -1] = 0
+
+    return grid
+
+
+def legacy_metrics(grid):
+
+    """
+    A replica of the notebook's metrics (LA50, LT90, time above 35 dBA, SEL), each walking the data its own way.
+    """
+
+    LA = grid[:, :, 2].astype('float')
+    LA50 = np.nanpercentile(LA, 50, axis=1)
+
+    LT = 10*np.log10(np.power(10, grid[:, :, 4:25].astype('float')/10).sum(axis=2))
+    LT90 = np.nanpercentile(LT, 10, axis=1)
+
+    durations = np.diff(grid[:, :, 0])
+    TA35 = np.array([np.sum(d[b]) for d, b in zip(durations, (LA >= 35)[:, :-1])])
+
+    SEL = 10*np.log10(np.sum(durations*np.power(10, LA[:, :-1]/10), axis=1))
+
+    return LA50, LT90, TA35, SEL
+
+
+def benchmark_metrics(n_sites=14400, n_steps=120):
+
+    """
+    Four metrics over a receiver grid: the notebook's functions vs. one `grid_metrics` sweep.
+    """
+
+    grid = synthetic_grid(n_sites, n_steps)
+
+    legacy = timed(legacy_metrics, grid, repeat=1)
+    sweep = timed(grid_metrics, grid, ["LA50", "LT90", "TA35", "SEL"], repeat=1)
+
+    print("metrics for {0:d} sites x {1:d} steps: legacy {2:.2f} s, grid_metrics {3:.2f} s ({4:.1f}x)".format(
+          n_sites, n_steps, legacy, sweep, legacy/sweep))
+
+
+def synthetic_season(n_flights=1500, points_per_flight=400, seed=0):
+
+    """
+    A season of GPS points: one row per point with the columns `tracks_within` uses.
+    """
+
+    rng = np.random.default_rng(seed)
+
+    n = n_flights*points_per_flight
+    flight_id = np.repeat(np.arange(n_flights), points_per_flight)
+    start = np.repeat(pd.Timestamp("2019-05-01") + pd.to_timedelta(rng.uniform(0, 120*86400, n_flights), unit="s"),
+                      points_per_flight)
+
+    return pd.DataFrame({"flight_id": flight_id,
+                         "id": flight_id,
+                         "ak_datetime": start + pd.to_timedelta(np.tile(np.arange(points_per_flight)*8.0, n_flights), unit="s"),
+                         "long_UTM": 400000 + np.cumsum(rng.normal(0, 80, n)),
+                         "lat_UTM": 7000000 + np.cumsum(rng.normal(0, 80, n))})
+
+
+def legacy_closest_approaches(tracks, site_x, site_y):
+
+    """
+    A replica of the closest-approach bookkeeping formerly done inside `tracks_within`.
+    """
+
+    approaches = pd.DataFrame([], index=np.unique(tracks["id"]), columns=["closest_distance", "closest_time"])
+
+    for f_id, data in tracks.groupby("flight_id"):
+
+        site_coords = np.array([site_x, site_y])
+        GPSpoints_xy = np.array([data["long_UTM"], data["lat_UTM"]])
+
+        approaches.loc[f_id, "closest_distance"] = np.min(np.linalg.norm(site_coords - GPSpoints_xy.T, axis=1))/1000
+        approaches.loc[f_id, "closest_time"] = data.iloc[np.argmin(np.linalg.norm(site_coords - GPSpoints_xy.T, axis=1))]['ak_datetime']
+
+    for track_id, flight in approaches.iterrows():
+
+        tracks.loc[tracks["flight_id"] == track_id, "closest_time"] = flight["closest_time"]
+        tracks.loc[tracks["flight_id"] == track_id, "closest_distance"] = flight["closest_distance"]
+
+    return tracks
+
+
+def vectorized_closest_approaches(tracks, site_x, site_y):
+
+    """
+    The same result via `closest_approaches` and a single merge.
+    """
+
+    approaches = closest_approaches(tracks["flight_id"].values, tracks["ak_datetime"].values,
+                                    tracks["long_UTM"].values, tracks["lat_UTM"].values, site_x, site_y)
+
+    return tracks.merge(approaches[["closest_time", "closest_distance"]], left_on="flight_id", right_index=True, how="left")
+
+
+def benchmark_closest_approaches(n_flights=1500):
+
+    """
+    Closest approach of a season of flights: the legacy per-flight loop vs. grouped reductions.
+    """
+
+    tracks = synthetic_season(n_flights)
+
+    legacy = timed(legacy_closest_approaches, tracks.copy(), 400000, 7000000, repeat=1)
+    fast = timed(vectorized_closest_approaches, tracks, 400000, 7000000)
+
+    print("closest approach of {0:d} flights ({1:d} points): legacy {2:.2f} s, vectorized {3:.3f} s ({4:.0f}x)".format(
+          n_flights, len(tracks), legacy, fast, legacy/fast))
+
+
+def import_time(module, repeat=3):
+
+    """
+    Seconds to import a module in a fresh interpreter (beyond starting the interpreter itself).
+    """
+
+    here = os.path.dirname(os.path.abspath(__file__))
+
+    def run(code):
+        began = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], cwd=here, check=True)
+        return time.perf_counter() - began
+
+    baseline = min(run("pass") for r in range(repeat))
+
+    return min(run("import " + module) for r in range(repeat)) - baseline
+
+
+def pool_startup_time(module, processes=2):
+
+    """
+    Seconds for a pool of freshly spawned worker processes to import a module and answer.
+    """
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    if(here not in sys.path):
+        sys.path.insert(0, here)
+
+    began = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=importlib.import_module, initargs=(module,)) as pool:
+        for future in [pool.submit(os.getpid) for p in range(processes)]:
+            future.result()
+
+    return time.perf_counter() - began
+
+
+def benchmark_imports(modules=("NMSIM_Results", "NMSIM_Metrics", "NMSIM_NVSPL", "NMSIM_DENA_Flight_Tracks")):
+
+    """
+    How long importing each module takes, and how long a spawned worker pool takes to be ready with it.
+    (The DENA module defers plotting, geoprocessing and network connections to first use.)
+    """
+
+    for module in modules:
+        print("import {0}: {1:.3f} s; spawn a 2-process pool using it: {2:.2f} s".format(
+              module, import_time(module), pool_startup_time(module)))
+
+
+if __name__ == "__main__":
+
+    benchmark_densify()
+    benchmark_trj_writer()
+    benchmark_tis_reader()
+    benchmark_metrics()
+    benchmark_closest_approaches()
+    benchmark_imports()
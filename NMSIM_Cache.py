@@ -0,0 +1,280 @@
+#-----------------------------------------------------------------------------#
+# NMSIM_Cache.py
+#
+# NPS Natural Sounds Program
+#
+# A small on-disk cache for parsed NMSIM outputs. The first time a .tis or
+# .tig is read, the parsed array is saved as a `.npy` file (with a `.json`
+# sidecar for its header or index) in a cache folder beside the output.
+# Every later read is a memory map of that file instead of a text parse.
+#
+# Entries are keyed on the source file's path, size and modification time
+# (or, optionally, a hash of its content), so a re-run of NMSIM invalidates
+# them automatically. The least recently used entries are evicted whenever
+# the cache grows past its disk budget.
+#
+# History:
+#	D. Halyn Betchkal -- Created
+#
+#-----------------------------------------------------------------------------#
+
+# ================ Import Libraries =======================
+
+import os
+import json
+import glob
+import hashlib
+import threading
+import numpy as np
+import pandas as pd
+
+from NMSIM_Results import read_tis, read_tig, split_tis
+
+
+# the default disk budget of a cache folder (bytes)
+default_max_bytes = 10e9
+
+
+# ===========================  Define functions  =======================================
+
+def default_cache_dir(source_path):
+
+    """
+    The cache folder for an output file: a subfolder next to it (e.g., inside TIG_TIS).
+    """
+
+    return os.path.join(os.path.dirname(os.path.abspath(source_path)), "NMSIM_cache")
+
+
+def file_hash(path, block_size=2**24):
+
+    """
+    SHA-1 of a file's content, read in blocks.
+    """
+
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+
+    return h.hexdigest()
+
+
+def cache_key(source_path, kind, use_hash=False, **params):
+
+    """
+    Identify a parsed result by its source file and the parameters used to parse it.
+
+    Inputs
+    ------
+    source_path (str, path): the NMSIM output file
+    kind (str): what was read, e.g. "tis" or "tig"
+    use_hash (bool): key on a hash of the file's content rather than its size and
+                     modification time (slower, but robust to copies that reset mtime) [default False]
+    params: any parse options that change the result (e.g., dtype, nodata)
+
+    Returns
+    -------
+    key (str): a hexadecimal digest
+
+    """
+
+    stat = os.stat(source_path)
+
+    if(use_hash):
+        identity = [file_hash(source_path)]
+    else:
+        identity = [os.path.abspath(source_path), stat.st_size, stat.st_mtime_ns]
+
+    description = json.dumps([kind] + identity + sorted([k, str(v)] for k, v in params.items()))
+
+    return hashlib.sha1(description.encode("utf-8")).hexdigest()
+
+
+def touch(paths):
+
+    """
+    Mark cache entries as recently used.
+    """
+
+    for p in paths:
+        os.utime(p, None)
+
+
+def evict(cache_dir, max_bytes=default_max_bytes, keep=[]):
+
+    """
+    Delete the least recently used cache entries until the folder fits within `max_bytes`.
+
+    Inputs
+    ------
+    cache_dir (str, path): a cache folder
+    max_bytes (float): the disk budget in bytes
+    keep (list): keys which must not be evicted (e.g., an entry about to be returned)
+
+    Returns
+    -------
+    evicted (list): the keys of the deleted entries
+
+    """
+
+    entries = []
+    for meta in glob.glob(os.path.join(cache_dir, "*.json")):
+
+        key = os.path.basename(meta)[:-5]
+
+        # an entry still being written (see `cached`) is not an entry yet
+        if(key.endswith(".tmp")):
+            continue
+
+        files = [p for p in [meta, os.path.join(cache_dir, key + ".npy")] if os.path.exists(p)]
+
+        try:
+            entries.append((os.path.getmtime(meta), key, files, sum(os.path.getsize(p) for p in files)))
+        except OSError:
+            pass # evicted meanwhile by another process
+
+    # oldest first
+    entries.sort()
+
+    total = sum(e[3] for e in entries)
+
+    evicted = []
+    for last_used, key, files, size in entries:
+
+        if(total <= max_bytes):
+            break
+
+        if(key in keep):
+            continue
+
+        for p in files:
+            try:
+                os.remove(p)
+            except OSError:
+                pass # an entry another process is using (or already removed)
+
+        total -= size
+        evicted.append(key)
+
+    return evicted
+
+
+def cached(source_path, kind, parse, cache_dir=None, max_bytes=default_max_bytes, use_hash=False, **params):
+
+    """
+    Return a cached (metadata, memory-mapped array) pair, parsing and storing it on a miss.
+
+    Inputs
+    ------
+    source_path (str, path): the NMSIM output file
+    kind (str): what is read, e.g. "tis" or "tig"
+    parse (function): called as parse(npy_path) on a miss; must write the array
+                      to `npy_path` and return JSON-serializable metadata
+    cache_dir (str, path): [optional] defaults to `default_cache_dir(source_path)`
+    max_bytes (float): the disk budget of the cache folder [default 10 GB]
+    use_hash (bool): key on file content rather than size and modification time [default False]
+    params: parse options that are part of the key
+
+    Returns
+    -------
+    meta (object): the metadata returned by `parse`
+    levels (numpy memmap): the parsed array, read-only
+
+    """
+
+    if(cache_dir is None):
+        cache_dir = default_cache_dir(source_path)
+
+    os.makedirs(cache_dir, exist_ok=True)
+
+    key = cache_key(source_path, kind, use_hash=use_hash, **params)
+    npy_path = os.path.join(cache_dir, key + ".npy")
+    meta_path = os.path.join(cache_dir, key + ".json")
+
+    if(os.path.exists(meta_path) and os.path.exists(npy_path)):
+
+        touch([meta_path, npy_path])
+
+        with open(meta_path) as f:
+            meta = json.load(f)
+
+    else:
+
+        # write under temporary names, then rename, so that a concurrent
+        # reader can never see a half-written entry (the names are unique to
+        # this process and thread, and `evict` leaves them alone)
+        tmp = "{0}.{1}.{2}.tmp".format(key, os.getpid(), threading.get_ident())
+        tmp_npy = os.path.join(cache_dir, tmp + ".npy")
+        tmp_meta = os.path.join(cache_dir, tmp + ".json")
+
+        meta = parse(tmp_npy)
+        with open(tmp_meta, "w") as f:
+            json.dump(meta, f)
+
+        os.replace(tmp_npy, npy_path)
+        os.replace(tmp_meta, meta_path)
+
+        evict(cache_dir, max_bytes=max_bytes, keep=[key])
+
+    return meta, np.load(npy_path, mmap_mode="r")
+
+
+def cached_tis(tis_path, dtype="float32", nodata=-99.9, cache_dir=None, max_bytes=default_max_bytes, use_hash=False):
+
+    """
+    `read_tis` through the cache. Arguments and returns are as for `NMSIM_Results.read_tis`,
+    plus the cache options of `cached`; the levels are a read-only memory map.
+    """
+
+    def parse(npy_path):
+
+        header, levels = read_tis(tis_path, dtype=dtype, nodata=nodata)
+        np.save(npy_path, levels)
+
+        return header
+
+    return cached(tis_path, "tis", parse, cache_dir=cache_dir, max_bytes=max_bytes, use_hash=use_hash,
+                  dtype=dtype, nodata=nodata)
+
+
+def cached_tis_site(tis_path, site, dtype="float32", nodata=-99.9, cache_dir=None, max_bytes=default_max_bytes, use_hash=False):
+
+    """
+    One receiver of a multi-receiver .tis (see `NMSIM_Results.split_tis`) through the cache.
+    Returns that receiver's row of the index (as a dict) and its levels, a read-only memory map.
+    """
+
+    def parse(npy_path):
+
+        index, levels = split_tis(tis_path, sites=[site], dtype=dtype, nodata=nodata)
+        if(site not in levels):
+            raise ValueError("No receiver " + str(site) + " in " + str(tis_path))
+
+        np.save(npy_path, levels[site])
+
+        return {k: (v.item() if hasattr(v, "item") else v) for k, v in index.iloc[0].items()}
+
+    return cached(tis_path, "tis", parse, cache_dir=cache_dir, max_bytes=max_bytes, use_hash=use_hash,
+                  dtype=dtype, nodata=nodata, site=site)
+
+
+def cached_tig(tig_path, dtype="float32", nodata=np.nan, cache_dir=None, max_bytes=default_max_bytes, use_hash=False):
+
+    """
+    `read_tig` through the cache. Arguments and returns are as for `NMSIM_Results.read_tig`,
+    plus the cache options of `cached`; the levels are a read-only memory map.
+    """
+
+    def parse(npy_path):
+
+        # the grid is decoded straight into the cache file, so it need not fit in memory
+        index, levels = read_tig(tig_path, out=npy_path, dtype=dtype, nodata=nodata)
+        del levels
+
+        return index.to_dict(orient="list")
+
+    index, levels = cached(tig_path, "tig", parse, cache_dir=cache_dir, max_bytes=max_bytes, use_hash=use_hash,
+                           dtype=dtype, nodata=nodata)
+
+    return pd.DataFrame(index), levels
@@ -0,0 +1,285 @@
+#-----------------------------------------------------------------------------#
+# NMSIM_Compare.py
+#
+# NPS Natural Sounds Program
+#
+# Numeric comparison of modelled events (NMSIM .tis, resampled to one second
+# by `tis_resampler`) with the acoustic record (NVSPL, see `NMSIM_NVSPL.py`).
+#
+# For each event the model and measurement are put on the measurement's
+# one-second time axis, and every statistic is computed for all 1/3rd octave
+# bands at once (plus the A-weighted sum of those bands, labelled "A"):
+#
+#	lag_s            the lag (s) maximizing the cross-correlation of model and
+#	                 measured energy (FFT based); positive: the measurement is later
+#	model_SEL,       sound exposure level over the seconds the model predicts sound
+#	measured_SEL
+#	model_Lmax,      the greatest one-second level over those seconds
+#	measured_Lmax
+#	SEL_error,       model minus measurement (dB)
+#	Lmax_error
+#	mean_difference, the mean and root-mean-square of the one-second differences
+#	rms_difference
+#	n_seconds        how many seconds were compared
+#
+# By default the model is first shifted by the A-weighted lag, so statistics
+# describe levels rather than timing; the timing error is the "A" row's lag.
+#
+# Many events are compared in parallel by `compare_events`, which returns a
+# single tidy table: one row per event and band.
+#
+# History:
+#	D. Halyn Betchkal -- Created
+#
+#-----------------------------------------------------------------------------#
+
+# ================ Import Libraries =======================
+
+import os
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+from NMSIM_Results import bands
+from NMSIM_Metrics import energy, A_weights, silent
+from NMSIM_Timing import timed, count
+
+
+# the columns of a comparison table
+comparison_columns = ["event", "band", "lag_s", "model_SEL", "measured_SEL", "SEL_error",
+                      "model_Lmax", "measured_Lmax", "Lmax_error", "mean_difference", "rms_difference", "n_seconds"]
+
+
+# ===========================  Define functions  =======================================
+
+def event_arrays(model, measured):
+
+    """
+    Put a model and a measurement on the measurement's time axis, keeping the bands they share.
+
+    Inputs
+    ------
+    model (pandas DataFrame): model levels indexed by (local) time, see `tis_resampler`
+    measured (pandas DataFrame): measured levels indexed by (local) time, see `NMSIM_NVSPL.nvspl_window`
+
+    Returns
+    -------
+    labels (list of str): the shared bands, low to high
+    model_levels (numpy array): time x band; NaN where the model has no value
+    measured_levels (numpy array): time x band
+
+    """
+
+    labels = [b for b in bands if (b in model.columns) and (b in measured.columns)]
+
+    model_levels = model[labels].reindex(measured.index).to_numpy(dtype="float64")
+    measured_levels = measured[labels].to_numpy(dtype="float64")
+
+    return labels, model_levels, measured_levels
+
+
+def a_weighted(levels, labels):
+
+    """
+    The A-weighted sum of one-third octave bands at each second: `silent` where no band
+    is above `silent`, NaN where every band is NaN.
+    """
+
+    weights = A_weights[[bands.index(b) for b in labels]].astype("float64")
+
+    with np.errstate(divide="ignore"):
+        total = 10*np.log10(energy(levels + weights).sum(axis=1))
+
+    with np.errstate(invalid="ignore"):
+        total[~np.any(levels > silent + 0.05, axis=1)] = silent
+    total[np.all(np.isnan(levels), axis=1)] = np.nan
+
+    return total
+
+
+def best_lags(model_levels, measured_levels, max_lag):
+
+    """
+    For every column at once, the lag (in samples) that best aligns a model with a measurement,
+    from the FFT cross-correlation of their (mean-removed) energies.
+
+    Inputs
+    ------
+    model_levels (numpy array): time x band, dB (NaN is no energy)
+    measured_levels (numpy array): time x band, dB
+    max_lag (int): the largest lag considered, either way
+
+    Returns
+    -------
+    lags (numpy array): one per column; positive when the measurement is later than the model,
+                        zero where there is nothing to correlate
+
+    """
+
+    a = energy(model_levels).astype("float64")
+    b = energy(measured_levels).astype("float64")
+
+    a = a - a.mean(axis=0)
+    b = b - b.mean(axis=0)
+
+    n = a.shape[0]
+    n_fft = 1 << int(np.ceil(np.log2(max(2*n, 2))))
+
+    # correlation[k] = sum over t of b[t + k] * a[t]
+    correlation = np.fft.irfft(np.fft.rfft(b, n_fft, axis=0)*np.conj(np.fft.rfft(a, n_fft, axis=0)), n_fft, axis=0)
+
+    max_lag = int(min(max_lag, n - 1))
+    candidates = np.arange(-max_lag, max_lag + 1)
+    scores = correlation[candidates % n_fft]
+
+    lags = candidates[np.argmax(scores, axis=0)]
+    lags[~(scores.max(axis=0) > 0)] = 0
+
+    return lags
+
+
+def shift(levels, lag):
+
+    """
+    Delay a time x band array by `lag` samples (advance it if negative), filling with NaN.
+    """
+
+    shifted = np.full(levels.shape, np.nan)
+
+    if(lag > 0):
+        shifted[lag:] = levels[:-lag]
+    elif(lag < 0):
+        shifted[:lag] = levels[-lag:]
+    else:
+        shifted[:] = levels
+
+    return shifted
+
+
+def level_statistics(model_levels, measured_levels):
+
+    """
+    SEL, Lmax and differences of one-second levels for every column at once, over the seconds
+    in which the model predicts sound (is above `silent`) and the measurement exists.
+
+    Returns
+    -------
+    statistics (dict): arrays, one value per column, keyed as `comparison_columns`
+
+    """
+
+    with np.errstate(invalid="ignore"):
+        valid = (model_levels > silent + 0.05) & ~np.isnan(measured_levels)
+    n = valid.sum(axis=0)
+    some = n > 0
+
+    def SEL(levels):
+        total = np.where(valid, energy(levels), 0.0).sum(axis=0)
+        with np.errstate(divide="ignore"):
+            return np.where(some, 10*np.log10(total), np.nan)
+
+    def Lmax(levels):
+        return np.where(some, np.where(valid, levels, -np.inf).max(axis=0), np.nan)
+
+    difference = np.where(valid, model_levels - measured_levels, 0.0)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean_difference = np.where(some, difference.sum(axis=0)/n, np.nan)
+        rms_difference = np.where(some, np.sqrt((difference**2).sum(axis=0)/n), np.nan)
+
+    statistics = {"model_SEL": SEL(model_levels),
+                  "measured_SEL": SEL(measured_levels),
+                  "model_Lmax": Lmax(model_levels),
+                  "measured_Lmax": Lmax(measured_levels),
+                  "mean_difference": mean_difference,
+                  "rms_difference": rms_difference,
+                  "n_seconds": n}
+
+    statistics["SEL_error"] = statistics["model_SEL"] - statistics["measured_SEL"]
+    statistics["Lmax_error"] = statistics["model_Lmax"] - statistics["measured_Lmax"]
+
+    return statistics
+
+
+def compare_event(event, max_lag_s=120, align=True):
+
+    """
+    Compare one modelled event with its measurement, for every band and the A-weighted sum.
+
+    Inputs
+    ------
+    event (dict): "event" (a name), "model" and "measured" (pandas DataFrames, see `event_arrays`)
+    max_lag_s (int): the largest lag (s) searched [default 120]
+    align (bool): shift the model by the A-weighted lag before computing levels [default True]
+
+    Returns
+    -------
+    comparison (pandas DataFrame): one row per band (and "A"), columns `comparison_columns`
+
+    """
+
+    labels, model_levels, measured_levels = event_arrays(event["model"], event["measured"])
+
+    # the A-weighted sum is compared exactly as another column
+    model_levels = np.column_stack([model_levels, a_weighted(model_levels, labels)])
+    measured_levels = np.column_stack([measured_levels, a_weighted(measured_levels, labels)])
+    labels = labels + ["A"]
+
+    lags = best_lags(model_levels, measured_levels, max_lag_s)
+
+    if(align):
+        model_levels = shift(model_levels, lags[-1])
+
+    comparison = pd.DataFrame(level_statistics(model_levels, measured_levels))
+    comparison.insert(0, "lag_s", lags)
+    comparison.insert(0, "band", labels)
+    comparison.insert(0, "event", event["event"])
+
+    return comparison[comparison_columns]
+
+
+def compare_events(events, processes=1, max_lag_s=120, align=True):
+
+    """
+    Compare many modelled events with their measurements, in parallel.
+
+    Inputs
+    ------
+    events (list of dict): see `compare_event`
+    processes (int): how many events are compared at once (in separate processes) [default 1]
+    max_lag_s (int): the largest lag (s) searched [default 120]
+    align (bool): shift each model by its A-weighted lag before computing levels [default True]
+
+    Returns
+    -------
+    comparison (pandas DataFrame): one tidy table, one row per event and band
+
+    """
+
+    compare = partial(compare_event, max_lag_s=max_lag_s, align=align)
+
+    with timed("compare", events=len(events), processes=processes):
+        if(processes > 1):
+            with ProcessPoolExecutor(max_workers=processes) as pool:
+                tables = list(pool.map(compare, events, chunksize=max(len(events)//(4*processes), 1)))
+        else:
+            tables = [compare(event) for event in events]
+
+    count("events_compared", len(events))
+
+    if(len(tables) == 0):
+        return pd.DataFrame(columns=comparison_columns)
+
+    return pd.concat(tables, ignore_index=True)
+
+
+def write_comparison(comparison, path):
+
+    """
+    Save a comparison table as .csv, atomically.
+    """
+
+    tmp = path + ".{0}.tmp".format(os.getpid())
+    comparison.to_csv(tmp, index=False)
+    os.replace(tmp, path)
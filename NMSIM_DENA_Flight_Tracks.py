@@ -23,69 +23,134 @@
 import sys
 import datetime as dt
 import os
-import re
 import glob
-import subprocess
 import numpy as np
 import warnings
 warnings.simplefilter(action='ignore', category=FutureWarning) # pandas has some verbose deprecation warnings
 import pandas as pd
-from functools import partial
 pd.options.display.float_format = '{:.5f}'.format
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
-from itertools import islice
 
-# geoprocessing libraries
-import fiona
-from fiona.crs import from_epsg
-import pyproj
-import geopandas as gpd
-from shapely.ops import transform
-from shapely.geometry import mapping, Point, Polygon
+# array-based tools from this repository (none of these load plotting or geoprocessing libraries)
+from NMSIM_Trajectories import densify_trajectory, write_trajectory, trim_window, closest_approaches as closest_approaches_to
+from NMSIM_Batch import solver_job, run_solver_jobs, write_site_file
+from NMSIM_Manifest import manifest_path
+from NMSIM_Results import read_tis, split_tis, columns as tis_columns
+from NMSIM_Cache import cached_tis, cached_tis_site
+from NMSIM_Elevation import elevation_zone, open_elevation, sample_elevation
+from NMSIM_Projections import to_utm, geodesic_buffers
+from NMSIM_NVSPL import open_nvspl_store, nvspl_window, coverage_index, coverage_fraction
+from NMSIM_Figures import comparison_job, draw_comparison, save_comparison
+from NMSIM_Timing import timed, timer, count
 
-# We also need two specialized NPS libaries: `iyore` and `soundDB` (which relies on `iyore` so is imported second)
-# we expect them in the same directory as this repository
-try:
-    sys.path.append(os.path.join(os.path.dirname(os.getcwd()), "iyore"))
-    import iyore
-    
-except ModuleNotFoundError:
-    print("Can't find library `iyore`, please clone the repository from https://github.com/nationalparkservice/iyore to",
-          os.path.dirname(os.getcwd()), "or install using pip")
+# `matplotlib`, `geopandas`, `shapely` and `pyproj` are imported by the functions that use them
+# so that importing this module (e.g., in a worker process that only reads .tis files) stays cheap
 
-try:
-    sys.path.append(os.path.join(os.path.dirname(os.getcwd()), "soundDB"))
-    from soundDB import *
 
-except ModuleNotFoundError:
-    print("Can't find library `soundDB`, please clone the repository from https://github.com/gjoseph92/soundDB to",
-          os.path.dirname(os.getcwd()))
+# ============ Set up a few paths and connections ===============
 
+# where the Denali data live; edit with `configure` *before* first use
+# (e.g., to work from a copy of the shares, or where the network is unreachable)
+config = {"RDS": r"\\inpdenards\overflights",                                       # DENA RDS computer
+          "Render": r"\\inpdenarender\E\Sound Data",                                # DENA Render computer
+          "metadata": r"\\inpdenafiles\sound\Complete_Metadata_AKR_2001-2021.txt",  # the site metadata sheet
+          "libraries": os.path.dirname(os.getcwd())}                                 # where `iyore` is cloned
 
-# ============ Set up a few paths and connections ===============
+# a local copy of every database query made so far (see `NMSIM_Track_Store.py`)
+default_track_store = os.path.join(os.path.expanduser("~"), "NMSIM_track_store")
 
-# DENA RDS computer
-RDS = r"\\inpdenards\overflights"
+# connections made so far (nothing is connected until a function needs it)
+connections = {}
 
-try:
-    sys.path.append(os.path.join(RDS, "scripts"))
-    from query_tracks import query_tracks, get_mask_wkt
-    
-except:
-    print("While importing `query_tracks` encountered an error.")
 
-# DENA Render computer (and an iyore dataset)
-Render = r"\\inpdenarender\E\Sound Data"
-archive = iyore.Dataset(Render)
+def configure(**settings):
+
+    """
+    Change the configuration (see `config`) and forget any connections already made.
+    """
+
+    unknown = set(settings) - set(config)
+    if(len(unknown) > 0):
+        raise KeyError("Unknown configuration: " + ", ".join(sorted(unknown)))
+
+    config.update(settings)
+    connections.clear()
+
+
+def get_archive():
+
+    """
+    The `iyore` Dataset of the acoustic archive on the DENA Render computer, opened on first use.
+    """
+
+    if("archive" not in connections):
+
+        # we need the specialized NPS library `iyore`, expected in the same directory as this repository
+        try:
+            sys.path.append(os.path.join(config["libraries"], "iyore"))
+            import iyore
+
+        except ModuleNotFoundError:
+            raise ModuleNotFoundError("Can't find library `iyore`, please clone the repository from " +
+                                      "https://github.com/nationalparkservice/iyore to " + config["libraries"] +
+                                      " or install using pip")
+
+        connections["archive"] = iyore.Dataset(config["Render"])
+
+    return connections["archive"]
+
+
+def get_query_tracks():
+
+    """
+    The `query_tracks` function of the Denali Overflights Database scripts (on the RDS computer), imported on first use.
+    """
+
+    if("query_tracks" not in connections):
+
+        sys.path.append(os.path.join(config["RDS"], "scripts"))
+        from query_tracks import query_tracks
+
+        connections["query_tracks"] = query_tracks
+
+    return connections["query_tracks"]
+
+
+def __getattr__(name):
+
+    """
+    The module's former globals, now made on first use: `archive`, `RDS` and `Render`.
+    """
+
+    if(name == "archive"):
+        return get_archive()
+
+    if(name in ["RDS", "Render"]):
+        return config[name]
+
+    raise AttributeError("module " + __name__ + " has no attribute " + name)
 
 
 # ===========================  Define functions  =======================================
 
+def project_elevation_file(project_dir):
+
+    """
+    The elevation file (.flt) of a canonical NMSIM project directory.
+    """
+
+    elev_files = glob.glob(project_dir + os.sep + r"Input_Data\01_ELEVATION\*.flt")
+
+    if(len(elev_files) == 0):
+        raise ValueError("No elevation file (.flt) in " + project_dir + os.sep + r"Input_Data\01_ELEVATION")
+
+    return elev_files[0]
+
+
 def get_utm_zone(project_dir):
     
     """
-    Glean the UTM zone that was saved as a suffix to the elevation file's name.
+    Glean the UTM zone of the project's elevation file: from its projection (.prj),
+    or else the suffix of its name.
     
     This assumes that the elevation file was clipped using the NSNSD ArcToolbox 
     packaged with this tool.
@@ -93,10 +158,13 @@ def get_utm_zone(project_dir):
     
     # the ArcPro tool will figure out the UTM zone associated with the western extent of the file
     # (this is the native UTM zone of the NMSIM project)
-    elev_filename = os.path.basename(glob.glob(project_dir + os.sep + r"Input_Data\01_ELEVATION\*.flt")[0])
+    elev_file = project_elevation_file(project_dir)
 
-    # this will glean the UTM zone from the filename as an integer
-    UTM_zone = int(elev_filename.split("_")[-1][3:-4])
+    UTM_zone = elevation_zone(elev_file)
+
+    if(UTM_zone is None):
+        raise ValueError("Can't tell the UTM zone of " + elev_file + ": its projection (.prj) names none, " +
+                         "and its name does not end in one (e.g., elevation_nad83_utm6.flt)")
     
     return UTM_zone
 
@@ -132,25 +200,11 @@ def point_buffer(lon, lat, km):
     buf (geopandas GeoDataFrame): a circular buffer around the point (in WGS84)
     """
     
-    wgs84 = pyproj.Proj('epsg:4326')
+    import geopandas as gpd
 
-    # Azimuthal equidistant projection
-    aeqd_formatter = '+proj=aeqd +lat_0={lat} +lon_0={lon} +x_0=0 +y_0=0'
-    aeqd = pyproj.Proj(aeqd_formatter.format(lat=lat, lon=lon))
-    
-    # set up two transformation objects
-    projector = pyproj.Transformer.from_proj('EPSG:4326', aeqd)
-    reprojector = pyproj.Transformer.from_proj(aeqd, 'EPSG:4326', always_xy=True)
-    
-    # project the site coordinate into aeqd
-    long_m, lat_m = projector.transform(lat, lon)
-
-    # buffer using a radius in meters
-    buf_m = Point(long_m, lat_m).buffer(km * 1000)  # distance in metres
-
-    # convert the polygon from aeqd back into wgs84
-    # note that this uses both `shapely` and `pyproj`
-    buf_poly = transform(reprojector.transform, buf_m)  # apply projection
+    # a circle on the ellipsoid: every vertex is `km` from the point along the surface
+    # (the same polygon as a buffer drawn in an azimuthal equidistant projection)
+    buf_poly = geodesic_buffers(lon, lat, km * 1000)[0]
     
     # we'll return a geopandas GeoDataFrame instead of the Shapely Polygon
     buf = gpd.GeoDataFrame(geometry=gpd.GeoSeries(buf_poly))
@@ -226,16 +280,96 @@ def create_NMSIM_site_file(project_dir, unit, site, long_utm, lat_utm, height):
     # the full path to the eventual NMSIM site file
     out_path = project_dir + os.sep + r"Input_Data\05_SITES" + os.sep + unit + site + ".sit"
     
-    # open a file and write to it
-    with open(out_path, 'w') as site_file:
+    elev_file = project_elevation_file(project_dir)
+
+    write_site_file(out_path, long_utm, lat_utm, height, [unit+site], elev_file)
+
+
+def create_NMSIM_multisite_file(project_dir, unit, sites, year, name=None):
+
+    '''
+    Create one NMSIM site file holding several NPS monitoring deployments, so that
+    NMSIM computes every receiver in a single run of each trajectory.
+    
+    Inputs
+    ------
+    
+    project_dir (str): a canonical NMSIM project directory
+    unit (str): 4-character NPS Alpha Code, e.g. "DENA"
+    sites (list of str): alpha-numeric acoustic monitoring site codes, e.g. ["TRLA", "UWBT"]
+    year (int): the deployment year of every site
+    name (str): [optional] the site file's name (without extension) [default unit + "_" + year]
+    
+    Returns
+    -------
+    site_path (str): the site file; each receiver is named unit + site, in the order given
+    
+    '''
+
+    # look up every site's coordinates (WGS84) and microphone height in the metadata sheet
+    metadata = pd.read_csv(config["metadata"], delimiter="\t", encoding="ISO-8859-1")
+    deployments = metadata.loc[metadata["year"] == year].drop_duplicates("code").set_index("code")
+
+    missing = [site for site in sites if site not in deployments.index]
+    if(len(missing) > 0):
+        raise KeyError("No {0:d} deployment in the metadata for site(s) ".format(year) + ", ".join(missing))
+
+    deployments = deployments.loc[list(sites)]
+
+    # convert from D.d (WGS84) into NMSIM's coordinate system (NAD83 / UTM, meters), all at once
+    zone = get_utm_zone(project_dir)
+    long_utm, lat_utm = to_utm(deployments["long"].values, deployments["lat"].values, zone)
+
+    if(name is None):
+        name = unit + "_" + str(year)
+
+    site_path = project_dir + os.sep + r"Input_Data\05_SITES" + os.sep + name + ".sit"
+    elev_file = project_elevation_file(project_dir)
+
+    write_site_file(site_path, long_utm, lat_utm, deployments["microphone_height"].values,
+                    [unit + site for site in sites], elev_file)
+
+    return site_path
+
+
+def site_elevation(project_dir, long_in, lat_in, long_utm, lat_utm, height):
+
+    '''
+    The elevation of a microphone (meters MSL): the ground beneath it, from the project's
+    elevation file, plus the microphone's height.
+
+    Inputs
+    ------
+
+    project_dir (str): a canonical NMSIM project directory
+    long_in (float): longitude of the microphone (D.d, WGS84)
+    lat_in (float): latitude of the microphone (D.d, WGS84)
+    long_utm (float): easting in meters for the NMSIM project's UTM zone
+    lat_utm (float): northing in meters for the NMSIM project's UTM zone
+    height (float): microphone height in meters
+
+    Returns
+    -------
+    site_z (float): the microphone's elevation, or None if it is off the elevation raster
+
+    '''
+
+    elevation = open_elevation(project_elevation_file(project_dir))
+
+    # a geographic elevation file is sampled by longitude and latitude, a projected one by UTM
+    if(elevation["geographic"]):
+        ground = sample_elevation(elevation, long_in, lat_in)
+    else:
+        ground = sample_elevation(elevation, long_utm, lat_utm)
+
+    # (a single point comes back as a 0-d array)
+    ground = float(np.ravel(ground)[0])
 
-        site_file.write("    0\n")
-        site_file.write("    1\n")
-        site_file.write("{0:19.0f}.{1:9.0f}.{2:10.5f} {3:20}\n".format(long_utm, lat_utm, height, unit+site))
-        site_file.write(glob.glob(project_dir + os.sep + r"Input_Data\01_ELEVATION\*.flt")[0]+"\n")
+    return None if np.isnan(ground) else ground + height
 
 
-def tracks_within(ds, site, year, search_within_km = 25, climb_ang_max = 20, aircraft_specs=False, NMSIM_proj_dir=None, decouple=False):
+def tracks_within(ds, site, year, search_within_km = 25, climb_ang_max = 20, aircraft_specs=False, NMSIM_proj_dir=None, decouple=False,
+                  track_store=default_track_store, min_coverage=None, trim_within_km=None, trim_pad_s=60.0, show=True):
     
     '''
     Given a microphone location, load proximal GPS data from the Denali Overflights Database. 
@@ -252,14 +386,33 @@ def tracks_within(ds, site, year, search_within_km = 25, climb_ang_max = 20, air
     NMSIM_proj_dir (str, path): a user-specified output for trajectories - if None, trajectories are saved to a site's "Computational Outputs" folder.
     decouple (bool): should all nearby tracks be loaded, not just those that correspond in time 
                      with the microphone deployment? [default False]
+    track_store (str, path): a local store of previously queried points; only days not yet stored
+                             for this area are fetched from the database. If None, always query the
+                             database. [default `default_track_store`]
+    min_coverage (float): the fraction of a flight's duration the acoustic record must cover
+                          for the flight to be kept (ignored if `decouple`). If None, a flight is kept
+                          when the record covers its start, as it always has been. [default None]
+    trim_within_km (float): [optional] a propagation cutoff; each trajectory is trimmed to the part of
+                            the flight within this slant range of the microphone (see `trim_window`).
+                            The trajectory's header gives the trimmed start time, so results stay
+                            aligned in absolute time. [default None, the whole flight is kept]
+    trim_pad_s (float): seconds kept either side of the part within `trim_within_km` [default 60.0]
+    show (bool): display a map of the search area [default True]
 
     Returns
     -------
     tracks (geopandas GeoDataFrame): a spatial table of GPS points corresponding to the site and year specified.
+                                     "closest_slant_km" is the closest 3D range of each point's
+                                     flight to the microphone, "trim_offset_s" the time trimmed
+                                     from the start of the flight (zero if it was not trimmed),
+                                     and "trj_path" the trajectory file written for it.
 
     '''
 
 
+    import geopandas as gpd
+    from shapely.geometry import Point
+
     unit = "DENA" # it always will be for this tool
 
     # set up the output folders
@@ -298,21 +451,14 @@ def tracks_within(ds, site, year, search_within_km = 25, climb_ang_max = 20, air
     # ===== first part; site coordinate wrangling =====================
     
     # load the metadata sheet
-    metadata = pd.read_csv(r"\\inpdenafiles\sound\Complete_Metadata_AKR_2001-2021.txt", 
+    metadata = pd.read_csv(config["metadata"], 
                            delimiter="\t", encoding = "ISO-8859-1")
 
     # look up the site's coordinates in WGS84
     lat_in, long_in = metadata.loc[(metadata["code"] == site)&(metadata["year"] == year), "lat":"long"].values[0]
 
-    # epsg codes for Alaskan UTM zones
-    epsg_lookup = {1:'epsg:26901', 2:'epsg:26902', 3:'epsg:26903', 4:'epsg:26904', 5:'epsg:26905', 
-                   6:'epsg:26906', 7:'epsg:26907', 8:'epsg:26908', 9:'epsg:26909', 10:'epsg:26910'}
-
-    # convert from D.d (WGS84) to meters (NAD83)
-    projector = pyproj.Transformer.from_crs('epsg:4326', epsg_lookup[zone])
-
-    # convert into NMSIM's coordinate system
-    long, lat = projector.transform(lat_in, long_in)
+    # convert from D.d (WGS84) into NMSIM's coordinate system (NAD83 / UTM, meters)
+    long, lat = to_utm(long_in, lat_in, zone)
     
 
     # ===== second part; mic height to feet, write NMSIM .sit file =====================
@@ -326,17 +472,23 @@ def tracks_within(ds, site, year, search_within_km = 25, climb_ang_max = 20, air
     # now write the microphone's position to an NMSIM .sit file
     create_NMSIM_site_file(NMSIM_proj_dir, unit, site, long, lat, height)
 
+    # the microphone's elevation (meters MSL), for slant ranges to it
+    # (off the elevation raster, fall back on horizontal ranges)
+    site_z = site_elevation(NMSIM_proj_dir, long_in, lat_in, long, lat, height)
+
 
     # ===== third part; save mask file using the buffer radius of choice ===============
 
     # create the buffer polygon
     buf = point_buffer(long_in, lat_in, search_within_km)  
 
-    # plot the buffer within the park boundary
-    base = buf.plot(color='white', edgecolor='black', zorder=-5)
-    gpd.GeoSeries(Point(long_in, lat_in)).plot(ax=base, color="green")
-    base.set_aspect(1.9)
-    plt.show()
+    # plot the buffer within the park boundary (batch runs skip the map entirely)
+    if(show):
+        import matplotlib.pyplot as plt
+        base = buf.plot(color='white', edgecolor='black', zorder=-5)
+        gpd.GeoSeries(Point(long_in, lat_in)).plot(ax=base, color="green")
+        base.set_aspect(1.9)
+        plt.show()
     
 
     # ===== fourth part; determine the date range of NVSPL files ===============
@@ -364,13 +516,69 @@ def tracks_within(ds, site, year, search_within_km = 25, climb_ang_max = 20, air
     print("\n\tSearching from", start, "and ends", end, "\n")
 
     # load tracks from the database over a certain daterange, using the buffered site
-    tracks = query_tracks(connection_txt=os.path.join(RDS, "config\connection_info.txt"), 
-                          start_date=start, end_date=end, mask=buf, 
-                          aircraft_info=aircraft_specs)
+    # (the database is only connected to for days the local track store does not already hold)
+    query_tracks = get_query_tracks()
+    connection_txt = os.path.join(config["RDS"], "config\connection_info.txt")
+
+    with timed("query", unit=unit, site=site, year=year):
+        if(track_store is None):
+            tracks = query_tracks(connection_txt=connection_txt, 
+                                  start_date=start, end_date=end, mask=buf, 
+                                  aircraft_info=aircraft_specs)
+        else:
+            from NMSIM_Track_Store import cached_query_tracks
+            tracks = cached_query_tracks(query_tracks, track_store, start, end, buf, 
+                                         aircraft_info=aircraft_specs,
+                                         connection_txt=connection_txt)
+
+    count("points", len(tracks))
+    count("flights", tracks["flight_id"].nunique())
+
+    # convert every GPS point from wgs84 to the correct UTM zone for the NMSIM elevation file (all at once)
+    with timed("projection", points=len(tracks)):
+        tracks["long_UTM"], tracks["lat_UTM"] = to_utm(tracks["longitude"].values, tracks["latitude"].values, zone)
+
+    # the closest approach of every flight to the site, computed together
+    closest_approaches = closest_approaches_to(tracks["flight_id"].values, 
+                                               tracks["ak_datetime"].values,
+                                               tracks["long_UTM"].values, 
+                                               tracks["lat_UTM"].values,
+                                               long, lat,
+                                               z=0.3048*tracks["altitude_ft"].values, site_z=site_z,
+                                               radius_m=1000*search_within_km)
+
+    # (numpy drops any time zone; look up each closest time in the original Alaska time column instead)
+    closest_approaches["closest_time"] = tracks["ak_datetime"].iloc[closest_approaches["closest_index"].values].array
+    
+    # the fraction of every flight's duration covered by the acoustic record, all at once
+    record = coverage_index(NVSPL_dts)
+    flight_times = tracks.groupby("flight_id")["ak_datetime"].agg(["min", "max"])
+    closest_approaches["coverage"] = coverage_fraction(record, flight_times["min"], flight_times["max"])
+
+    if(min_coverage is None):
+        # the start of the flight must fall within the record (a flight of a single instant)
+        covered = coverage_fraction(record, flight_times["min"], flight_times["min"]) > 0
+    else:
+        covered = closest_approaches["coverage"].values >= min_coverage
+
+    uncovered = closest_approaches.index[~covered]
+
+    if(not decouple):
+
+        if(min_coverage is None):
+            print("\t", len(uncovered), "of", len(closest_approaches), "flights start outside the acoustic record.")
+        else:
+            print("\t", len(uncovered), "of", len(closest_approaches), 
+                  "flights are less than {0:.0%} covered by the acoustic record.".format(min_coverage))
+
+        # drop every flight without a matching record in one step
+        tracks = tracks[~tracks["flight_id"].isin(uncovered)]
+
+    written = []
+    outside = []
+    closest_approaches["trim_offset_s"] = 0.0
+    closest_approaches["trj_path"] = None
 
-    # make a dataframe to hold distances and times
-    closest_approaches = pd.DataFrame([], index=np.unique(tracks["id"]), columns=["closest_distance", "closest_time"])
-    
     # process each unique flight track in sequence
     for f_id, data in tracks.groupby("flight_id"):
         
@@ -379,13 +587,6 @@ def tracks_within(ds, site, year, search_within_km = 25, climb_ang_max = 20, air
             # double check that the data are sorted by time
             data = data.sort_values("ak_datetime")
 
-            # convert the GPS points from wgs84 to the correct UTM zone for the NMSIM elevation file
-            long_utm, lat_utm = projector.transform(data["latitude"].values, data["longitude"].values)
-
-            # assign back into the dataframe for subsequent use
-            data.loc[:, "long_UTM"] = long_utm
-            data.loc[:, "lat_UTM"] = lat_utm
-
             # coordinates of each point
             coords = np.array([[lo, la, e] for lo, la, e in zip(data["long_UTM"], 
                                                                 data["lat_UTM"], 
@@ -408,171 +609,95 @@ def tracks_within(ds, site, year, search_within_km = 25, climb_ang_max = 20, air
             data["ClimbAngle"] = climb_angs
 
             # NMSIM probably won't like nan... replace those with zero as well
-            data["ClimbAngle"].fillna(0, inplace=True)
+            data["ClimbAngle"] = data["ClimbAngle"].fillna(0)
 
             # this is the start time of the track
             start = data["ak_datetime"].iloc[0]
 
-            # truncate starting time to nearest hour to check against the NVSPL list
-            check = start.replace(minute=0, second=0)
-
-            # 1 if there is a match, 0 if not
-            match_bool = NVSPL_dts.apply(lambda date: date in [check]).sum()
-
-            if((match_bool == 0)&(not decouple)):
-
-                tracks = tracks[tracks["flight_id"] != f_id]
-                print("\t\t", "Flight starting", start, "has no matching acoustic record")
-                
-
-            elif((match_bool == 1)|(decouple)):
-            
-                if(decouple):
-                    print("\t\t", "Flight starting", start, "has no matching acoustic record. Proceeding by user override.")
-
-                # find the time at which the flight passes closest to the station
-                site_coords = np.array([long, lat])
-                GPSpoints_xy = np.array([data["long_UTM"], data["lat_UTM"]])
-
-                # which point made the closest approach to the site?
-                min_distance = np.min(np.linalg.norm(site_coords - GPSpoints_xy.T, axis=1))/1000
-
-                # keep track of the closest approach by id
-                closest_approaches.loc[data["flight_id"].iloc[0], "closest_distance"] = min_distance
-
-                # at what time did the closest approach occur?
-                closest_time = data.iloc[np.argmin(np.linalg.norm(site_coords - GPSpoints_xy.T, axis=1))]['ak_datetime']
+            # (with `decouple`, flights without a matching acoustic record are kept by user override)
+            if(decouple and (f_id in uncovered)):
+                count("flights_without_record")
 
-                # likewise keep track of the closest time
-                closest_approaches.loc[data["flight_id"].iloc[0], "closest_time"] = closest_time
+            # the distance at which the flight passes closest to the station
+            min_distance = closest_approaches.loc[f_id, "closest_distance"]
 
-                print("\t\t", "#"+str(f_id), "expected closest at", closest_time, "{0:0.1f}km".format(min_distance))
+            # create a time-elapsed column
+            data["time_elapsed"] = (data["ak_datetime"] - data["ak_datetime"].min()).dt.total_seconds()
 
-                # create a time-elapsed column
-                data["time_elapsed"] = (data["ak_datetime"] - data["ak_datetime"].min()).apply(lambda t: t.total_seconds())
+            # we'll only save the trajectory if it's within the specified search radius!
+            if(min_distance <= search_within_km):
 
-                # we'll only save the trajectory if it's within the specified search radius!
-                if(min_distance <= search_within_km):
+                # ======= densify the GPS points for NMSIM ========
 
-                    # ======= densify the GPS points for NMSIM ========
+                # resample every column to one point per second in a single pass
+                with timed("densify", flight=f_id, points=len(data)):
+                    dense = densify_trajectory(data["time_elapsed"].values,
+                                               data["long_UTM"].values,
+                                               data["lat_UTM"].values,
+                                               0.3048*data["altitude_ft"].values,
+                                               data["heading"].values,
+                                               data["knots"].values,
+                                               step=1.0,
+                                               extra={"ClimbAngle": data["ClimbAngle"].values})
 
-                    print("\n\t\t\t", "Flight is within search distance. Attempting to densify", 
-                          data.shape[0], "points...")
-
-                    new_points = gpd.GeoDataFrame([])
-                    for row in data.itertuples():
-
-                        try:
-
-                            next_ind = data.index[np.argwhere(data.index == row.Index)+1][0][0]
+                # ======= trim the flight to its pass by the microphone ========
 
-                            # this represents time steps < 1 second
-                            interpSteps = int(1.1*(data.loc[next_ind, "ak_datetime"] - row.ak_datetime).total_seconds())
-                            print("trying for", interpSteps, "steps between points")
+                offset = 0.0
+                if(trim_within_km is not None):
 
-                            # interpolate the indices, longitudes, latitudes, and altitudes
-                            # we don't need the first or last values - they're already in the dataframe
-                            indi = np.linspace(row.Index, next_ind, interpSteps)[1:-1]
-                            ti = np.linspace(row.time_elapsed, data.loc[next_ind, "time_elapsed"], interpSteps)[1:-1]
-                            xi = np.linspace(row.longitude, data.loc[next_ind, "longitude"], interpSteps)[1:-1]
-                            yi = np.linspace(row.latitude, data.loc[next_ind, "latitude"], interpSteps)[1:-1]
-                            zi = np.linspace(row.altitude_ft, data.loc[next_ind, "altitude_ft"], interpSteps)[1:-1]
-                            utm_xi = np.linspace(row.long_UTM, data.loc[next_ind, "long_UTM"], interpSteps)[1:-1]
-                            utm_yi = np.linspace(row.lat_UTM, data.loc[next_ind, "lat_UTM"], interpSteps)[1:-1]
-                            cai = np.linspace(row.ClimbAngle, data.loc[next_ind, "ClimbAngle"], interpSteps)[1:-1]
-                            hi = interpolate_heading(row.heading, data.loc[next_ind, "heading"], interpSteps)[1:-1]
-                            vi = np.linspace(row.knots, data.loc[next_ind, "knots"], interpSteps)[1:-1]
+                    with timed("trim", flight=f_id, points=len(dense)):
+                        window = trim_window(dense["time_elapsed"].values, dense["x"].values, dense["y"].values,
+                                             dense["z"].values, long, lat, 1000*trim_within_km, sites_z=site_z,
+                                             pad_s=trim_pad_s)
 
-                            # generate geometry objects for each new interpolated point
-                            gi = [Point(xyz) for xyz in zip(xi, yi, zi)]
+                    # the flight never came within the propagation cutoff
+                    if(window is None):
+                        outside.append(f_id)
+                        continue
 
-                            # create a dictionary of the interpolated values to their column
-                            d = {'time_elapsed': ti,
-                                 'longitude': xi, 
-                                 'latitude': yi,
-                                 'altitude_ft': zi,
-                                 'long_UTM': utm_xi,
-                                 'lat_UTM': utm_yi,
-                                 'ClimbAngle': cai,
-                                 'heading': hi,
-                                 'knots': vi,
-                                 'geom': gi}
+                    # the trimmed trajectory starts from zero again; its header gives its own start time
+                    offset, end = window
+                    kept = (dense["time_elapsed"] >= offset) & (dense["time_elapsed"] <= end)
+                    count("trajectory_points_trimmed", int((~kept).sum()))
 
+                    dense = dense.loc[kept].reset_index(drop=True)
+                    dense["time_elapsed"] -= offset
+                    closest_approaches.loc[f_id, "trim_offset_s"] = offset
 
-                            # turn the newly interpolated values into a GeoDataFrame 
-                            rowsi = gpd.GeoDataFrame(d, index=indi, crs="EPSG:4326")
+                count("trajectory_points", len(dense))
 
-                            # append to the track's overall new points
-                            new_points = new_points.append(rowsi)
+                # ======= write the trajectory file! ==============
 
-                        # there is no next index on the last row... pass through
-                        except IndexError:
-                            pass
+                # add N-number and begin time (the file keeps the flight's name, however it was trimmed)
+                start_time = dt.datetime.strftime(data["utc_datetime"].min(skipna=True) + dt.timedelta(seconds=offset),
+                                                  "%Y-%m-%d %H:%M:%S")
+                file_name_dt = dt.datetime.strftime(data["utc_datetime"].min(skipna=True), "_%Y%m%d_%H%M%S")
+                N_number = data["registration"].iloc[0]
 
+                # path to the specific .trj file to be written
+                trj_path = trj_out + os.sep + str(N_number) + str(file_name_dt) + ".trj"
 
-                    # append the new points and sort by index (which is also by time)
-                    data = data.append(new_points)
-                    data = data.sort_index()
+                # the header and the whole data section are written at once (atomically)
+                with timed("write", flight=f_id, points=len(dense)):
+                    write_trajectory(trj_path, dense["time_elapsed"].values, dense["x"].values, dense["y"].values,
+                                     dense["z"].values, dense["heading"].values, dense["ClimbAngle"].values,
+                                     dense["speed"].values, zone=zone,
+                                     title=str(N_number) + " beginning " + start_time + " UTC")
 
-                    print("\t\t\t", "...trajectory now has", 
-                          data.shape[0], "points!\n")
+                count("trajectories")
+                count("bytes_written", os.path.getsize(trj_path))
+                closest_approaches.loc[f_id, "trj_path"] = trj_path
+                written.append(f_id)
 
-                    # ======= write the trajectory file! ==============
-
-                    print("\t\t\t", "Densification complete, writing trajectory file...")
-
-                    # add N-number and begin time
-                    start_time = dt.datetime.strftime(data["utc_datetime"].min(skipna=True), "%Y-%m-%d %H:%M:%S")
-                    file_name_dt = dt.datetime.strftime(data["utc_datetime"].min(skipna=True), "_%Y%m%d_%H%M%S")
-                    N_number = data["registration"].iloc[0]
-
-                    # path to the specific .trj file to be written
-                    trj_path = trj_out + os.sep + str(N_number) + str(file_name_dt) + ".trj"
+            
+            # the flight was not within the search radius...
+            else:
+                outside.append(f_id)
 
-                    with open(trj_path, 'w') as trajectory:
-
-                        # write the header information
-                        trajectory.write("Flight track trajectory variable description:\n")
-                        trajectory.write(" time - time in seconds from the reference time\n")
-                        trajectory.write(" Xpos - x coordinate (UTM)\n")
-                        trajectory.write(" Ypos - y coordinate (UTM)\n")
-                        trajectory.write(" UTM Zone  "+str(zone)+"\n")
-                        trajectory.write(" Zpos - z coordinate in meters MSL\n")
-                        trajectory.write(" heading - aircraft compass bearing in degrees\n")
-                        trajectory.write(" climbANG - aircraft climb angle in degrees\n")
-                        trajectory.write(" vel - aircraft velocity in knots\n")
-                        trajectory.write(" power - % engine power\n")
-                        trajectory.write(" roll - bank angle (right wing down), degrees\n")
-                        trajectory.write("FLIGHT " + str(N_number) + " beginning " + start_time +" UTC\n")
-                        trajectory.write("TEMP.  59.0\n")
-                        trajectory.write("Humid.  70.0\n")
-                        trajectory.write("\n")
-                        trajectory.write("         time(s)        Xpos           Ypos           Zpos         heading        climbANG       Vel            power          rol\n")
-
-                        # now write the data section row by row
-                        for ind, point in data.iterrows():
-
-                            # write the line
-                            trajectory.write("{0:15.3f}".format(point["time_elapsed"]) + \
-                                             "{0:15.3f}".format(point["long_UTM"]) + \
-                                             "{0:15.3f}".format(point["lat_UTM"]) + \
-                                             "{0:15.3f}".format(0.3048*point["altitude_ft"]) + \
-                                             "{0:15.3f}".format(point["heading"]) + \
-                                             "{0:15.3f}".format(point["ClimbAngle"]) + \
-                                             "{0:15.3f}".format(point["knots"]) + \
-                                             "{0:15.3f}".format(95) + \
-                                             "{0:15.3f}".format(0) + "\n")
-
-                        print("\t\t\t...finished writing .trj", "\n")
-                        print("-----------------------------------------------------------------------------------------")
+    # ...drop every flight outside the search radius from the table in one step
+    tracks = tracks[~tracks["flight_id"].isin(outside)]
+    print("\t", len(written), "trajectories written;", len(outside), "flights were not within the search radius (or propagation cutoff).")
 
-                
-                # (closes `if` from line 253) the flight was not within the search radius...
-                else:
-                    tracks = tracks[tracks["flight_id"] != f_id] # ...drop the flight ID from the table
-                    print("\t\t", "Flight starting", start, "was not within the search radius.")
-    
-    print(tracks.size)
     if(tracks.shape[0] <= 1):
         
         print("\nSorry, no tracks in the database coincide with this deployment.")
@@ -586,16 +711,16 @@ def tracks_within(ds, site, year, search_within_km = 25, climb_ang_max = 20, air
         print("\nThere are", len(u), "tracks in the database which coincide with this deployment.")
         print("Identification numbers:", u)
         
-        # iterate through each id number and add the closest approach information
-        for track_id, flight in closest_approaches.iterrows():
-            
-            tracks.loc[tracks["flight_id"] == track_id, "closest_time"] = flight["closest_time"]
-            tracks.loc[tracks["flight_id"] == track_id, "closest_distance"] = flight["closest_distance"]
+        # add the closest approach information to every point with a single join on flight id
+        tracks = tracks.merge(closest_approaches[["closest_time", "closest_distance", "closest_slant_km",
+                                                  "time_in_radius_s", "coverage", "trim_offset_s", "trj_path"]],
+                              left_on="flight_id", right_index=True, how="left")
         
         return tracks
     
     
-def NMSIM_create_tis(project_dir, source_path, Nnumber=None, NMSIMpath=None):
+def NMSIM_create_tis(project_dir, source_path, Nnumber=None, NMSIMpath=None, processes=1, timeout=None, retries=0, force=False,
+                     site_file=None, trj_files=None):
     
     '''
     Create a site-based model run (.tis) using the NMSIM batch processor.
@@ -605,30 +730,41 @@ def NMSIM_create_tis(project_dir, source_path, Nnumber=None, NMSIMpath=None):
     project_dir (str, path): the location of a canonical NMSIM project directory, created with "Create_Base_Layers.py"
     source_path (str, path): the location of the relevant NMSIM noise source file (.src)
     NMSIMpath (str, path): [optional] an alternate location of the program `Nord2000batch.exe`
+    processes (int): how many trajectories to simulate at once [default 1]
+    timeout (float): [optional] seconds before a single NMSIM run is killed
+    retries (int): how many times to re-run a trajectory that failed [default 0]
+    force (bool): re-simulate every trajectory, even those whose .tis is up to date [default False]
+    site_file (str, path): [optional] the receiver site file (.sit); one holding many receivers
+                           (see `create_NMSIM_multisite_file`) computes them all in a single run
+                           of each trajectory [default the first site file in the project]
+    trj_files (list of str): [optional] the trajectories to simulate, e.g. those `tracks_within` wrote
+                             for one deployment [default every trajectory in the project]
     
     Returns
     -------
-    None
+    results (pandas DataFrame): one record per trajectory (exit code, duration, output path, NMSIM messages)
     
     '''
     
     # ======= (1) define obvious, one-to-one project files ================
     
-    elev_file = glob.glob(project_dir + os.sep + r"Input_Data\01_ELEVATION\*.flt")[0]
+    elev_file = project_elevation_file(project_dir)
     
     # imped_file = project_dir + os.sep + "Input_Data\01_IMPEDANCE" + os.sep + "landcover.flt"
     imped_file = None
 
-    trj_files = glob.glob(project_dir + os.sep + r"Input_Data\03_TRAJECTORY\*.trj")
+    if(trj_files is None):
+        trj_files = glob.glob(project_dir + os.sep + r"Input_Data\03_TRAJECTORY\*.trj")
 
     # eventually the batch file is going to want this
     tis_out_dir = project_dir + os.sep + r"Output_Data\TIG_TIS"
     
     # ======= (2) define less obvious project files - these still need thought! ================
     
-    # site files need some thinking through... there COULD be more than one per study area
-    # (it's quite project dependant)
-    site_file = glob.glob(project_dir + os.sep + r"Input_Data\05_SITES\*.sit")[0]
+    # there COULD be more than one site file per study area (it's quite project dependant),
+    # but a single file may hold every receiver of interest
+    if(site_file is None):
+        site_file = glob.glob(project_dir + os.sep + r"Input_Data\05_SITES\*.sit")[0]
     
     # strip out the FAA registration number
     registrations = [t.split("_")[-3][11:] for t in trj_files]
@@ -640,13 +776,8 @@ def NMSIM_create_tis(project_dir, source_path, Nnumber=None, NMSIMpath=None):
 
     trajectories = pd.DataFrame([registrations, trj_files, tis_files], index=["N_Number","TRJ_Path","TIS_Path"]).T
     
-    # ======= (3) write the control + batch files for command line control of NMSIM ================
-        
-    # set up the two files we want to write
-    control_file = project_dir + os.sep + "control.nms"
-    batch_file = project_dir + os.sep + "batch.txt"
+    # ======= (3) select the trajectories to process ================
     
-    # select the trajectories to process
     if(Nnumber == None):
 
         trj_to_process = trajectories
@@ -655,75 +786,37 @@ def NMSIM_create_tis(project_dir, source_path, Nnumber=None, NMSIMpath=None):
 
         trj_to_process = trajectories.loc[trajectories["N_Number"] == Nnumber, :]
     
-    
-    if(NMSIMpath == None):
-        
-        # NMSIM is packaged right along with these scripts
-        # so by default we look for `Nord2000batch.exe` relative to this file
-        this_file = os.path.abspath(__file__)
-        one_dir_up = os.path.dirname(this_file)
+    # each trajectory gets its own control + batch files in a private scratch folder
+    jobs = [solver_job(os.path.basename(flight["TRJ_Path"])[:-4], flight["TIS_Path"], 
+                       elev_file, site_file, flight["TRJ_Path"], source_path, imped_file=imped_file)
+            for meta, flight in trj_to_process.iterrows()]
 
-        Nord = one_dir_up + os.sep + r"NMSIM\Nord2000batch.exe"
-        
-    else:
-        
-        Nord = NMSIMpath
+    # ======= (4) compute the theoretically observed trace on the site's microphone ================
 
-    for meta, flight in trj_to_process.iterrows():
-    
+    # the project's build manifest remembers the inputs of every .tis, so only
+    # new or changed trajectories (or elevation, site and source files) are re-simulated
+    results = run_solver_jobs(jobs, NMSIMpath=NMSIMpath, processes=processes, timeout=timeout, retries=retries,
+                              manifest=manifest_path(project_dir), force=force)
 
-        # write the control file for this situation
-        with open(control_file, 'w') as nms:
+    ran = results[~results["skipped"]]
 
-            nms.write(elev_file+"\n") # elevation path
-            
-            if(imped_file != None):
-                nms.write(imped_file+"\n") # impedance path
-            else:
-                nms.write("-\n")
-                
-            nms.write(site_file+"\n") # site path
-            nms.write(flight["TRJ_Path"]+"\n")
-            nms.write("-\n")
-            nms.write("-\n")
-            nms.write(source_path+"\n")
-            nms.write("{0:11.4f}   \n".format(500.0000))
-            nms.write("-\n")
-            nms.write("-")    
-
-        # write the batch file to create a site-based analysis
-        with open(batch_file, 'w') as batch:
-
-            batch.write("open\n")
-            batch.write(control_file+"\n")
-            batch.write("site\n")
-            batch.write(flight["TIS_Path"]+"\n")
-            batch.write("dbf: no\n")
-            batch.write("hrs: 0\n")
-            batch.write("min: 0\n")
-            batch.write("sec: 0.0")
-        
-        # ======= (4) compute the theoretically observed trace on the site's microphone ================
-        
-        print(flight["TRJ_Path"]+"\n")
-        
-        process = subprocess.Popen([Nord, batch_file], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-        stdout, stderr = process.communicate()
+    print(results["skipped"].sum(), "of", len(results), "trajectories are already up to date;",
+          ran["ok"].sum(), "simulated.\n")
 
-        output_messages = stdout.decode("utf-8").split("\r\n")
-        output_messages = [ out for out in output_messages if out.strip() != '' ]
-        
+    # NMSIM's own messages are only worth reading when it failed (every run's are kept in `results`)
+    for meta, result in ran[~ran["ok"]].iterrows():
+
+        print(result["out_path"])
+        print("\tNMSIM failed after", result["attempts"], "attempt(s); control and batch files kept in", result["scratch"])
         print("\tthe following lines are directly from NMSIM:")
-        for s in output_messages+["\n"]:
+        for s in result["messages"]:
             print("\t"+s)
-
-        # slightly messier printing for error messages
-        if(stderr != None):
-            for s in sterr.decode("utf-8").split("\r\n"):
-                print(s.strip()) 
+        print()
                 
+    return results
+    
 
-def pair_trj_to_tis_results(project_dir):
+def pair_trj_to_tis_results(project_dir, site_file=None, trj_files=None):
     
     '''
     Join a directory of .tis results created by NMSIM
@@ -732,75 +825,122 @@ def pair_trj_to_tis_results(project_dir):
     Inputs
     ------
     project_dir (str): the path to a canonical NPS-style NMSIM project directory
+    site_file (str, path): [optional] the site file (.sit) the results were computed for; each .tis
+                           is named for it, followed by its trajectory [default the first site file in the project]
+    trj_files (list of str): [optional] only pair the results of these trajectories [default every result]
     
     Returns
     -------
-    iterator (zip object): an iterator containing the paired .tis and .trj file paths
+    iterator (iterator): (.trj, .tis) pairs of file paths
     
     '''
     
-    # find all the '.tis' files
-    successful_tis = glob.glob(project_dir + os.sep + "Output_Data\TIG_TIS\*.tis")
+    if(site_file is None):
+        site_file = glob.glob(project_dir + os.sep + r"Input_Data\05_SITES\*.sit")[0]
+
+    # each result is named "<site file>_<trajectory>.tis" (see `NMSIM_create_tis`)
+    site_prefix = os.path.basename(site_file)[:-4] + "_"
+
+    # find all the '.tis' files computed for this site file
+    successful_tis = [f for f in glob.glob(project_dir + os.sep + r"Output_Data\TIG_TIS\*.tis")
+                      if os.path.basename(f).startswith(site_prefix)]
 
     # find all the '.trj' files
-    trajectories = [project_dir + os.sep + "Input_Data\\03_TRAJECTORY" + \
-                    os.sep + os.path.basename(f)[9:-4] + ".trj" for f in successful_tis]
+    trajectories = [project_dir + os.sep + r"Input_Data\03_TRAJECTORY" + \
+                    os.sep + os.path.basename(f)[len(site_prefix):-4] + ".trj" for f in successful_tis]
     
-    iterator = zip(trajectories, successful_tis)
+    pairs = list(zip(trajectories, successful_tis))
+
+    if(trj_files is not None):
+        wanted = set(os.path.basename(t) for t in trj_files)
+        pairs = [(t, f) for t, f in pairs if os.path.basename(t) in wanted]
+
+    iterator = iter(pairs)
     
     return iterator
 
 
-def tis_resampler(tis_path, dt_start, utc_offset=-8):
+@timer("parse")
+def tis_resampler(tis_path, dt_start, utc_offset=-8, cache=False, site=None):
     
     '''
-    '''
-    
-    # read the data line-by-line
-    with open(tis_path) as f:
+    Read a site-based model (.tis) and resample it to one-second resolution in local time.
 
-        content = list(islice(f, 18 + (3600*24)))
-    
-    
-    # find the line index where the header ends
-    splitBegin = content.index('---End File Header---\n')
+    Inputs
+    ------
+    tis_path (str, path): an NMSIM site-based model result
+    dt_start (datetime): the UTC start time of the trajectory that produced the .tis
+    utc_offset (float): hours from UTC to local time [default -8]
+    cache (bool): keep the parsed .tis in a binary cache beside it, so later calls skip parsing [default False]
+    site (str): [optional] the receiver to read from a .tis holding several, e.g. "DENATRLA" [default the first]
 
-    # take out the whitespace and two empty columns at either end
-    spectral_data = [re.split(r'\s+',c) for c in content[splitBegin+10:]] 
-    spectral_data = [d[1:-2] for d in spectral_data]      
+    Returns
+    -------
+    clean_tis (pandas DataFrame): median levels (dB) for each second, indexed by local time
+    '''
     
-    # initalize a pandas dataframe using the raw spectral data and the expected column headers
-    tis = pd.DataFrame(spectral_data, columns=["SP#","TIME","F","A","10", "12.5","15.8","20","25","31.5","40","50","63",
-                                                "80","100","125","160","200","250","315","400","500","630","800","1000",
-                                                "1250","1600","2000","2500","3150","4000","5000","6300","8000","10000",
-                                                "12500"], dtype='float') #,"20000"
-
-    # there's a weird text line at the end of the file (is this true for all .tis files?)
-    tis.drop(tis.tail(1).index,inplace=True) # drop last n rows
+    # parse the header once and load the numeric block in bulk (any duration)
+    if((site is not None) and cache):
+        row, levels = cached_tis_site(tis_path, site, dtype="float64")
+    elif(site is not None):
+        index, levels = split_tis(tis_path, sites=[site], dtype="float64")
+        if(site not in levels):
+            raise ValueError("No receiver " + str(site) + " in " + str(tis_path))
+        levels = levels[site]
+    elif(cache):
+        header, levels = cached_tis(tis_path, dtype="float64")
+    else:
+        header, levels = read_tis(tis_path, dtype="float64")
 
-    # these columns are stubborn
-    tis["TIME"] = tis["TIME"].astype('float')
-    tis["SP#"] = tis["SP#"].astype('float').apply(lambda f: int(f))
-    tis["F"] = tis["F"].astype('int')
+    # initalize a pandas dataframe using the spectral data and the expected column headers
+    # (D-prime, the final column, is not needed here)
+    tis = pd.DataFrame(np.array(levels[:, :-1]), columns=tis_columns[:-1])
 
-    # convert relevant columns to decibels (dB) from centibels (cB)
-    tis.loc[:,'A':'12500'] *= 0.1
+    # the data position number is an integer
+    tis["SP#"] = tis["SP#"].astype('int')
 
     # timedelta to adjust to local time
     utc_offset = dt.timedelta(hours=utc_offset) 
 
     # reindex the dataframe to AKT
-    tis.index = tis["TIME"].astype('float').apply(lambda t: dt_start + dt.timedelta(seconds=t) + utc_offset)
+    tis.index = pd.to_datetime(dt_start + utc_offset) + pd.to_timedelta(tis["TIME"].values, unit="s")
 
     # resample to match NVSPL time resolution
-    clean_tis = tis.sort_index().resample('1S').quantile(0.5)
+    clean_tis = tis.sort_index().resample('1s').quantile(0.5)
     
     return clean_tis
 
 
-def NVSPL_to_match_tis(ds, project_dir, startdate, clean_tis, trj, unit, site, year, utc_offset=-8, pad_length=5):
-    
+@timer("match")
+def NVSPL_to_match_tis(ds, project_dir, startdate, clean_tis, trj, unit, site, year, utc_offset=-8, pad_length=5,
+                       store=None, figures=None, show=True, dpi=300, thumbnail_dpi=None):
+
     '''
+    Find the acoustic record (NVSPL) that coincides with a model result, and save a figure comparing them.
+
+    Inputs
+    ------
+    ds (iyore Dataset): the acoustic archive
+    project_dir (str): the path to a canonical NPS-style NMSIM project directory
+    startdate (datetime): the UTC start time of the trajectory
+    clean_tis (pandas DataFrame): the model result, see `tis_resampler`
+    trj (str, path): the trajectory that produced the model result
+    unit (str): four letter park service unit code
+    site (str): site code
+    year (int): year of the event
+    utc_offset (float): hours from UTC to local time [default -8]
+    pad_length (float): minutes of record to show before and after the event [default 5]
+    store (dict): [optional] an NVSPL store shared by many events (see `NMSIM_NVSPL.open_nvspl_store`),
+                  so that hours are read once; if None, a store is opened for this event alone
+    figures (list): [optional] a queue for the comparison figure; if given, the figure is appended
+                    as a job (see `NMSIM_Figures.comparison_job`) rather than drawn [default None]
+    show (bool): display the figure after saving it (when it is drawn here) [default True]
+    dpi (int): resolution of the saved figure [default 300]
+    thumbnail_dpi (int): [optional] also save a thumbnail at this resolution [default None]
+
+    Returns
+    -------
+    event_SPL (pandas DataFrame): measured levels over the padded event, indexed by local time
     '''
     
     # timedelta to adjust to local time
@@ -808,7 +948,6 @@ def NVSPL_to_match_tis(ds, project_dir, startdate, clean_tis, trj, unit, site, y
     
     # convert startdate to Alaska Time
     ak_start = startdate + utc_offset
-    print("Alaska start time", ak_start)
     
     # tidy up the TIS spectrogram by converting np.nan to -99.9
     clean_tis.fillna(-99.9).values.T
@@ -816,73 +955,43 @@ def NVSPL_to_match_tis(ds, project_dir, startdate, clean_tis, trj, unit, site, y
     # we can only compare 1/3rd octave bands down to 12.5 Hz... drop the rest
     clean_tis = clean_tis.loc[:, ~clean_tis.columns.isin(["SP#", "TIME", "F", "A", "10"])]
 
-    # load NVSPL for the day of the event
-    nv = nvspl(ds,
-               unit=unit,
-               site=site,
-               year=ak_start.year,
-               month=str(ak_start.month).zfill(2),
-               day=str(ak_start.day).zfill(2),
-               hour=[str(h).zfill(2) for h in np.unique(clean_tis.index.hour.values)],
-               columns=["H"+s.replace(".", "p") for s in clean_tis.columns]).combine()
-
-    # if multiple hours, drop the heirarchical index
-    if isinstance(nv.index, pd.MultiIndex):
-        nv.index = nv.index.droplevel(0)
-
     # select the SPL data that corresponds 
     pad = dt.timedelta(minutes=pad_length)
-    
+
+    # NVSPL hours are read once and kept in a store; a store shared by many events
+    # (see `NMSIM_Pipeline.stage_compare`) reads each day's files a single time
+    if(store is None):
+        store = open_nvspl_store(ds, unit, site)
+
     # find the NVSPL data the specifically corresponds to the timing of the model
-    event_SPL = nv.loc[clean_tis.index[0]-pad : clean_tis.index[-1]+pad,:]
-    
-    print("NVSPL shape:", event_SPL.shape)
+    event_SPL = nvspl_window(store, clean_tis.index[0]-pad, clean_tis.index[-1]+pad, bands=list(clean_tis.columns))
+
+    if(len(event_SPL) == 0):
+        raise ValueError("No NVSPL data coincide with " + os.path.basename(trj))
 
     # pad the theoretical data as well
     spect_pad = np.full((int(pad.total_seconds()), clean_tis.shape[1]), -99.9)
     theoretical = np.vstack((spect_pad, clean_tis))
-
-    print("NMSIM shape:", theoretical.shape)
-    
-    fig, ax = plt.subplots(nrows=2, ncols=1, figsize=(18,5), sharex=True)
-    
-    # convert the NVSPL's nice datetime axis to numbers
-    x_lims = mdates.date2num(event_SPL.index)
     
-    ax[0].set_title("NMISIM results", loc="left")
-    ax[0].imshow(theoretical.T, aspect='auto', origin='lower', 
-                 extent=[x_lims[0], x_lims[-1], 0, event_SPL.shape[1]],
-                 cmap='plasma', interpolation=None, vmin=-10, vmax=80, zorder=-5)
+    # describe the figure; its drawing can happen here or in another process
+    job = comparison_job(project_dir, os.path.basename(trj)[:-4], unit, site, theoretical, event_SPL,
+                         dpi=dpi, thumbnail_dpi=thumbnail_dpi)
 
-    ax[0].set_yticks(np.arange(event_SPL.shape[1])[::4])
-    ax[0].set_yticklabels(event_SPL.columns.astype('float')[::4])
-    
-    # tell matplotlib that the numeric axis should be formatted as dates
-    ax[0].xaxis_date()
-    ax[0].xaxis.set_major_formatter(mdates.DateFormatter("%b-%d\n%H:%M")) # tidy them!
-    
-    ax[1].set_title("microphone measurement at "+unit+site, loc="left")
-    im = ax[1].imshow(event_SPL.T, aspect='auto', origin='lower', 
-                      extent=[x_lims[0], x_lims[-1], 0, event_SPL.shape[1]],
-                      cmap='plasma', interpolation=None, vmin=-10, vmax=80)
-    
-    # the same as for the first plot
-    ax[1].set_yticks(np.arange(event_SPL.shape[1])[::4])
-    ax[1].set_yticklabels(event_SPL.columns.astype('float')[::4])
-    ax[1].xaxis_date()
-    ax[1].xaxis.set_major_formatter(mdates.DateFormatter("%b-%d\n%H:%M")) # tidy them!
+    if(figures is not None):
 
-    fig.colorbar(im, ax=ax.ravel().tolist(), anchor=(2.2, 0.0))
-    fig.text(1.06, 0.5, "Sound Level (Leq, 1s)", va='center', rotation='vertical', fontsize=10)
-    fig.text(-0.02, 0.55, "Frequency Band (Hz)", va='center', rotation='vertical', fontsize=13)
-    
-    title = os.path.basename(trj)[:-4]
-    
-    plt.suptitle(title, y=1.05, fontsize=17, ha="center")
+        # a batch run renders the queue later, off-screen (see `NMSIM_Figures.render_figures`)
+        figures.append(job)
+
+    else:
+
+        import matplotlib.pyplot as plt
 
-    fig.tight_layout()
+        fig = draw_comparison(job)
+        save_comparison(fig, job)
 
-    plt.savefig(project_dir + os.sep + r"Output_Data\IMAGES" + os.sep + title + "_comparison.png", dpi=300, bbox_inches="tight")
-    plt.show()
+        if(show):
+            plt.show()
+        else:
+            plt.close(fig)
     
     return event_SPL
\ No newline at end of file
@@ -0,0 +1,291 @@
+#-----------------------------------------------------------------------------#
+# NMSIM_Elevation.py
+#
+# NPS Natural Sounds Program
+#
+# Read the elevation file of an NMSIM project (ESRI GridFloat: a `.flt` of
+# raw 32-bit floats, described by a `.hdr` sidecar) without arcpy or GDAL.
+# The `.flt` is memory-mapped, so sampling even a statewide DEM reads only
+# the pages under the points requested.
+#
+# Coordinates are those of the raster itself: for an elevation file made by
+# `NMSIM_Create_Base_Layers.py` that is NAD83 / UTM (meters), and the zone
+# is recorded in its `.prj` (and its name, e.g. elevation_nad83_utm13.flt).
+# Older projects may hold a geographic (NAD83 longitude/latitude) raster.
+#
+# History:
+#	D. Halyn Betchkal -- Created
+#
+#-----------------------------------------------------------------------------#
+
+# ================ Import Libraries =======================
+
+import os
+import re
+import numpy as np
+import pandas as pd
+
+
+# ===========================  Define functions  =======================================
+
+def read_hdr(hdr_path):
+
+    """
+    Parse an ESRI GridFloat header (.hdr) into a dictionary.
+
+    Inputs
+    ------
+    hdr_path (str, path): a .hdr file
+
+    Returns
+    -------
+    header (dict): "ncols", "nrows" (int), "xllcorner", "yllcorner", "cellsize", "nodata" (float)
+                   and "byteorder" ("LSBFIRST" or "MSBFIRST"). Centers ("xllcenter") are
+                   converted to corners.
+
+    """
+
+    values = {}
+    with open(hdr_path) as f:
+        for line in f:
+
+            tokens = line.split()
+            if(len(tokens) >= 2):
+                values[tokens[0].lower()] = tokens[1]
+
+    cellsize = float(values["cellsize"])
+
+    header = {"ncols": int(values["ncols"]),
+              "nrows": int(values["nrows"]),
+              "cellsize": cellsize,
+              "nodata": float(values.get("nodata_value", -9999)),
+              "byteorder": values.get("byteorder", "LSBFIRST").upper()}
+
+    # the lower-left corner may be given as the corner of the cell, or its center
+    for axis in ["x", "y"]:
+        if(axis + "llcorner" in values):
+            header[axis + "llcorner"] = float(values[axis + "llcorner"])
+        else:
+            header[axis + "llcorner"] = float(values[axis + "llcenter"]) - cellsize/2
+
+    return header
+
+
+def read_prj(flt_path):
+
+    """
+    The text of the projection file (.prj) beside a raster, or "" if there is none.
+    """
+
+    prj_path = os.path.splitext(flt_path)[0] + ".prj"
+
+    if(not os.path.exists(prj_path)):
+        return ""
+
+    with open(prj_path) as f:
+        return f.read()
+
+
+def is_geographic(flt_path):
+
+    """
+    True if a raster's .prj describes latitude/longitude (rather than projected) coordinates.
+    """
+
+    return re.search(r"^\s*Projection\s+GEOGRAPHIC|^\s*GEOGCS", read_prj(flt_path),
+                     flags=re.IGNORECASE | re.MULTILINE) is not None
+
+
+def elevation_zone(flt_path):
+
+    """
+    The UTM zone of an NMSIM project's elevation file, from its projection (.prj) if possible,
+    otherwise from the suffix of its name (e.g., elevation_nad83_utm13.flt -> 13).
+    Returns None if neither gives a zone.
+    """
+
+    prj = read_prj(flt_path)
+
+    # either well-known text (PROJCS["NAD_1983_UTM_Zone_13N", ...) or the older key/value style
+    match = re.search(r"UTM_Zone_(\d+)", prj, flags=re.IGNORECASE) or \
+            re.search(r"^\s*Zone\s+(\d+)", prj, flags=re.IGNORECASE | re.MULTILINE)
+
+    if(match is not None):
+        return int(match.group(1))
+
+    # (a geographic raster keeps the zone of the project it was made for in its name)
+    match = re.search(r"utm(\d+)$", os.path.splitext(os.path.basename(flt_path))[0], flags=re.IGNORECASE)
+
+    return int(match.group(1)) if match is not None else None
+
+
+def open_elevation(flt_path):
+
+    """
+    Memory-map an elevation file (.flt) using its header (.hdr). Nothing is read until sampled.
+
+    Inputs
+    ------
+    flt_path (str, path): a GridFloat elevation file
+
+    Returns
+    -------
+    elevation (dict): "data" (a read-only `numpy` memmap of shape (nrows, ncols), north row first),
+                      "path", "zone" (see `elevation_zone`), "geographic" (True if the raster's
+                      coordinates are longitude/latitude), and every item of `read_hdr`
+
+    """
+
+    header = read_hdr(os.path.splitext(flt_path)[0] + ".hdr")
+
+    dtype = "<f4" if header["byteorder"] == "LSBFIRST" else ">f4"
+
+    elevation = dict(header)
+    elevation["path"] = flt_path
+    elevation["zone"] = elevation_zone(flt_path)
+    elevation["geographic"] = is_geographic(flt_path)
+    elevation["data"] = np.memmap(flt_path, dtype=dtype, mode="r", shape=(header["nrows"], header["ncols"]))
+
+    return elevation
+
+
+def extent(elevation):
+
+    """
+    The (xmin, xmax, ymin, ymax) bounds of an elevation raster.
+    """
+
+    xmin = elevation["xllcorner"]
+    ymin = elevation["yllcorner"]
+
+    return (xmin, xmin + elevation["ncols"]*elevation["cellsize"],
+            ymin, ymin + elevation["nrows"]*elevation["cellsize"])
+
+
+def sample_elevation(elevation, x, y, chunk_points=2**20):
+
+    """
+    Bilinear interpolation of the elevation at many points at once.
+
+    Points are handled in chunks, and only the raster rows beneath each
+    chunk are touched, so millions of points can be sampled from a DEM
+    far larger than memory.
+
+    Inputs
+    ------
+    elevation (dict): see `open_elevation`
+    x (numpy array): x coordinates, in the raster's coordinate system
+    y (numpy array): y coordinates, in the raster's coordinate system
+    chunk_points (int): how many points are interpolated at once [default 2**20]
+
+    Returns
+    -------
+    z (numpy array): elevation at each point; NaN outside the raster or next to NODATA cells
+
+    """
+
+    x = np.asarray(x, dtype="float64")
+    y = np.asarray(y, dtype="float64")
+    shape = np.broadcast(x, y).shape
+    x, y = np.broadcast_arrays(x, y)
+    x = x.ravel()
+    y = y.ravel()
+
+    data = elevation["data"]
+    nrows, ncols = data.shape
+    cellsize = elevation["cellsize"]
+    top = elevation["yllcorner"] + nrows*cellsize
+
+    z = np.full(x.size, np.nan)
+    for start in range(0, x.size, chunk_points):
+
+        stop = start + chunk_points
+
+        # fractional (row, column) positions relative to cell centers
+        col = (x[start:stop] - elevation["xllcorner"])/cellsize - 0.5
+        row = (top - y[start:stop])/cellsize - 0.5
+
+        inside = (col >= -0.5) & (col <= ncols - 0.5) & (row >= -0.5) & (row <= nrows - 0.5)
+
+        # half a cell at the edges of the raster is held constant
+        col = np.clip(col, 0, ncols - 1)
+        row = np.clip(row, 0, nrows - 1)
+
+        c0 = np.minimum(np.floor(col).astype("int64"), max(ncols - 2, 0))
+        r0 = np.minimum(np.floor(row).astype("int64"), max(nrows - 2, 0))
+        c1 = np.minimum(c0 + 1, ncols - 1)
+        r1 = np.minimum(r0 + 1, nrows - 1)
+
+        fc = col - c0
+        fr = row - r0
+
+        # the four neighbors (fancy indexing reads only the pages they sit on)
+        z00 = data[r0, c0].astype("float64")
+        z01 = data[r0, c1].astype("float64")
+        z10 = data[r1, c0].astype("float64")
+        z11 = data[r1, c1].astype("float64")
+
+        neighbors = np.stack([z00, z01, z10, z11])
+        invalid = np.any(neighbors == elevation["nodata"], axis=0) | ~inside
+
+        values = (z00*(1 - fc) + z01*fc)*(1 - fr) + (z10*(1 - fc) + z11*fc)*fr
+        values[invalid] = np.nan
+
+        z[start:stop] = values
+
+    return z.reshape(shape)
+
+
+def terrain_profile(elevation, start, end, spacing=None):
+
+    """
+    Sample the terrain along a straight line.
+
+    Inputs
+    ------
+    elevation (dict): see `open_elevation`
+    start (tuple): (x, y) of the beginning of the line
+    end (tuple): (x, y) of the end of the line
+    spacing (float): [optional] distance between samples [default: the raster's cell size]
+
+    Returns
+    -------
+    profile (pandas DataFrame): columns "distance", "x", "y", "elevation"
+
+    """
+
+    if(spacing is None):
+        spacing = elevation["cellsize"]
+
+    length = np.hypot(end[0] - start[0], end[1] - start[1])
+    n = max(int(np.ceil(length/spacing)), 1) + 1
+
+    distance = np.linspace(0, length, n)
+    x = np.linspace(start[0], end[0], n)
+    y = np.linspace(start[1], end[1], n)
+
+    return pd.DataFrame({"distance": distance,
+                         "x": x,
+                         "y": y,
+                         "elevation": sample_elevation(elevation, x, y)})
+
+
+def altitude_AGL(elevation, x, y, z):
+
+    """
+    Altitude above ground level for every point of a trajectory.
+
+    Inputs
+    ------
+    elevation (dict): see `open_elevation`
+    x (numpy array): x coordinates, in the raster's coordinate system
+    y (numpy array): y coordinates, in the raster's coordinate system
+    z (numpy array): altitude in the raster's vertical units (meters MSL for NMSIM)
+
+    Returns
+    -------
+    AGL (numpy array): z minus the terrain beneath each point; NaN off the raster
+
+    """
+
+    return np.asarray(z, dtype="float64") - sample_elevation(elevation, x, y)
@@ -0,0 +1,257 @@
+#-----------------------------------------------------------------------------#
+# NMSIM_Figures.py
+#
+# NPS Natural Sounds Program
+#
+# Draw the figures comparing NMSIM models with acoustic measurements, either
+# one at a time (in a notebook) or as a queue rendered by a pool of worker
+# processes (in a batch run). A figure is described by a plain dictionary of
+# arrays (a "job"), so computing a comparison and drawing it are independent:
+# the workers draw with the non-interactive Agg backend and never display.
+#
+# A job may also ask for a low resolution thumbnail, and a queue can be
+# rendered "missing only", skipping every figure whose image already exists.
+#
+# History:
+#	D. Halyn Betchkal -- Created
+#
+#-----------------------------------------------------------------------------#
+
+# ================ Import Libraries =======================
+
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+
+# ===========================  Define functions  =======================================
+
+def comparison_path(project_dir, title, thumbnail=False):
+
+    '''
+    Where the comparison figure of an event (or its thumbnail) is saved.
+    '''
+
+    suffix = "_comparison_thumb.png" if thumbnail else "_comparison.png"
+
+    return project_dir + os.sep + r"Output_Data\IMAGES" + os.sep + title + suffix
+
+
+def comparison_job(project_dir, title, unit, site, theoretical, event_SPL, dpi=300, thumbnail_dpi=None):
+
+    '''
+    Describe a model vs. measurement figure, without drawing it.
+
+    Inputs
+    ------
+    project_dir (str): the path to a canonical NPS-style NMSIM project directory
+    title (str): the name of the event (the trajectory's file name)
+    unit (str): four letter park service unit code
+    site (str): site code
+    theoretical (numpy array): padded model levels, time x band
+    event_SPL (pandas DataFrame): measured levels, indexed by time, one column per band
+    dpi (int): resolution of the saved figure [default 300]
+    thumbnail_dpi (int): [optional] also save a thumbnail at this resolution [default None]
+
+    Returns
+    -------
+    job (dict): pass to `draw_comparison`, `render_comparison` or `submit_figures`
+
+    '''
+
+    return {"path": comparison_path(project_dir, title),
+            "thumbnail": comparison_path(project_dir, title, thumbnail=True) if thumbnail_dpi is not None else None,
+            "title": title,
+            "label": unit + site,
+            "theoretical": np.asarray(theoretical, dtype="float32"),
+            "measured": event_SPL.to_numpy(dtype="float32"),
+            "bands": [str(b) for b in event_SPL.columns],
+            "start": event_SPL.index[0],
+            "end": event_SPL.index[-1],
+            "dpi": dpi,
+            "thumbnail_dpi": thumbnail_dpi}
+
+
+def draw_comparison(job):
+
+    '''
+    Draw the two panel spectrogram (model above, measurement below) of a comparison job.
+
+    Returns
+    -------
+    fig (matplotlib Figure)
+    '''
+
+    import matplotlib.pyplot as plt
+    import matplotlib.dates as mdates
+
+    n_bands = job["measured"].shape[1]
+    band_labels = np.array(job["bands"]).astype('float')
+
+    fig, ax = plt.subplots(nrows=2, ncols=1, figsize=(18,5), sharex=True)
+
+    # convert the NVSPL's nice datetime axis to numbers
+    x_lims = mdates.date2num([job["start"], job["end"]])
+
+    ax[0].set_title("NMISIM results", loc="left")
+    ax[0].imshow(job["theoretical"].T, aspect='auto', origin='lower',
+                 extent=[x_lims[0], x_lims[-1], 0, n_bands],
+                 cmap='plasma', interpolation=None, vmin=-10, vmax=80, zorder=-5)
+
+    ax[1].set_title("microphone measurement at "+job["label"], loc="left")
+    im = ax[1].imshow(job["measured"].T, aspect='auto', origin='lower',
+                      extent=[x_lims[0], x_lims[-1], 0, n_bands],
+                      cmap='plasma', interpolation=None, vmin=-10, vmax=80)
+
+    for a in ax:
+
+        a.set_yticks(np.arange(n_bands)[::4])
+        a.set_yticklabels(band_labels[::4])
+
+        # tell matplotlib that the numeric axis should be formatted as dates
+        a.xaxis_date()
+        a.xaxis.set_major_formatter(mdates.DateFormatter("%b-%d\n%H:%M")) # tidy them!
+
+    fig.colorbar(im, ax=ax.ravel().tolist(), anchor=(2.2, 0.0))
+    fig.text(1.06, 0.5, "Sound Level (Leq, 1s)", va='center', rotation='vertical', fontsize=10)
+    fig.text(-0.02, 0.55, "Frequency Band (Hz)", va='center', rotation='vertical', fontsize=13)
+
+    fig.suptitle(job["title"], y=1.05, fontsize=17, ha="center")
+
+    fig.tight_layout()
+
+    return fig
+
+
+def save_comparison(fig, job):
+
+    '''
+    Save a drawn comparison figure (and its thumbnail, if the job asks for one).
+    '''
+
+    fig.savefig(job["path"], dpi=job["dpi"], bbox_inches="tight")
+
+    if(job["thumbnail"] is not None):
+        fig.savefig(job["thumbnail"], dpi=job["thumbnail_dpi"], bbox_inches="tight")
+
+
+def is_rendered(job):
+
+    '''
+    True if a job's image (and thumbnail, if asked for) already exist.
+    '''
+
+    return os.path.exists(job["path"]) and ((job["thumbnail"] is None) or os.path.exists(job["thumbnail"]))
+
+
+def use_agg():
+
+    '''
+    Switch a process to the non-interactive Agg backend (worker initializer).
+    '''
+
+    import matplotlib
+    matplotlib.use("Agg", force=True)
+
+
+def render_comparison(job):
+
+    '''
+    Draw and save one comparison job off-screen, then free the figure.
+
+    Returns
+    -------
+    record (dict): "path", "thumbnail" and "seconds" spent rendering
+    '''
+
+    use_agg()
+    import matplotlib.pyplot as plt
+
+    began = time.perf_counter()
+
+    fig = draw_comparison(job)
+    try:
+        save_comparison(fig, job)
+    finally:
+        plt.close(fig)
+
+    return {"path": job["path"], "thumbnail": job["thumbnail"], "seconds": time.perf_counter() - began}
+
+
+def open_figure_pool(processes=1):
+
+    '''
+    A pool of worker processes that draw with the Agg backend.
+    '''
+
+    return ProcessPoolExecutor(max_workers=processes, initializer=use_agg)
+
+
+def submit_figures(pool, jobs, missing_only=False):
+
+    '''
+    Queue comparison jobs on a figure pool.
+
+    Inputs
+    ------
+    pool (concurrent.futures Executor): see `open_figure_pool`
+    jobs (list of dict): see `comparison_job`
+    missing_only (bool): skip jobs whose images already exist [default False]
+
+    Returns
+    -------
+    submitted (list of tuples): the paths and future of each job submitted, see `collect_figures`
+                                (the job's arrays are not kept, so a long queue does not hold them)
+
+    '''
+
+    return [((job["path"], job["thumbnail"]), pool.submit(render_comparison, job))
+            for job in jobs if not (missing_only and is_rendered(job))]
+
+
+def collect_figures(submitted):
+
+    '''
+    Wait for submitted figures and tabulate the outcome of each.
+
+    Returns
+    -------
+    records (pandas DataFrame): columns "path", "thumbnail", "seconds", "ok" and "error"
+    '''
+
+    records = []
+    for (path, thumbnail), future in submitted:
+
+        try:
+            record = future.result()
+            record.update({"ok": True, "error": None})
+        except Exception as e:
+            record = {"path": path, "thumbnail": thumbnail, "seconds": np.nan,
+                      "ok": False, "error": repr(e)}
+
+        records.append(record)
+
+    return pd.DataFrame(records, columns=["path", "thumbnail", "seconds", "ok", "error"])
+
+
+def render_figures(jobs, processes=1, missing_only=False):
+
+    '''
+    Render a queue of comparison jobs in a pool of worker processes.
+
+    Inputs
+    ------
+    jobs (list of dict): see `comparison_job`
+    processes (int): how many figures are drawn at once [default 1]
+    missing_only (bool): skip jobs whose images already exist [default False]
+
+    Returns
+    -------
+    records (pandas DataFrame): see `collect_figures`
+
+    '''
+
+    with open_figure_pool(processes) as pool:
+        return collect_figures(submit_figures(pool, jobs, missing_only=missing_only))
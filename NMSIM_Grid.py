@@ -0,0 +1,337 @@
+#-----------------------------------------------------------------------------#
+# NMSIM_Grid.py
+#
+# NPS Natural Sounds Program
+#
+# Split a grid analysis of a large study area into tiles that run as
+# separate, concurrent NMSIM solver jobs, then merge their grid outputs
+# (.tig) into one result.
+#
+# NMSIM lays an ii_max x jj_max grid of points over the elevation file and
+# can compute any rectangle of it (a "sub-grid"; see Appendices D and F of
+# the NMSIM manual). Each grid point's time history is named iiiijjjj, so
+# every block of every tile knows its place in the full grid. Points are
+# numbered globally in the order of those names: site = (ii - 1)*jj_max + (jj - 1).
+#
+# Every tile has its own site file (its grid points, named iiiijjjj) and,
+# through `NMSIM_Batch`, its own private control and batch files. Tiles run
+# in a pool of solver processes; with a manifest, tiles already computed
+# from identical inputs are skipped, so an interrupted run resumes where it
+# stopped.
+#
+# History:
+#	D. Halyn Betchkal -- Created
+#
+#-----------------------------------------------------------------------------#
+
+# ================ Import Libraries =======================
+
+import os
+import numpy as np
+import pandas as pd
+
+from NMSIM_Batch import write_site_file, solver_job, run_solver_jobs
+from NMSIM_Elevation import open_elevation, extent
+from NMSIM_Manifest import replace_if_changed
+from NMSIM_Results import index_tig, iter_tig_blocks, tig_columns
+
+
+# ===========================  Define functions  =======================================
+
+def grid_point_name(ii, jj):
+
+    '''
+    The name NMSIM gives a grid point's time history (iiiijjjj).
+    '''
+
+    return "{0:04d}{1:04d}".format(int(ii), int(jj))
+
+
+def grid_spec(ii_max, jj_max, ii_left=1, ii_right=None, jj_bottom=1, jj_top=None):
+
+    '''
+    Describe a grid (or a sub-grid of it) for `NMSIM_Batch.write_batch_file`.
+
+    Inputs
+    ------
+    ii_max (int): grid points across (x)
+    jj_max (int): grid points up (y)
+    ii_left, ii_right (int): the first and last column computed (from 1) [default all]
+    jj_bottom, jj_top (int): the first and last row computed (from 1) [default all]
+
+    Returns
+    -------
+    grid (dict)
+
+    '''
+
+    return {"ii_max": int(ii_max),
+            "jj_max": int(jj_max),
+            "ii_left": int(ii_left),
+            "ii_right": int(ii_max if ii_right is None else ii_right),
+            "jj_bottom": int(jj_bottom),
+            "jj_top": int(jj_max if jj_top is None else jj_top)}
+
+
+def grid_tiles(ii_max, jj_max, tile_ii, tile_jj=None):
+
+    '''
+    Split a grid into rectangular tiles of (at most) `tile_ii` x `tile_jj` points.
+
+    Inputs
+    ------
+    ii_max (int): grid points across (x)
+    jj_max (int): grid points up (y)
+    tile_ii (int): columns per tile
+    tile_jj (int): rows per tile [default `tile_ii`]
+
+    Returns
+    -------
+    tiles (pandas DataFrame): one row per tile, with a "tile" name and its sub-grid (see `grid_spec`)
+
+    '''
+
+    if(tile_jj is None):
+        tile_jj = tile_ii
+
+    tiles = []
+    for ii_left in range(1, ii_max + 1, tile_ii):
+        for jj_bottom in range(1, jj_max + 1, tile_jj):
+
+            tile = grid_spec(ii_max, jj_max,
+                             ii_left, min(ii_left + tile_ii - 1, ii_max),
+                             jj_bottom, min(jj_bottom + tile_jj - 1, jj_max))
+            tile["tile"] = "tile_" + grid_point_name(ii_left, jj_bottom)
+
+            tiles.append(tile)
+
+    return pd.DataFrame(tiles, columns=["tile", "ii_max", "jj_max", "ii_left", "ii_right", "jj_bottom", "jj_top"])
+
+
+def grid_points(bounds, grid):
+
+    '''
+    The names and coordinates of the points of a (sub-)grid spanning a study area.
+
+    Each point is the center of one of ii_max x jj_max equal cells of the study area.
+
+    Inputs
+    ------
+    bounds (tuple): (xmin, xmax, ymin, ymax) of the study area, e.g. `NMSIM_Elevation.extent`
+    grid (dict): see `grid_spec`
+
+    Returns
+    -------
+    points (pandas DataFrame): columns "site" (iiiijjjj), "ii", "jj", "x" and "y", in global site order
+
+    '''
+
+    xmin, xmax, ymin, ymax = bounds
+
+    ii, jj = np.meshgrid(np.arange(grid["ii_left"], grid["ii_right"] + 1),
+                         np.arange(grid["jj_bottom"], grid["jj_top"] + 1), indexing="ij")
+    ii = ii.ravel()
+    jj = jj.ravel()
+
+    return pd.DataFrame({"site": [grid_point_name(i, j) for i, j in zip(ii, jj)],
+                         "ii": ii,
+                         "jj": jj,
+                         "x": xmin + (ii - 0.5)*(xmax - xmin)/grid["ii_max"],
+                         "y": ymin + (jj - 0.5)*(ymax - ymin)/grid["jj_max"]})
+
+
+def plan_grid_tiles(out_dir, name, elev_file, trj_file, source_path, ii_max, jj_max, tile_ii, tile_jj=None,
+                    height=1.5, imped_file=None, contour_interval=500.0):
+
+    '''
+    Write a site file for every tile of a grid analysis and describe each tile as a solver job.
+
+    Inputs
+    ------
+    out_dir (str, path): where tile site files and outputs are written
+    name (str): a name for the whole analysis (each tile's output is `name`_tile_iiiijjjj.tig)
+    elev_file (str, path): the elevation file (.flt); the grid spans its extent
+    trj_file (str, path): the trajectory file (.trj)
+    source_path (str, path): the noise source file (.src)
+    ii_max (int): grid points across (x)
+    jj_max (int): grid points up (y)
+    tile_ii (int): columns per tile
+    tile_jj (int): rows per tile [default `tile_ii`]
+    height (float): receiver height above ground (m) [default 1.5]
+    imped_file (str, path): [optional] the impedance file
+    contour_interval (float): contour interval in meters [default 500.0]
+
+    Returns
+    -------
+    tiles (pandas DataFrame): see `grid_tiles`, plus each tile's "site_file" and "tig_path"
+    jobs (list of dict): one "grid" solver job per tile, for `NMSIM_Batch.run_solver_jobs`
+
+    '''
+
+    os.makedirs(out_dir, exist_ok=True)
+
+    bounds = extent(open_elevation(elev_file))
+    tiles = grid_tiles(ii_max, jj_max, tile_ii, tile_jj)
+
+    site_files = []
+    jobs = []
+    for tile in tiles.to_dict("records"):
+
+        grid = {k: tile[k] for k in ["ii_max", "jj_max", "ii_left", "ii_right", "jj_bottom", "jj_top"]}
+        stem = os.path.join(out_dir, name + "_" + tile["tile"])
+
+        # a site file is rewritten only if its points have changed, so the manifest still sees it as up to date
+        points = grid_points(bounds, grid)
+        def write(tmp):
+            write_site_file(tmp, points["x"], points["y"], height, points["site"], elev_file)
+
+        site_file = replace_if_changed(stem + ".sit", write)
+
+        site_files.append(site_file)
+        jobs.append(solver_job(name + "_" + tile["tile"], stem, elev_file, site_file, trj_file, source_path,
+                               imped_file=imped_file, contour_interval=contour_interval,
+                               analysis="grid", grid=grid))
+
+    tiles["site_file"] = site_files
+    tiles["tig_path"] = [job["out_path"] + ".tig" for job in jobs]
+
+    return tiles, jobs
+
+
+def index_grid_tiles(tig_paths, jj_max):
+
+    '''
+    Index the grid points of many tiles (.tig) and number them globally.
+
+    Inputs
+    ------
+    tig_paths (list of str): the tiles' grid outputs
+    jj_max (int): grid points up (y) of the full grid
+
+    Returns
+    -------
+    index (pandas DataFrame): `NMSIM_Results.index_tig` of every tile, plus "tile" (its position in `tig_paths`),
+                              "ii", "jj" and "site_number" (the point's row in the merged result)
+
+    '''
+
+    indices = []
+    for k, tig_path in enumerate(tig_paths):
+
+        index = index_tig(tig_path)
+        index["tile"] = k
+        indices.append(index)
+
+    index = pd.concat(indices, ignore_index=True)
+
+    index["ii"] = index["site"].str[:4].astype("int")
+    index["jj"] = index["site"].str[4:8].astype("int")
+    index["site_number"] = (index["ii"] - 1)*jj_max + (index["jj"] - 1)
+
+    if(index["site_number"].duplicated().any()):
+        raise ValueError("Some grid points appear in more than one tile: " +
+                         ", ".join(index.loc[index["site_number"].duplicated(), "site"].head().tolist()))
+
+    return index
+
+
+def merge_grid_tiles(tig_paths, ii_max, jj_max, out=None, dtype="float32", nodata=np.nan):
+
+    '''
+    Merge the grid outputs of many tiles into one (site, time step, column) array, numbered globally.
+
+    Tiles are decoded one grid point at a time and written straight into `out`,
+    so when `out` is a file path the merged result never has to fit in memory.
+
+    Inputs
+    ------
+    tig_paths (list of str): the tiles' grid outputs
+    ii_max (int): grid points across (x) of the full grid
+    jj_max (int): grid points up (y) of the full grid
+    out (str, path): [optional] a `.npy` path for the result (opened as a `numpy` memory map) [default in memory]
+    dtype (str or numpy dtype): the output data type [default "float32"]
+    nodata (float): the value used for anything NMSIM did not compute [default np.nan]
+
+    Returns
+    -------
+    index (pandas DataFrame): one row per point of the full grid, in global order: "site" (iiiijjjj), "ii", "jj",
+                              "zone", "x", "y", "n_rows" and "tile" (NaN coordinates and tile for any point no tile computed)
+    levels (numpy array or memmap): shape (ii_max*jj_max, time steps, 36); see `NMSIM_Results.tig_columns`.
+                                    Points with fewer time steps than the longest (or none) are padded with NaN.
+
+    '''
+
+    tile_index = index_grid_tiles(tig_paths, jj_max)
+
+    shape = (ii_max*jj_max, int(tile_index["n_rows"].max()) if len(tile_index) > 0 else 0, len(tig_columns))
+
+    if(out is None):
+        levels = np.full(shape, np.nan, dtype=dtype)
+    else:
+        levels = np.lib.format.open_memmap(out, mode="w+", dtype=dtype, shape=shape)
+        levels[:] = np.nan
+
+    for k, tig_path in enumerate(tig_paths):
+
+        index = tile_index.loc[tile_index["tile"] == k].reset_index(drop=True)
+        site_numbers = index["site_number"].values
+
+        for i, block in iter_tig_blocks(tig_path, index=index, dtype=dtype, nodata=nodata):
+            levels[site_numbers[i], :len(block)] = block[:, 1:]
+
+    if(isinstance(levels, np.memmap)):
+        levels.flush()
+
+    # one row per point of the full grid, even those no tile computed
+    ii, jj = np.meshgrid(np.arange(1, ii_max + 1), np.arange(1, jj_max + 1), indexing="ij")
+    index = pd.DataFrame({"site": [grid_point_name(i, j) for i, j in zip(ii.ravel(), jj.ravel())],
+                          "ii": ii.ravel(),
+                          "jj": jj.ravel()})
+
+    index = index.join(tile_index.set_index("site_number")[["zone", "x", "y", "n_rows", "tile"]])
+    index["n_rows"] = index["n_rows"].fillna(0).astype("int")
+
+    return index, levels
+
+
+def simulate_grid(out_dir, name, elev_file, trj_file, source_path, ii_max, jj_max, tile_ii, tile_jj=None,
+                  height=1.5, imped_file=None, contour_interval=500.0, NMSIMpath=None, processes=None,
+                  timeout=None, retries=0, manifest=None, force=False, merged=None):
+
+    '''
+    Run a grid analysis as tiles in a pool of solver processes, then merge the tiles.
+
+    Inputs
+    ------
+    [`out_dir` through `contour_interval` as for `plan_grid_tiles`]
+    NMSIMpath (str, path, or list): [optional] the solver command, see `NMSIM_Batch.find_Nord2000batch`
+    processes (int): tiles computed at once [default: the number of CPUs]
+    timeout (float): [optional] seconds before a tile's attempt is killed
+    retries (int): how many times to re-run a failed tile [default 0]
+    manifest (str, path): [optional] a build manifest (.json); tiles it shows are up to date are not run again
+    force (bool): run every tile, even those the manifest says are up to date [default False]
+    merged (str, path): [optional] a `.npy` path for the merged result [default in memory]
+
+    Returns
+    -------
+    runs (pandas DataFrame): `NMSIM_Batch.run_solver_jobs` of every tile
+    index (pandas DataFrame): see `merge_grid_tiles`
+    levels (numpy array or memmap): see `merge_grid_tiles`
+
+    '''
+
+    tiles, jobs = plan_grid_tiles(out_dir, name, elev_file, trj_file, source_path, ii_max, jj_max, tile_ii, tile_jj,
+                                  height=height, imped_file=imped_file, contour_interval=contour_interval)
+
+    runs = run_solver_jobs(jobs, NMSIMpath=NMSIMpath, processes=processes, timeout=timeout, retries=retries,
+                           manifest=manifest, force=force)
+
+    if(not runs["ok"].all()):
+        failed = runs.loc[~runs["ok"]]
+        raise RuntimeError("{0:d} of {1:d} tiles failed (first: {2}, scratch kept at {3})".format(len(failed), len(runs),
+                                                                                               failed["name"].iloc[0],
+                                                                                               failed["scratch"].iloc[0]))
+
+    index, levels = merge_grid_tiles(tiles["tig_path"].tolist(), ii_max, jj_max, out=merged)
+
+    return runs, index, levels
@@ -0,0 +1,233 @@
+#-----------------------------------------------------------------------------#
+# NMSIM_Manifest.py
+#
+# NPS Natural Sounds Program
+#
+# A build manifest for NMSIM runs, kept as a JSON file in the project
+# directory. For every output (.tis or .tig) it records a fingerprint of
+# each input that produced it - elevation, impedance, site, trajectory and
+# source files, plus the solver options - and the size and modification
+# time of the output itself. A run whose fingerprint is unchanged, and whose
+# output is still the file that run wrote, does not need to be repeated.
+#
+# Inputs are fingerprinted by content (SHA-1). To keep that cheap for large
+# elevation files, each hash is remembered with the size and modification
+# time it was computed at, and only recomputed when those change.
+#
+# History:
+#	D. Halyn Betchkal -- Created
+#
+#-----------------------------------------------------------------------------#
+
+# ================ Import Libraries =======================
+
+import os
+import json
+
+from NMSIM_Cache import file_hash
+
+
+# the input files of a solver job (see `NMSIM_Batch.solver_job`) that determine its output
+input_keys = ["elev_file", "imped_file", "site_file", "trj_file", "source_path"]
+
+# options of a solver job that change its output
+option_keys = ["analysis", "contour_interval"]
+
+
+# ===========================  Define functions  =======================================
+
+def manifest_path(project_dir):
+
+    '''
+    The manifest of a canonical NPS-style NMSIM project directory.
+    '''
+
+    return os.path.join(project_dir, "NMSIM_manifest.json")
+
+
+def load_manifest(path):
+
+    '''
+    Read a manifest, or start an empty one if the file does not exist yet.
+
+    Returns
+    -------
+    manifest (dict): "files" (path -> size, mtime and hash) and "outputs" (output path -> record)
+
+    '''
+
+    if(os.path.exists(path)):
+        with open(path) as f:
+            manifest = json.load(f)
+    else:
+        manifest = {}
+
+    manifest.setdefault("files", {})
+    manifest.setdefault("outputs", {})
+
+    return manifest
+
+
+def save_manifest(manifest, path):
+
+    '''
+    Write a manifest atomically, so an interrupted run never leaves it half-written.
+    '''
+
+    tmp = path + ".{0}.tmp".format(os.getpid())
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+
+    os.replace(tmp, path)
+
+
+def same_content(path_a, path_b):
+
+    '''
+    True if two files exist and hold the same bytes.
+    '''
+
+    if(not (os.path.exists(path_a) and os.path.exists(path_b))):
+        return False
+
+    if(os.path.getsize(path_a) != os.path.getsize(path_b)):
+        return False
+
+    with open(path_a, "rb") as a, open(path_b, "rb") as b:
+        return a.read() == b.read()
+
+
+def replace_if_changed(path, write):
+
+    '''
+    Write a file through `write(tmp_path)`, replacing `path` only if the content differs,
+    so the manifest still sees an unchanged input as up to date.
+
+    Inputs
+    ------
+    path (str, path): the file to (re)write
+    write (function): called as write(tmp_path); writes the new content to `tmp_path`
+
+    Returns
+    -------
+    path (str, path)
+
+    '''
+
+    tmp = path + ".{0}.tmp".format(os.getpid())
+    write(tmp)
+
+    if(same_content(tmp, path)):
+        os.remove(tmp)
+    else:
+        os.replace(tmp, path)
+
+    return path
+
+
+def stat_key(path):
+
+    '''
+    The size and modification time of a file (None if it does not exist).
+    '''
+
+    if(not os.path.exists(path)):
+        return None
+
+    stat = os.stat(path)
+
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def file_fingerprint(path, manifest):
+
+    '''
+    The content hash of an input file, reusing the manifest's hash if the file has not changed.
+    '''
+
+    if(path is None):
+        return None
+
+    path = os.path.abspath(path)
+    stat = stat_key(path)
+
+    if(stat is None):
+        return None
+
+    known = manifest["files"].get(path)
+
+    if((known is None) or (known["stat"] != stat)):
+        known = {"stat": stat, "sha1": file_hash(path)}
+        manifest["files"][path] = known
+
+    return known["sha1"]
+
+
+def job_fingerprint(job, manifest):
+
+    '''
+    Fingerprint everything that determines a solver job's output.
+
+    Inputs
+    ------
+    job (dict): as returned by `NMSIM_Batch.solver_job`
+    manifest (dict): see `load_manifest`
+
+    Returns
+    -------
+    fingerprint (dict): input name -> content hash, and option name -> value
+
+    '''
+
+    fingerprint = {key: file_fingerprint(job[key], manifest) for key in input_keys}
+
+    # a GridFloat elevation (.flt) is georeferenced by the header beside it
+    if(job["elev_file"].lower().endswith(".flt")):
+        fingerprint["elev_header"] = file_fingerprint(job["elev_file"][:-4] + ".hdr", manifest)
+    fingerprint.update({key: job[key] for key in option_keys})
+
+    # the sub-grid of a grid job (site jobs have none, and their fingerprints are unchanged)
+    if(job.get("grid") is not None):
+        fingerprint["grid"] = dict(job["grid"])
+
+    return fingerprint
+
+
+def output_path(job):
+
+    '''
+    The file a solver job writes (NMSIM appends the extension itself).
+    '''
+
+    return job["out_path"] + (".tig" if job["analysis"] == "grid" else ".tis")
+
+
+def is_up_to_date(job, manifest, fingerprint=None):
+
+    '''
+    True if a job's output exists, is the file its last run wrote, and was made from identical inputs.
+    '''
+
+    output = os.path.abspath(output_path(job))
+    record = manifest["outputs"].get(output)
+
+    if((record is None) or (stat_key(output) is None) or (record["output_stat"] != stat_key(output))):
+        return False
+
+    if(fingerprint is None):
+        fingerprint = job_fingerprint(job, manifest)
+
+    return record["inputs"] == fingerprint
+
+
+def record_output(job, fingerprint, manifest):
+
+    '''
+    Note that a job's output was just (re)built from inputs with this fingerprint.
+    '''
+
+    output = os.path.abspath(output_path(job))
+
+    manifest["outputs"][output] = {"inputs": fingerprint,
+                                   "output_stat": stat_key(output)}
+
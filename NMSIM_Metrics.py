@@ -0,0 +1,408 @@
+#-----------------------------------------------------------------------------#
+# NMSIM_Metrics.py
+#
+# NPS Natural Sounds Program
+#
+# Acoustic metrics for every receiver of a grid-based model at once.
+# The input is a (site, time step, column) array laid out as `tig_columns`
+# (i.e., as returned by `NMSIM_Results.read_tig`): time, flat and A-weighted
+# levels, 32 one-third octave bands and D-prime, in decibels, with NaN for
+# anything NMSIM did not compute (or for padding past a site's last step).
+#
+# Each metric is computed with whole-array `numpy` operations. Several
+# metrics can be computed in a single sweep with `grid_metrics`, which reads
+# each block of sites once and shares the intermediate results (time step
+# durations, energies, sorted levels) between all of the metrics requested.
+#
+# Metrics are named by the same aliases used for output rasters:
+#	"LA50"          the level (LAeq,*) exceeded 50% of the time
+#	"LT90"          the truncated (12.5 - 1250 Hz) level exceeded 90% of the time
+#	"TA35"          the time (s) at or above 35 dBA
+#	"TA35_percent"  the same, as a percentage of the model duration
+#	"SEL"           the A-weighted sound exposure level
+#	"LAeq"          the A-weighted equivalent continuous level
+#	"LFeq"          the flat (unweighted) equivalent continuous level
+#
+# History:
+#	D. Halyn Betchkal -- Created
+#
+#-----------------------------------------------------------------------------#
+
+# ================ Import Libraries =======================
+
+import re
+import numpy as np
+import pandas as pd
+
+from NMSIM_Results import bands, tig_columns
+
+
+# the position of each column in a (site, time step, column) array
+TIME = tig_columns.index("TIME")
+F = tig_columns.index("F")
+A = tig_columns.index("A")
+band_slice = slice(tig_columns.index(bands[0]), tig_columns.index(bands[-1]) + 1)
+
+# nominal A-weighting corrections (dB) for each one-third octave band in `bands` (IEC 61672-1)
+A_weights = np.array([-70.4, -63.4, -56.7, -50.5, -44.7, -39.4, -34.6, -30.2, -26.2, -22.5, -19.1,
+                      -16.1, -13.4, -10.9, -8.6, -6.6, -4.8, -3.2, -1.9, -0.8, 0.0, 0.6, 1.0, 1.2,
+                      1.3, 1.2, 1.0, 0.5, -0.1, -1.1, -2.5, -4.3], dtype="float32")
+
+# the truncated (or 'traffic') bands used by LTx
+LT_bands = ("12.5", "1250")
+
+# the level given to time steps with no energy at all in the bands summed
+silent = -99.9
+
+
+# ===========================  Define functions  =======================================
+
+def energy(levels):
+
+    """
+    Relative energy (10^(L/10)) of levels in decibels, with NaN treated as no energy.
+    """
+
+    return np.nan_to_num(np.power(np.float32(10), levels/np.float32(10)), nan=0.0)
+
+
+def band_total(levels, low=bands[0], high=bands[-1], weighting=None):
+
+    """
+    The energetic sum of a range of one-third octave bands at each time step.
+
+    Inputs
+    ------
+    levels (numpy array): shape (sites, time steps, 36); see `tig_columns`
+    low (str): the lowest band included [default "10"]
+    high (str): the highest band included [default "12500"]
+    weighting (str): None for flat, or "A" to apply `A_weights` before summing [default None]
+
+    Returns
+    -------
+    total (numpy array): shape (sites, time steps), in decibels. Steps with no energy are
+                         `silent` (-99.9 dB), padding steps (no time) are NaN.
+
+    """
+
+    b0 = bands.index(low)
+    b1 = bands.index(high) + 1
+    spectrum = levels[:, :, band_slice][:, :, b0:b1]
+
+    if(weighting == "A"):
+        spectrum = spectrum + A_weights[b0:b1]
+    elif(weighting is not None):
+        raise ValueError("Unknown weighting '{0}'; use None or 'A'.".format(weighting))
+
+    with np.errstate(divide="ignore"):
+        total = 10*np.log10(energy(spectrum).sum(axis=2, dtype="float64")).astype("float32")
+
+    total[np.isneginf(total)] = silent
+    total[np.isnan(levels[:, :, TIME])] = np.nan
+
+    return total
+
+
+def time_step_durations(levels):
+
+    """
+    The duration (s) of each time step, shape (sites, time steps - 1). Each time step
+    is slightly different (annoying but true); padding steps have zero duration.
+    """
+
+    return np.nan_to_num(np.diff(levels[:, :, TIME], axis=1), nan=0.0)
+
+
+def sorted_percentiles(sorted_values, n_valid, q):
+
+    """
+    Percentiles along axis 1 of an array already sorted with NaN last, interpolated
+    linearly exactly as `np.nanpercentile`, but without a Python loop over sites.
+
+    Inputs
+    ------
+    sorted_values (numpy array): shape (sites, time steps), sorted along axis 1
+    n_valid (numpy array): the number of non-NaN values in each row
+    q (float): the percentile (0 - 100)
+
+    Returns
+    -------
+    values (numpy array): shape (sites,); NaN where a row has no values
+
+    """
+
+    position = (q/100)*np.maximum(n_valid - 1, 0)
+    lo = np.floor(position).astype("int64")
+    hi = np.minimum(lo + 1, np.maximum(n_valid - 1, 0))
+    fraction = (position - lo).astype("float32")
+
+    below = np.take_along_axis(sorted_values, lo[:, np.newaxis], axis=1)[:, 0]
+    above = np.take_along_axis(sorted_values, hi[:, np.newaxis], axis=1)[:, 0]
+
+    values = below + fraction*(above - below)
+    values[n_valid == 0] = np.nan
+
+    return values
+
+
+def parse_alias(alias):
+
+    """
+    Split a metric alias (e.g., "LA50", "TA35_percent") into its name and parameter,
+    and return the metadata describing it.
+
+    Returns
+    -------
+    name (str): one of "LAx", "LTx", "TimeAbove", "SEL", "Leq"
+    parameter (float or str): the exceedance, threshold, or weighting (None for SEL)
+    meta (dict): 'full', 'alias' and 'unit', as used to label figures and rasters
+
+    """
+
+    match = re.fullmatch(r"(LA|LT|TA)(\d+(?:\.\d+)?)(_percent)?", alias)
+
+    if(match is not None):
+
+        kind, number, percent = match.groups()
+        x = float(number)
+
+        if(kind == "TA"):
+
+            full = "Time Above $LA_{eq,*} =$" + " {0:.1f} dB".format(x)
+            unit = "Time Above (% of event duration)" if percent else "Time Above (seconds)"
+
+            return "TimeAbove", x, {'full': full, 'alias': alias, 'unit': unit}
+
+        elif(percent is None):
+
+            percentile = "{0:.0f}th percentile".format(100 - x)
+            full = percentile + (" $LA_{eq,*}$" if kind == "LA" else " $LT_{eq,*}$")
+
+            return kind + "x", x, {'full': full, 'alias': alias, 'unit': "dB"}
+
+    elif(alias == "SEL"):
+
+        return "SEL", None, {'full': "Sound Exposure Level", 'alias': alias, 'unit': "dB"}
+
+    elif(alias in ["LAeq", "LFeq"]):
+
+        weighting = alias[1]
+        full = "Equivalent Continuous Sound Level $L_{" + weighting + "eq}$"
+
+        return "Leq", weighting, {'full': full, 'alias': alias, 'unit': "dB"}
+
+    raise ValueError("Unknown metric '{0}'.".format(alias))
+
+
+def block_metrics(block, aliases):
+
+    """
+    Compute every metric in `aliases` for one block of sites, sharing intermediate results.
+
+    Inputs
+    ------
+    block (numpy array): shape (sites, time steps, 36); see `tig_columns`
+    aliases (list of str): metric aliases, see `parse_alias`
+
+    Returns
+    -------
+    values (dict): alias -> numpy array of shape (sites,)
+
+    """
+
+    shared = {}
+
+    # each intermediate result is computed the first time a metric needs it
+    def get(name):
+
+        if(name not in shared):
+
+            if(name == "durations"):
+                shared[name] = time_step_durations(block)
+
+            elif(name == "total_time"):
+                shared[name] = get("durations").sum(axis=1, dtype="float64")
+
+            elif(name in ["exposure_A", "exposure_F"]):
+                column = A if name == "exposure_A" else F
+                shared[name] = (get("durations")*energy(block[:, :-1, column])).sum(axis=1, dtype="float64")
+
+            elif(name in ["sorted_LA", "sorted_LT"]):
+                values = block[:, :, A] if name == "sorted_LA" else band_total(block, *LT_bands)
+                shared[name] = (np.sort(values, axis=1), np.count_nonzero(~np.isnan(values), axis=1))
+
+        return shared[name]
+
+    values = {}
+    with np.errstate(divide="ignore", invalid="ignore"):
+
+        for alias in aliases:
+
+            name, x, meta = parse_alias(alias)
+
+            if(name in ["LAx", "LTx"]):
+
+                # exceedance x% is the (100 - x)th percentile
+                sorted_values, n_valid = get("sorted_" + name[:2])
+                values[alias] = sorted_percentiles(sorted_values, n_valid, 100 - x)
+
+            elif(name == "TimeAbove"):
+
+                above = (block[:, :-1, A] >= x)
+                time_above = (get("durations")*above).sum(axis=1, dtype="float64")
+
+                if(alias.endswith("_percent")):
+                    values[alias] = 100*time_above/get("total_time")
+                else:
+                    values[alias] = time_above
+
+            elif(name == "SEL"):
+
+                values[alias] = 10*np.log10(get("exposure_A"))
+
+            elif(name == "Leq"):
+
+                values[alias] = 10*np.log10(get("exposure_" + x)/get("total_time"))
+
+    return values
+
+
+def fill_missing(values):
+
+    """
+    Replace NaN and -inf with the minimum finite value. It's necessary for 'cubic'
+    interpolation; unfortunately this affects the interpolation results (minorly).
+    """
+
+    finite = np.isfinite(values)
+
+    if(not finite.any()):
+        return values
+
+    min_existing = values[finite].min()
+
+    return np.nan_to_num(values, nan=min_existing, neginf=min_existing)
+
+
+def grid_metrics(levels, aliases, fill=True, chunk_sites=512):
+
+    """
+    Compute several metrics for every site in a single sweep over the data.
+
+    Sites are processed in blocks, so `levels` may be a `numpy` memory map
+    (e.g., from `NMSIM_Cache.cached_tig`) much larger than memory; each block
+    is read once no matter how many metrics are requested.
+
+    Inputs
+    ------
+    levels (numpy array or memmap): shape (sites, time steps, 36); see `tig_columns`
+    aliases (list of str): metric aliases, e.g. ["LA50", "LT90", "TA35", "SEL"]; see `parse_alias`
+    fill (bool): replace missing values with the minimum of each metric, see `fill_missing`
+                 (time above is never filled) [default True]
+    chunk_sites (int): how many sites are processed at once [default 512]
+
+    Returns
+    -------
+    values (pandas DataFrame): one row per site (numbered from 1), one column per alias
+    meta (dict): alias -> {'full', 'alias', 'unit'}
+
+    """
+
+    if(isinstance(aliases, str)):
+        aliases = [aliases]
+
+    # validate every alias before any work is done
+    meta = {alias: parse_alias(alias)[2] for alias in aliases}
+
+    n_sites = levels.shape[0]
+    values = {alias: np.empty(n_sites, dtype="float32") for alias in aliases}
+
+    for start in range(0, n_sites, chunk_sites):
+
+        block = np.asarray(levels[start:start+chunk_sites], dtype="float32")
+
+        for alias, v in block_metrics(block, aliases).items():
+            values[alias][start:start+len(block)] = v
+
+    if(fill):
+        for alias in aliases:
+            if(parse_alias(alias)[0] != "TimeAbove"):
+                values[alias] = fill_missing(values[alias])
+
+    return pd.DataFrame(values, index=pd.Index(np.arange(1, n_sites+1), name="site")), meta
+
+
+def single_metric(levels, alias, fill=True):
+
+    """
+    One metric as a (values, meta) pair - the convention of the .tig notebook.
+    """
+
+    values, meta = grid_metrics(levels, [alias], fill=fill)
+
+    return values[alias].values, meta[alias]
+
+
+def LAx(levels, x=10, fill=True):
+
+    '''
+    Return exceedance level LAx,* i.e., "the level exceeded x% of the time",
+    and the "*" indicates an undefined integration time (in our case, it should
+    usually be about 1-2 seconds.)
+    '''
+
+    return single_metric(levels, "LA{0:g}".format(x), fill=fill)
+
+
+def LTx(levels, x=10, fill=True):
+
+    '''
+    Return exceedance level LTx,* i.e., "the level exceeded x% of the time".
+    The 'T' stands for 'truncated' or 'traffic'; it is the band from 12.5 - 1250 Hz.
+    '''
+
+    return single_metric(levels, "LT{0:g}".format(x), fill=fill)
+
+
+def TimeAbove(levels, threshold=35.0, return_as_time=True):
+
+    '''
+    Tabulate the time equal-to or exceeding an A-weighted sound level threshold for each site.
+
+    Inputs
+    ------
+    levels (numpy array): shape (sites, time steps, 36); see `tig_columns`
+    threshold (float): a sound level threshold [default 35.0]
+    return_as_time (bool): if True - the duration above the threshold, in seconds;
+                           if False - the percentage of the model duration above the threshold
+
+    Returns
+    -------
+    values (numpy array): one value per site
+    meta (dict)
+
+    '''
+
+    alias = "TA{0:g}".format(threshold) + ("" if return_as_time else "_percent")
+
+    return single_metric(levels, alias, fill=False)
+
+
+def SEL(levels, fill=True):
+
+    '''
+    Tabulate the Sound Exposure Level (SEL) for each site. SEL is a way of measuring
+    the overall 'noise dose' at a location.
+    '''
+
+    return single_metric(levels, "SEL", fill=fill)
+
+
+def Leq(levels, weighting="A", fill=True):
+
+    '''
+    Tabulate the equivalent continuous level (the energetic average over the
+    model duration) for each site, "A"-weighted or "F"lat.
+    '''
+
+    return single_metric(levels, "L" + weighting + "eq", fill=fill)
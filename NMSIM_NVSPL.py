@@ -0,0 +1,383 @@
+#-----------------------------------------------------------------------------#
+# NMSIM_NVSPL.py
+#
+# NPS Natural Sounds Program
+#
+# Load acoustic measurements (NVSPL: one file of 1-second, 1/3rd octave band
+# levels per site-hour) for many events at once. Each hour file is read a
+# single time into `numpy` arrays (a nanosecond time axis and float32 band
+# levels) and kept in a store; any event window is then sliced out of the
+# resident hours by binary search on the time axis.
+#
+# Events are grouped by day, and all the hours a day's events need are read
+# concurrently in a thread pool. At most `max_hours` hours stay resident;
+# the least recently used are dropped first.
+#
+# Which times a deployment's record covers at all is answered by a coverage
+# index (`coverage_index`): the files' hours merged into sorted, disjoint
+# intervals, searched for every flight at once.
+#
+# Times are those of the NVSPL files themselves (local time).
+#
+# History:
+#	D. Halyn Betchkal -- Created
+#
+#-----------------------------------------------------------------------------#
+
+# ================ Import Libraries =======================
+
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+
+
+# NVSPL band columns look like H12p5, H1000, H20000
+band_pattern = re.compile(r"^H\d+(p\d+)?$")
+
+
+# ===========================  Define functions  =======================================
+
+def band_label(column):
+
+    '''
+    The NMSIM-style label of an NVSPL band column (e.g., H12p5 -> 12.5).
+    '''
+
+    return column[1:].replace("p", ".")
+
+
+def read_nvspl_hour(path):
+
+    '''
+    Read the time axis and band levels of one NVSPL file.
+
+    Inputs
+    ------
+    path (str, path): an NVSPL file
+
+    Returns
+    -------
+    hour (tuple): times (numpy int64, nanoseconds), levels (numpy float32, time x band)
+                  and band labels (list of str, e.g. "12.5")
+
+    '''
+
+    nv = pd.read_csv(path, usecols=lambda c: (c == "STime") or (band_pattern.match(c) is not None))
+
+    band_columns = [c for c in nv.columns if c != "STime"]
+
+    times = pd.to_datetime(nv["STime"]).values.astype("datetime64[ns]").astype("int64")
+    levels = nv[band_columns].to_numpy(dtype="float32")
+
+    # the rows of a file should be in order, but just in case...
+    order = np.argsort(times, kind="stable")
+
+    return times[order], levels[order], [band_label(c) for c in band_columns]
+
+
+def open_nvspl_store(ds, unit, site, max_hours=48, threads=4):
+
+    '''
+    Start an empty store of NVSPL hours for one site.
+
+    Inputs
+    ------
+    ds (iyore Dataset): the acoustic archive
+    unit (str): four letter park service unit code
+    site (str): site code
+    max_hours (int): how many hours may stay resident (least recently used are dropped) [default 48]
+    threads (int): how many hour files are read at once [default 4]
+
+    Returns
+    -------
+    store (dict): pass to `load_hours`, `preload_windows` and `nvspl_window`
+
+    '''
+
+    return {"ds": ds,
+            "unit": unit,
+            "site": site,
+            "max_hours": max_hours,
+            "threads": threads,
+            "hours": OrderedDict(),
+            "lock": threading.Lock(),
+            "reads": 0}
+
+
+def window_hours(start, end):
+
+    '''
+    The hours (as Timestamps) touched by a time window.
+    '''
+
+    hour = pd.Timedelta(hours=1)
+
+    return list(pd.date_range(pd.Timestamp(start).floor(hour), pd.Timestamp(end).floor(hour), freq=hour))
+
+
+def hour_paths(store, hours):
+
+    '''
+    Find the NVSPL file of each hour (None if the archive has none).
+    '''
+
+    paths = {h: None for h in hours}
+
+    # one query of the archive per day
+    for day, day_hours in pd.Series(hours, index=hours).groupby(lambda h: h.date()):
+
+        entries = store["ds"].nvspl(unit=store["unit"],
+                                    site=store["site"],
+                                    year=day.year,
+                                    month=str(day.month).zfill(2),
+                                    day=str(day.day).zfill(2),
+                                    hour=[str(h.hour).zfill(2) for h in day_hours])
+
+        for e in entries:
+            hour = pd.Timestamp(year=day.year, month=day.month, day=day.day, hour=int(e.hour))
+            if(hour in paths):
+                paths[hour] = e.path
+
+    return paths
+
+
+def load_hours(store, hours):
+
+    '''
+    Make sure each hour is resident, reading the missing ones concurrently.
+
+    Hours without an NVSPL file are remembered as such, so they are not looked
+    for again. The hours asked for are always kept, even beyond `max_hours`.
+    '''
+
+    with store["lock"]:
+        missing = [h for h in hours if h not in store["hours"]]
+
+    if(len(missing) > 0):
+
+        paths = hour_paths(store, missing)
+        found = [h for h in missing if paths[h] is not None]
+
+        with ThreadPoolExecutor(max_workers=max(min(store["threads"], len(found)), 1)) as pool:
+            loaded = dict(zip(found, pool.map(lambda h: read_nvspl_hour(paths[h]), found)))
+
+        with store["lock"]:
+            store["reads"] += len(found)
+            for h in missing:
+                store["hours"][h] = loaded.get(h)
+
+    with store["lock"]:
+
+        # mark these hours as the most recently used...
+        for h in hours:
+            store["hours"].move_to_end(h)
+
+        # ...then drop the least recently used beyond the limit
+        keep = set(hours)
+        while(len(store["hours"]) > store["max_hours"]):
+            oldest = next(iter(store["hours"]))
+            if(oldest in keep):
+                break
+            store["hours"].popitem(last=False)
+
+
+def preload_windows(store, windows):
+
+    '''
+    Read every hour a set of event windows needs, one day at a time,
+    so that each day's files are read once however many events it holds.
+
+    Inputs
+    ------
+    store (dict): see `open_nvspl_store`
+    windows (list of tuples): (start, end) of each event
+
+    Returns
+    -------
+    None
+
+    '''
+
+    hours = sorted(set(h for start, end in windows for h in window_hours(start, end)))
+
+    for day, day_hours in pd.Series(hours, index=hours).groupby(lambda h: h.date()):
+        load_hours(store, list(day_hours))
+
+
+def nvspl_window(store, start, end, bands=None):
+
+    '''
+    The measured levels between two times (inclusive).
+
+    Inputs
+    ------
+    store (dict): see `open_nvspl_store`
+    start (datetime): beginning of the window (local time)
+    end (datetime): end of the window (local time)
+    bands (list of str): [optional] band labels to return, e.g. ["12.5", "16", ...];
+                         bands missing from the files are NaN [default all bands of the files]
+
+    Returns
+    -------
+    SPL (pandas DataFrame): levels (dB) indexed by time, one column per band
+
+    '''
+
+    hours = window_hours(start, end)
+    load_hours(store, hours)
+
+    with store["lock"]:
+        resident = [store["hours"][h] for h in hours if store["hours"].get(h) is not None]
+
+    if(bands is None):
+        bands = resident[0][2] if len(resident) > 0 else []
+
+    lo = pd.Timestamp(start).value
+    hi = pd.Timestamp(end).value
+
+    times = []
+    levels = []
+    for t, spl, labels in resident:
+
+        # binary search for the part of this hour inside the window
+        i0 = np.searchsorted(t, lo, side="left")
+        i1 = np.searchsorted(t, hi, side="right")
+
+        position = {b: i for i, b in enumerate(labels)}
+        chunk = np.full((i1 - i0, len(bands)), np.nan, dtype="float32")
+        for j, b in enumerate(bands):
+            if(b in position):
+                chunk[:, j] = spl[i0:i1, position[b]]
+
+        times.append(t[i0:i1])
+        levels.append(chunk)
+
+    if(len(times) == 0):
+        return pd.DataFrame(np.empty((0, len(bands)), dtype="float32"), columns=bands,
+                            index=pd.DatetimeIndex([]))
+
+    return pd.DataFrame(np.vstack(levels), columns=bands,
+                        index=pd.DatetimeIndex(np.concatenate(times).astype("datetime64[ns]")))
+
+
+def to_ns(times):
+
+    '''
+    Times as int64 nanoseconds of wall-clock time (any time zone is dropped, not converted).
+    '''
+
+    times = pd.to_datetime(pd.Series(np.atleast_1d(np.asarray(times))))
+
+    if(times.dt.tz is not None):
+        times = times.dt.tz_localize(None)
+
+    return times.values.astype("datetime64[ns]").astype("int64")
+
+
+def coverage_index(hour_starts, length=pd.Timedelta(hours=1)):
+
+    '''
+    Build an index of the times an acoustic record covers, from the start of each of its files.
+
+    Overlapping or abutting files are merged, so the index is a sorted set of
+    disjoint intervals that `covered_seconds` and `coverage_fraction` search.
+
+    Inputs
+    ------
+    hour_starts (list or pandas Series of datetimes): the start time of every NVSPL file
+    length (pandas Timedelta): the duration of one file [default one hour]
+
+    Returns
+    -------
+    index (dict): "lo", "hi" (int64 nanoseconds) of each interval and "before",
+                  the total covered time of all earlier intervals
+
+    '''
+
+    lo = np.sort(to_ns(hour_starts))
+    hi = lo + pd.Timedelta(length).value
+
+    if(lo.size > 0):
+
+        # a new interval begins wherever a file starts after every earlier file has ended
+        reach = np.maximum.accumulate(hi)
+        new = np.concatenate([[True], lo[1:] > reach[:-1]])
+
+        lo = lo[new]
+        hi = np.maximum.reduceat(reach, np.flatnonzero(new))
+
+    return {"lo": lo, "hi": hi, "before": np.concatenate([[0], np.cumsum(hi - lo)])[:lo.size].astype("int64")}
+
+
+def covered_until(index, t):
+
+    '''
+    The total covered time (nanoseconds) before each time `t` (int64 nanoseconds).
+    '''
+
+    if(index["lo"].size == 0):
+        return np.zeros(t.shape, dtype="int64")
+
+    k = np.searchsorted(index["lo"], t, side="right") - 1
+    inside = k >= 0
+    k = np.maximum(k, 0)
+
+    partial = np.clip(t - index["lo"][k], 0, index["hi"][k] - index["lo"][k])
+
+    return np.where(inside, index["before"][k] + partial, 0)
+
+
+def covered_seconds(index, start, end):
+
+    '''
+    How many seconds between each start and end the record covers, for many flights at once.
+
+    Inputs
+    ------
+    index (dict): see `coverage_index`
+    start (array of datetimes): the first time of each flight
+    end (array of datetimes): the last time of each flight
+
+    Returns
+    -------
+    seconds (numpy array): covered seconds of each flight
+
+    '''
+
+    return (covered_until(index, to_ns(end)) - covered_until(index, to_ns(start)))/1e9
+
+
+def coverage_fraction(index, start, end):
+
+    '''
+    The fraction of each flight's duration the record covers, for many flights at once.
+    A flight of a single instant is covered (1) or not (0).
+
+    Inputs
+    ------
+    index (dict): see `coverage_index`
+    start (array of datetimes): the first time of each flight
+    end (array of datetimes): the last time of each flight
+
+    Returns
+    -------
+    fraction (numpy array): between 0 and 1 for each flight
+
+    '''
+
+    t0 = to_ns(start)
+    t1 = to_ns(end)
+
+    covered = covered_until(index, t1) - covered_until(index, t0)
+    duration = t1 - t0
+
+    # an instant is covered if it falls inside an interval
+    instant = np.zeros(t0.shape, dtype=bool)
+    if(index["lo"].size > 0):
+        k = np.searchsorted(index["lo"], t0, side="right") - 1
+        instant = (k >= 0) & (t0 < index["hi"][np.maximum(k, 0)])
+
+    return np.where(duration > 0, covered/np.maximum(duration, 1), instant.astype("float64"))
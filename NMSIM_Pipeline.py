@@ -0,0 +1,627 @@
+#-----------------------------------------------------------------------------#
+# NMSIM_Pipeline.py
+#
+# NPS Natural Sounds Program
+#
+# Run the Denali Overflights Database -> NMSIM workflow for many site-years
+# (deployments) in one unattended run. Each deployment passes through the
+# same stages as the notebook "DENA Overflights Database GPS to NMSIM workflow":
+#
+#	tracks    `tracks_within`: GPS points -> trajectories (.trj) and a site file (.sit)
+#	simulate  `NMSIM_create_tis`: trajectories -> site-based model results (.tis)
+#	compare   `tis_resampler` + `NVSPL_to_match_tis`: model vs. measurement figures
+#	          (events grouped by day, so each NVSPL hour is read once; see `NMSIM_NVSPL.py`,
+#	          and figures drawn off-screen by a pool of processes; see `NMSIM_Figures.py`;
+#	          level and timing errors of every event in one table; see `NMSIM_Compare.py`)
+#
+# Stages form a graph: each stage waits on the one before it, and deployments
+# that share a project directory run one after another (they share its
+# trajectory and output folders). Each stage is given the summaries of the
+# stages before it, so a deployment only simulates and compares the
+# trajectories its own tracks stage wrote, even when other years of the
+# same site share its project directory. Every stage has its own limit on how many
+# deployments it may process at once. When a stage finishes it writes a
+# checkpoint; a re-run skips every stage already checkpointed, so a crash
+# resumes where it stopped.
+#
+# Usage:
+#	python NMSIM_Pipeline.py deployments.csv --projects-root D:\NMSIM_Projects --source C207.src
+#
+# where `deployments.csv` has the columns unit, site, year (and, optionally, project_dir).
+# With --timing, every stage is timed (see `NMSIM_Timing.py`): the timings are logged
+# as JSON lines beside the checkpoints, and a report of where the time went is printed.
+#
+# History:
+#	D. Halyn Betchkal -- Created
+#
+#-----------------------------------------------------------------------------#
+
+# ================ Import Libraries =======================
+
+import os
+import sys
+import json
+import glob
+import time
+import argparse
+import traceback
+import datetime as dt
+from itertools import groupby
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import pandas as pd
+
+from NMSIM_Timing import record_duration
+
+
+# ===========================  Define functions  =======================================
+
+def load_DENA():
+
+    '''
+    Import the DENA workflow module on first use. (Importing it is cheap; the
+    Denali network shares are only connected to when a stage needs them.)
+    '''
+
+    import NMSIM_DENA_Flight_Tracks as DENA
+
+    return DENA
+
+
+def trj_start_time(trj_path):
+
+    '''
+    Read the UTC start time (to the second!) from the header of a trajectory written by `tracks_within`.
+    '''
+
+    with open(trj_path) as lines:
+        head = [next(lines) for x in range(12)]
+
+    return dt.datetime.strptime(head[-1][-24:-5], "%Y-%m-%d %H:%M:%S")
+
+
+def in_deployment_year(trj_path, year, utc_offset):
+
+    '''
+    True if a trajectory begins (in local time) during the deployment's year.
+    '''
+
+    return (trj_start_time(trj_path) + dt.timedelta(hours=utc_offset)).year == int(year)
+
+
+def deployment_trajectories(deployment, settings):
+
+    '''
+    The trajectories of one deployment: those its tracks stage wrote or, for a checkpoint
+    written before they were listed, the project's trajectories that begin in its year.
+    '''
+
+    tracks = deployment.get("summaries", {}).get("tracks") or {}
+
+    if("trajectories" in tracks):
+        return tracks["trajectories"]
+
+    trj_files = glob.glob(os.path.join(deployment["project_dir"], "Input_Data", "03_TRAJECTORY", "*.trj"))
+
+    return sorted(t for t in trj_files if in_deployment_year(t, deployment["year"], settings["utc_offset"]))
+
+
+def stage_tracks(deployment, settings):
+
+    '''
+    Select GPS points near the site and write them as NMSIM trajectories.
+    '''
+
+    DENA = load_DENA()
+
+    tracks = DENA.tracks_within(DENA.get_archive(), deployment["site"], deployment["year"],
+                                search_within_km=settings["search_within_km"],
+                                NMSIM_proj_dir=deployment["project_dir"],
+                                decouple=settings["decouple"], track_store=settings["track_store"],
+                                trim_within_km=settings["trim_within_km"],
+                                trim_pad_s=settings["trim_pad_s"], show=False)
+
+    registrations = sorted(str(r) for r in tracks["registration"].unique()) if len(tracks) > 0 else []
+
+    # the trajectories written for this deployment (and only for its year), for the later stages
+    written = sorted(tracks["trj_path"].dropna().unique()) if len(tracks) > 0 else []
+    trajectories = [t for t in written if in_deployment_year(t, deployment["year"], settings["utc_offset"])]
+
+    return {"flights": int(tracks["flight_id"].nunique()) if len(tracks) > 0 else 0,
+            "registrations": registrations,
+            "trajectories": trajectories}
+
+
+def stage_simulate(deployment, settings):
+
+    '''
+    Run NMSIM for every trajectory of the deployment, choosing a source file by N-Number.
+    '''
+
+    DENA = load_DENA()
+
+    trj_files = deployment_trajectories(deployment, settings)
+
+    # trajectory files are named N-Number + start time, e.g. "N72395_20170612_173402.trj"
+    registrations = sorted(set(os.path.basename(t).split("_")[0] for t in trj_files))
+
+    runs = 0
+    failed = 0
+    up_to_date = 0
+    no_source = []
+    for registration in registrations:
+
+        source_path = settings["source_map"].get(registration, settings["default_source"])
+
+        if(source_path is None):
+            no_source.append(registration)
+            continue
+
+        results = DENA.NMSIM_create_tis(deployment["project_dir"], source_path, Nnumber=registration,
+                                        NMSIMpath=settings["NMSIMpath"], processes=settings["solver_processes"],
+                                        timeout=settings["solver_timeout"], retries=settings["solver_retries"],
+                                        trj_files=trj_files)
+
+        runs += len(results)
+        failed += int((~results["ok"]).sum())
+        up_to_date += int(results["skipped"].sum())
+
+    if(failed > 0):
+        raise RuntimeError("{0:d} of {1:d} NMSIM runs failed.".format(failed, runs))
+
+    return {"runs": runs, "up_to_date": up_to_date, "no_source": no_source}
+
+
+def deployment_events(deployment, settings):
+
+    '''
+    (UTC start time, .trj, .tis) of every simulated trajectory of one deployment, in chronological order.
+    '''
+
+    DENA = load_DENA()
+
+    pairs = DENA.pair_trj_to_tis_results(deployment["project_dir"], trj_files=deployment_trajectories(deployment, settings))
+
+    return sorted(((trj_start_time(trj), trj, tis) for trj, tis in pairs), key=lambda event: event[0])
+
+
+def stage_compare(deployment, settings):
+
+    '''
+    Pair each model result with the acoustic record; save a comparison figure of each event
+    and one table of the model's errors (see `NMSIM_Compare.py`) for the deployment.
+    '''
+
+    DENA = load_DENA()
+
+    from NMSIM_NVSPL import open_nvspl_store, preload_windows
+    from NMSIM_Figures import open_figure_pool, submit_figures, collect_figures
+    from NMSIM_Compare import compare_events, write_comparison
+
+    # one store of NVSPL hours for the whole deployment
+    store = open_nvspl_store(DENA.get_archive(), deployment["unit"], deployment["site"])
+    pad = dt.timedelta(minutes=settings["pad_length"])
+
+    # events in chronological order, so that each day's hours are read once
+    events = deployment_events(deployment, settings)
+
+    local = dt.timedelta(hours=settings["utc_offset"])
+
+    # figures are queued by the comparisons and drawn off-screen by a pool of processes,
+    # one day's worth at a time, while the next day is being compared
+    figures = []
+    pool = open_figure_pool(settings["figure_processes"])
+    submitted = []
+
+    compared = 0
+    unmatched = []
+    tables = []
+    try:
+        for day, day_events in groupby(events, key=lambda event: (event[0] + local).date()):
+
+            theories = []
+            paired = []
+            for startdate, trj, tis in day_events:
+                try:
+                    theories.append((startdate, trj, DENA.tis_resampler(tis, startdate, utc_offset=settings["utc_offset"], cache=True)))
+                except ValueError:
+                    unmatched.append(os.path.basename(trj))
+
+            # read every hour the day's events need, concurrently, before comparing them
+            preload_windows(store, [(theory.index[0] - pad, theory.index[-1] + pad)
+                                    for startdate, trj, theory in theories if len(theory) > 0])
+
+            for startdate, trj, theory in theories:
+
+                try:
+                    event_SPL = DENA.NVSPL_to_match_tis(DENA.get_archive(), deployment["project_dir"],
+                                                        startdate, theory, trj,
+                                                        unit=deployment["unit"], site=deployment["site"], year=int(startdate.year),
+                                                        utc_offset=settings["utc_offset"], pad_length=settings["pad_length"],
+                                                        store=store, figures=figures, show=False,
+                                                        dpi=settings["figure_dpi"], thumbnail_dpi=settings["thumbnail_dpi"])
+                    paired.append({"event": os.path.basename(trj)[:-4], "model": theory, "measured": event_SPL})
+                    compared += 1
+
+                except (ValueError, AttributeError, IndexError):
+
+                    # sometimes there are gaps in the record that would 'appear' to be computable... but aren't
+                    unmatched.append(os.path.basename(trj))
+
+            submitted += submit_figures(pool, figures, missing_only=settings["render_missing_only"])
+            figures.clear()
+
+            # numeric comparison of the day's events (band-wise levels, SEL, Lmax and timing)
+            tables.append(compare_events(paired, processes=settings["compare_processes"], max_lag_s=settings["max_lag_s"]))
+
+        rendered = collect_figures(submitted)
+
+    finally:
+        pool.shutdown(cancel_futures=True)
+
+    if(not rendered["ok"].all()):
+        raise RuntimeError("{0:d} of {1:d} figures failed: {2}".format(int((~rendered["ok"]).sum()), len(rendered),
+                                                                       rendered.loc[~rendered["ok"], "error"].iloc[0]))
+
+    # one table for the whole deployment
+    comparison_path = os.path.join(deployment["project_dir"], "Output_Data", "SITE", deployment["name"] + "_model_vs_measurement.csv")
+    os.makedirs(os.path.dirname(comparison_path), exist_ok=True)
+    write_comparison(pd.concat(tables, ignore_index=True) if len(tables) > 0 else compare_events([]), comparison_path)
+
+    return {"compared": compared, "unmatched": unmatched, "figures": int(rendered["ok"].sum()),
+            "comparison": comparison_path}
+
+
+
+# the stages of the workflow, in order, with how many deployments each may process at once
+default_stages = [("tracks", stage_tracks, 2),
+                  ("simulate", stage_simulate, 2),
+                  ("compare", stage_compare, 2)]
+
+# settings shared by every stage, see `run_pipeline`
+default_settings = {"search_within_km": 25,
+                    "track_store": os.path.join(os.path.expanduser("~"), "NMSIM_track_store"),  # (DENA's default)
+                    "trim_within_km": None,
+                    "trim_pad_s": 60.0,
+                    "decouple": False,
+                    "default_source": None,
+                    "source_map": {},
+                    "NMSIMpath": None,
+                    "solver_processes": os.cpu_count() or 1,
+                    "solver_timeout": None,
+                    "solver_retries": 1,
+                    "utc_offset": -8,
+                    "pad_length": 5,
+                    "figure_processes": 1,
+                    "figure_dpi": 300,
+                    "thumbnail_dpi": None,
+                    "render_missing_only": False,
+                    "compare_processes": 1,
+                    "max_lag_s": 120}
+
+
+def deployment_table(deployments, projects_root=None):
+
+    '''
+    Normalize deployments to a table with the columns unit, site, year, project_dir and name.
+
+    Inputs
+    ------
+    deployments (pandas DataFrame, list of tuples, or str path to a .csv): (unit, site, year[, project_dir])
+    projects_root (str, path): [optional] where project directories live when none is given;
+                               each deployment then uses `projects_root/UNITSITE`
+
+    Returns
+    -------
+    table (pandas DataFrame)
+
+    '''
+
+    if(isinstance(deployments, str)):
+        table = pd.read_csv(deployments, dtype={"site": str})
+    elif(isinstance(deployments, pd.DataFrame)):
+        table = deployments.copy()
+    else:
+        table = pd.DataFrame([list(d) for d in deployments],
+                             columns=["unit", "site", "year", "project_dir"][:len(deployments[0])])
+
+    table["year"] = table["year"].astype(int)
+
+    if("project_dir" not in table.columns):
+        table["project_dir"] = None
+
+    missing = table["project_dir"].isna()
+    if(missing.any() and (projects_root is None)):
+        raise ValueError("Deployments without a project_dir need a `projects_root`.")
+
+    # the canonical NPS project directory is named for the unit and site, e.g. "DENAUWBT"
+    table.loc[missing, "project_dir"] = [os.path.join(projects_root, u + s) for u, s in
+                                         zip(table.loc[missing, "unit"], table.loc[missing, "site"])]
+
+    table["name"] = table["unit"] + "_" + table["site"] + "_" + table["year"].astype(str)
+
+    return table.reset_index(drop=True)
+
+
+def checkpoint_path(checkpoint_dir, name, stage):
+
+    '''
+    The checkpoint file of one stage of one deployment.
+    '''
+
+    return os.path.join(checkpoint_dir, name, stage + ".json")
+
+
+def read_checkpoint(checkpoint_dir, name, stage):
+
+    '''
+    Return the checkpoint of a stage, or None if the stage has not finished.
+    '''
+
+    path = checkpoint_path(checkpoint_dir, name, stage)
+
+    if(not os.path.exists(path)):
+        return None
+
+    with open(path) as f:
+        record = json.load(f)
+
+    return record if record["status"] == "done" else None
+
+
+def write_checkpoint(checkpoint_dir, name, stage, record):
+
+    '''
+    Write a stage's record atomically (a crash mid-write never leaves a partial checkpoint).
+    '''
+
+    path = checkpoint_path(checkpoint_dir, name, stage)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    tmp = path + ".{0}.tmp".format(os.getpid())
+    with open(tmp, "w") as f:
+        json.dump(record, f, indent=1, default=str)
+
+    os.replace(tmp, path)
+
+
+def run_stage(function, deployment, settings, checkpoint_dir, stage):
+
+    '''
+    Run one stage of one deployment, and checkpoint the outcome.
+    '''
+
+    started = dt.datetime.now()
+    t0 = time.perf_counter()
+
+    print(started.strftime("%H:%M:%S"), "starting", stage, "for", deployment["name"])
+
+    try:
+        summary = function(deployment, settings)
+        status, error = "done", None
+
+    except Exception:
+        summary, status, error = None, "failed", traceback.format_exc()
+
+    record = {"stage": stage,
+              "status": status,
+              "started": started.isoformat(timespec="seconds"),
+              "duration_s": time.perf_counter() - t0,
+              "summary": summary,
+              "error": error}
+
+    # (a no-op unless timing is enabled; see `NMSIM_Timing.py`)
+    record_duration("pipeline:" + stage, record["duration_s"], ok=(status == "done"), deployment=deployment["name"])
+
+    write_checkpoint(checkpoint_dir, deployment["name"], stage, record)
+
+    return record
+
+
+def run_pipeline(deployments, checkpoint_dir, projects_root=None, stages=None, limits=None, settings=None, resume=True):
+
+    '''
+    Run every stage for every deployment, as a graph with bounded parallelism at each stage.
+
+    A stage of a deployment starts as soon as its previous stage has finished
+    (and, for the first stage, as soon as any earlier deployment sharing its
+    project directory has finished entirely), and as soon as its stage has a
+    free worker. A stage that fails blocks only the later stages of its own
+    deployment (and of deployments waiting on it); everything else carries on.
+
+    Inputs
+    ------
+    deployments (pandas DataFrame, list of tuples, or str path to a .csv): see `deployment_table`
+    checkpoint_dir (str, path): where stage checkpoints are kept
+    projects_root (str, path): [optional] see `deployment_table`
+    stages (list): [optional] (name, function, limit) for each stage, in order; each function is
+                   called as function(deployment, settings) and returns a JSON-serializable summary;
+                   `deployment["summaries"]` holds those of its earlier stages [default `default_stages`]
+    limits (dict): [optional] stage name -> how many deployments it may process at once (overrides `stages`)
+    settings (dict): [optional] updates to `default_settings`
+    resume (bool): skip stages that already have a checkpoint [default True]
+
+    Returns
+    -------
+    records (pandas DataFrame): one row per deployment and stage, with its status
+                                ("done", "resumed", "failed" or "blocked"), duration, summary and error
+
+    '''
+
+    table = deployment_table(deployments, projects_root=projects_root)
+
+    if(stages is None):
+        stages = default_stages
+
+    limits = dict({name: limit for name, function, limit in stages}, **(limits or {}))
+    settings = dict(default_settings, **(settings or {}))
+    stage_names = [name for name, function, limit in stages]
+    functions = {name: function for name, function, limit in stages}
+
+    # ======= (1) the graph: each task waits on the tasks in `depends` ================
+
+    depends = {}
+    last_in_project = {}
+    for i, deployment in table.iterrows():
+
+        for s, stage in enumerate(stage_names):
+
+            if(s > 0):
+                depends[(i, stage)] = [(i, stage_names[s-1])]
+
+            elif(deployment["project_dir"] in last_in_project):
+                depends[(i, stage)] = [(last_in_project[deployment["project_dir"]], stage_names[-1])]
+
+            else:
+                depends[(i, stage)] = []
+
+        last_in_project[deployment["project_dir"]] = i
+
+    # ======= (2) previously finished stages ================
+
+    records = {}
+    if(resume):
+        for (i, stage) in depends:
+
+            record = read_checkpoint(checkpoint_dir, table.loc[i, "name"], stage)
+            if(record is not None):
+                records[(i, stage)] = dict(record, status="resumed")
+
+    # ======= (3) run everything else as its dependencies finish ================
+
+    pools = {stage: ThreadPoolExecutor(max_workers=limits[stage]) for stage in stage_names}
+    running = {}
+
+    try:
+        while(True):
+
+            for task, needs in depends.items():
+
+                if((task in records) or (task in running.values())):
+                    continue
+
+                states = [records[n]["status"] if n in records else None for n in needs]
+
+                if(any(s in ["failed", "blocked"] for s in states)):
+
+                    records[task] = {"stage": task[1], "status": "blocked", "started": None, "duration_s": 0.0,
+                                     "summary": None, "error": "an earlier stage failed"}
+
+                elif(all(s in ["done", "resumed"] for s in states)):
+
+                    i, stage = task
+                    deployment = table.loc[i].to_dict()
+                    deployment["summaries"] = {s: records[(i, s)]["summary"]
+                                               for s in stage_names[:stage_names.index(stage)]}
+
+                    future = pools[stage].submit(run_stage, functions[stage], deployment, settings, checkpoint_dir, stage)
+                    running[future] = task
+
+            if(len(running) == 0):
+
+                # blocking may have freed nothing to run; stop once every task has an outcome
+                if(len(records) == len(depends)):
+                    break
+                continue
+
+            finished, pending = wait(list(running), return_when=FIRST_COMPLETED)
+
+            for future in finished:
+
+                task = running.pop(future)
+                records[task] = future.result()
+
+                print(dt.datetime.now().strftime("%H:%M:%S"), "finished", task[1], "for", table.loc[task[0], "name"],
+                      "-", records[task]["status"], "({0:.0f} s)".format(records[task]["duration_s"]))
+
+    finally:
+        for pool in pools.values():
+            pool.shutdown(wait=True)
+
+    # ======= (4) one tidy table ================
+
+    rows = []
+    for (i, stage), record in sorted(records.items(), key=lambda kv: (kv[0][0], stage_names.index(kv[0][1]))):
+
+        rows.append({"unit": table.loc[i, "unit"],
+                     "site": table.loc[i, "site"],
+                     "year": table.loc[i, "year"],
+                     "stage": stage,
+                     "status": record["status"],
+                     "started": record["started"],
+                     "duration_s": record["duration_s"],
+                     "summary": record["summary"],
+                     "error": record["error"]})
+
+    return pd.DataFrame(rows, columns=["unit", "site", "year", "stage", "status", "started",
+                                       "duration_s", "summary", "error"])
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Run the DENA Overflights -> NMSIM workflow for many site-years.")
+    parser.add_argument("deployments", help="a .csv with the columns unit, site, year (and, optionally, project_dir)")
+    parser.add_argument("--projects-root", help="folder holding one NMSIM project directory per unit+site")
+    parser.add_argument("--checkpoint-dir", default=None, help="where stage checkpoints are kept [default: beside the .csv]")
+    parser.add_argument("--source", default=None, help="the NMSIM source (.src) used for every aircraft")
+    parser.add_argument("--source-map", default=None, help="a .csv with the columns registration, source")
+    parser.add_argument("--search-km", type=float, default=25.0, help="search radius around each site")
+    parser.add_argument("--trim-km", type=float, default=None, help="trim trajectories to this slant range of each site")
+    parser.add_argument("--trim-pad-s", type=float, default=60.0, help="seconds kept either side of the trimmed part")
+    parser.add_argument("--NMSIM", default=None, help="the solver command (defaults to the bundled Nord2000batch.exe)")
+    parser.add_argument("--solver-processes", type=int, default=os.cpu_count() or 1, help="NMSIM runs at once per deployment")
+    parser.add_argument("--solver-timeout", type=float, default=None, help="seconds before an NMSIM run is killed")
+    parser.add_argument("--figure-processes", type=int, default=1, help="comparison figures drawn at once per deployment")
+    parser.add_argument("--thumbnail-dpi", type=int, default=None, help="also save comparison thumbnails at this resolution")
+    parser.add_argument("--render-missing-only", action="store_true", help="only draw comparison figures that do not exist yet")
+    parser.add_argument("--compare-processes", type=int, default=1, help="events compared at once per deployment")
+    for name, function, limit in default_stages:
+        parser.add_argument("--" + name + "-workers", type=int, default=limit, help="deployments in '" + name + "' at once")
+    parser.add_argument("--restart", action="store_true", help="ignore existing checkpoints")
+    parser.add_argument("--timing", action="store_true", help="time every stage and report where the time went")
+    args = parser.parse_args()
+
+    # never open windows during an unattended run
+    import matplotlib
+    matplotlib.use("Agg")
+
+    source_map = {}
+    if(args.source_map is not None):
+        source_map = dict(pd.read_csv(args.source_map, dtype=str)[["registration", "source"]].values)
+
+    checkpoint_dir = args.checkpoint_dir
+    if(checkpoint_dir is None):
+        checkpoint_dir = os.path.join(os.path.dirname(os.path.abspath(args.deployments)), "NMSIM_checkpoints")
+
+    run_stamp = dt.datetime.now().strftime("%Y%m%d_%H%M%S")
+
+    # every timing as a line of JSON, beside the checkpoints
+    if(args.timing):
+        import NMSIM_Timing
+        NMSIM_Timing.enable(os.path.join(checkpoint_dir, "timing_" + run_stamp + ".jsonl"))
+
+    records = run_pipeline(args.deployments, checkpoint_dir, projects_root=args.projects_root,
+                           limits={name: getattr(args, name + "_workers") for name, function, limit in default_stages},
+                           settings={"search_within_km": args.search_km,
+                                     "trim_within_km": args.trim_km,
+                                     "trim_pad_s": args.trim_pad_s,
+                                     "default_source": args.source,
+                                     "source_map": source_map,
+                                     "NMSIMpath": args.NMSIM,
+                                     "solver_processes": args.solver_processes,
+                                     "solver_timeout": args.solver_timeout,
+                                     "figure_processes": args.figure_processes,
+                                     "thumbnail_dpi": args.thumbnail_dpi,
+                                     "render_missing_only": args.render_missing_only,
+                                     "compare_processes": args.compare_processes},
+                           resume=not args.restart)
+
+    print(records[["unit", "site", "year", "stage", "status", "duration_s"]].to_string(index=False))
+
+    records.to_csv(os.path.join(checkpoint_dir, "pipeline_" + run_stamp + ".csv"), index=False)
+
+    if(args.timing):
+        print()
+        print(NMSIM_Timing.report())
+        NMSIM_Timing.disable()
+
+    sys.exit(0 if records["status"].isin(["done", "resumed"]).all() else 1)
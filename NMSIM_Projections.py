@@ -0,0 +1,236 @@
+#-----------------------------------------------------------------------------#
+# NMSIM_Projections.py
+#
+# NPS Natural Sounds Program
+#
+# Coordinate transformations shared by every tool in this repository.
+#
+# NMSIM projects are referenced to NAD83 / UTM, in the zone of the western
+# edge of the study area. `nad83_utm_crs` gives that coordinate reference
+# system for any zone: the EPSG code where one exists (zones 1-23, 59, 60),
+# or an equivalent PROJ definition otherwise.
+#
+# Building a `pyproj` Transformer is far slower than using one, so they are
+# kept in a registry keyed by (source, destination) and made once per thread
+# (Transformers should not be shared between threads). `transform` converts
+# whole arrays of coordinates at once, always in (x, y) = (longitude, latitude)
+# or (easting, northing) order.
+#
+# History:
+#	D. Halyn Betchkal -- Created
+#
+#-----------------------------------------------------------------------------#
+
+# ================ Import Libraries =======================
+
+import threading
+import numpy as np
+
+
+# longitude/latitude of GPS data (and of the Overflights Database)
+WGS84 = "EPSG:4326"
+
+# longitude/latitude on the North American datum
+NAD83 = "EPSG:4269"
+
+# one registry of transformers per thread
+registry = threading.local()
+
+
+# ===========================  Define functions  =======================================
+
+def utm_zone(longitude):
+
+    """
+    The UTM zone(s) containing longitude(s), in decimal degrees.
+    """
+
+    zone = (np.floor((np.asarray(longitude, dtype="float64") + 180)/6) % 60).astype("int") + 1
+
+    return int(zone) if np.ndim(zone) == 0 else zone
+
+
+def nad83_utm_epsg(zone):
+
+    """
+    The EPSG code of NAD83 / UTM in a northern zone, or None where EPSG defines none.
+    """
+
+    zone = int(zone)
+
+    if(1 <= zone <= 23):
+        return 26900 + zone
+
+    # the western Aleutians
+    return {59: 3372, 60: 3373}.get(zone)
+
+
+def nad83_utm_crs(zone):
+
+    """
+    NAD83 / UTM in a northern zone (1 - 60), as an EPSG code or an equivalent PROJ definition.
+    """
+
+    if(not 1 <= int(zone) <= 60):
+        raise ValueError("UTM zones are numbered 1 to 60, not " + str(zone))
+
+    epsg = nad83_utm_epsg(zone)
+
+    if(epsg is not None):
+        return "EPSG:" + str(epsg)
+
+    return "+proj=utm +zone={0:d} +datum=NAD83 +units=m +no_defs".format(int(zone))
+
+
+def get_transformer(src, dst):
+
+    """
+    A `pyproj` Transformer from one coordinate reference system to another (in x, y order),
+    made on first use in each thread and reused afterwards.
+
+    Inputs
+    ------
+    src (str): source CRS, e.g. "EPSG:4326" or `nad83_utm_crs(6)`
+    dst (str): destination CRS
+
+    Returns
+    -------
+    transformer (pyproj Transformer)
+
+    """
+
+    transformers = getattr(registry, "transformers", None)
+    if(transformers is None):
+        transformers = registry.transformers = {}
+
+    key = (str(src), str(dst))
+
+    if(key not in transformers):
+
+        import pyproj
+        transformers[key] = pyproj.Transformer.from_crs(key[0], key[1], always_xy=True)
+
+    return transformers[key]
+
+
+def transform(src, dst, x, y):
+
+    """
+    Transform arrays of coordinates between coordinate reference systems.
+
+    Inputs
+    ------
+    src (str): source CRS
+    dst (str): destination CRS
+    x (array): longitudes or eastings
+    y (array): latitudes or northings
+
+    Returns
+    -------
+    x, y (numpy arrays, or floats for scalar input): the transformed coordinates
+
+    """
+
+    x = np.asarray(x, dtype="float64")
+    y = np.asarray(y, dtype="float64")
+
+    tx, ty = get_transformer(src, dst).transform(x, y)
+
+    if(np.ndim(tx) == 0):
+        return float(tx), float(ty)
+
+    return np.asarray(tx), np.asarray(ty)
+
+
+def to_utm(longitude, latitude, zone, src=WGS84):
+
+    """
+    Project longitude/latitude (WGS84 unless otherwise given) into an NMSIM project's NAD83 / UTM zone.
+    """
+
+    return transform(src, nad83_utm_crs(zone), longitude, latitude)
+
+
+def from_utm(easting, northing, zone, dst=WGS84):
+
+    """
+    Convert NAD83 / UTM coordinates of an NMSIM project back to longitude/latitude (WGS84 unless otherwise given).
+    """
+
+    return transform(nad83_utm_crs(zone), dst, easting, northing)
+
+
+def geodesic_buffers(longitude, latitude, radius_m, n_vertices=64):
+
+    """
+    Circles of a given radius on the ellipsoid (WGS84) around many points, computed together.
+
+    Every vertex lies exactly `radius_m` from its center along the earth's surface,
+    as a buffer drawn in an azimuthal equidistant projection would; no projection
+    is needed at all.
+
+    Inputs
+    ------
+    longitude (array): longitudes of the centers (decimal degrees)
+    latitude (array): latitudes of the centers (decimal degrees)
+    radius_m (float): radius in meters
+    n_vertices (int): vertices of each circle [default 64]
+
+    Returns
+    -------
+    buffers (list of shapely Polygons): one per center, in WGS84 longitude/latitude
+
+    """
+
+    import pyproj
+    from shapely.geometry import Polygon
+
+    geod = getattr(registry, "geod", None)
+    if(geod is None):
+        geod = registry.geod = pyproj.Geod(ellps="WGS84")
+
+    longitude = np.atleast_1d(np.asarray(longitude, dtype="float64"))
+    latitude = np.atleast_1d(np.asarray(latitude, dtype="float64"))
+
+    # counter-clockwise, starting due east (as `shapely` draws a buffer)
+    azimuths = (90 - np.arange(n_vertices)*360/n_vertices) % 360
+
+    lon, lat, back = geod.fwd(np.repeat(longitude, n_vertices), np.repeat(latitude, n_vertices),
+                              np.tile(azimuths, longitude.size), np.full(longitude.size*n_vertices, float(radius_m)))
+
+    lon = np.reshape(lon, (longitude.size, n_vertices))
+    lat = np.reshape(lat, (longitude.size, n_vertices))
+
+    return [Polygon(np.column_stack([lo, la])) for lo, la in zip(lon, lat)]
+
+
+def transform_bounds(src, dst, bounds, densify=21):
+
+    """
+    The bounding box, in another coordinate reference system, of a bounding box.
+
+    Each edge is sampled at `densify` points, since a straight edge in one
+    system is generally curved in another.
+
+    Inputs
+    ------
+    src (str): source CRS
+    dst (str): destination CRS
+    bounds (tuple): (xmin, ymin, xmax, ymax) in the source CRS
+    densify (int): points sampled along each edge [default 21]
+
+    Returns
+    -------
+    bounds (tuple): (xmin, ymin, xmax, ymax) in the destination CRS
+
+    """
+
+    xmin, ymin, xmax, ymax = bounds
+
+    t = np.linspace(0, 1, densify)
+    x = np.concatenate([xmin + t*(xmax - xmin), np.full(densify, xmax), xmax - t*(xmax - xmin), np.full(densify, xmin)])
+    y = np.concatenate([np.full(densify, ymin), ymin + t*(ymax - ymin), np.full(densify, ymax), ymax - t*(ymax - ymin)])
+
+    tx, ty = transform(src, dst, x, y)
+
+    return (float(np.min(tx)), float(np.min(ty)), float(np.max(tx)), float(np.max(ty)))
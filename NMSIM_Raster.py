@@ -0,0 +1,324 @@
+#-----------------------------------------------------------------------------#
+# NMSIM_Raster.py
+#
+# NPS Natural Sounds Program
+#
+# Save acoustic metrics of a grid-based model (.tig) as a GeoTIFF raster.
+#
+# NMSIM computes its grid points on a regular lattice, so in general no
+# interpolation is needed at all: `detect_lattice` recovers the lattice
+# (its origin, spacing and every point's row and column) from the points'
+# coordinates, and `lattice_to_array` scatters the metric values into a
+# 2-D array by index. Only points that do not sit on a lattice are
+# interpolated (`interpolate_to_grid`, which needs `scipy`).
+#
+# `write_geotiff` writes every metric as one band of a single tiled,
+# compressed GeoTIFF, a block of rows at a time, in the project's NAD83 /
+# UTM coordinate reference system (see `NMSIM_Projections.py`). GDAL is
+# imported only when a raster is written.
+#
+# History:
+#	D. Halyn Betchkal -- Created
+#
+#-----------------------------------------------------------------------------#
+
+# ================ Import Libraries =======================
+
+import numpy as np
+import pandas as pd
+
+from NMSIM_Projections import nad83_utm_crs
+
+
+# ===========================  Define functions  =======================================
+
+def lattice_axis(coordinates, tolerance):
+
+    '''
+    Recover the spacing of one axis of a lattice from the coordinates of its points.
+
+    Inputs
+    ------
+    coordinates (numpy array): x (or y) of every point
+    tolerance (float): how far (as a fraction of the spacing) a point may lie from its lattice line
+
+    Returns
+    -------
+    axis (dict): "origin", "spacing", "n" (lattice lines) and "index" (each point's line, from 0),
+                 or None if the points do not sit on evenly spaced lines
+
+    '''
+
+    lines = np.unique(coordinates)
+
+    if(lines.size == 1):
+        return {"origin": lines[0], "spacing": None, "n": 1, "index": np.zeros(coordinates.size, dtype="int64")}
+
+    # the typical gap between neighbouring lines (whole lines of points may be missing)...
+    typical = np.median(np.diff(lines))
+
+    # ...then the spacing that best fits every line between the first and the last
+    n = int(np.rint((lines[-1] - lines[0])/typical)) + 1
+    spacing = (lines[-1] - lines[0])/(n - 1)
+
+    index = np.rint((coordinates - lines[0])/spacing).astype("int64")
+
+    if(np.abs(coordinates - (lines[0] + index*spacing)).max() > tolerance*spacing):
+        return None
+
+    return {"origin": lines[0], "spacing": spacing, "n": n, "index": index}
+
+
+def detect_lattice(x, y, tolerance=0.1):
+
+    '''
+    Decide whether points sit on a regular lattice and, if so, where each point belongs.
+
+    NMSIM writes grid point coordinates rounded to the meter, so points may
+    stray from their lattice line by a little; `tolerance` allows for that.
+    Points may be missing (e.g., a tile that was not computed), but no two
+    may share a cell.
+
+    Inputs
+    ------
+    x (array): eastings of the points
+    y (array): northings of the points
+    tolerance (float): how far (as a fraction of the spacing) a point may lie from its lattice line [default 0.1]
+
+    Returns
+    -------
+    lattice (dict): "x0", "y0" (the lower-left point), "dx", "dy" (spacings), "ncols", "nrows",
+                    "col" and "row" (of each point; row 0 is the southernmost), or None if the points
+                    are not on a lattice
+
+    '''
+
+    x = np.asarray(x, dtype="float64")
+    y = np.asarray(y, dtype="float64")
+
+    if(x.size < 2):
+        return None
+
+    columns = lattice_axis(x, tolerance)
+    rows = lattice_axis(y, tolerance)
+
+    if((columns is None) or (rows is None)):
+        return None
+
+    # a single row or column of points takes its cell size from the other axis
+    dx = columns["spacing"] if columns["spacing"] is not None else rows["spacing"]
+    dy = rows["spacing"] if rows["spacing"] is not None else columns["spacing"]
+
+    # two points in one cell means the layout is not a lattice at this spacing
+    cells = rows["index"]*columns["n"] + columns["index"]
+    if(np.unique(cells).size < cells.size):
+        return None
+
+    return {"x0": columns["origin"],
+            "y0": rows["origin"],
+            "dx": dx,
+            "dy": dy,
+            "ncols": columns["n"],
+            "nrows": rows["n"],
+            "col": columns["index"],
+            "row": rows["index"]}
+
+
+def lattice_transform(lattice):
+
+    '''
+    The GDAL geotransform of a north-up raster whose cells are centered on the lattice points.
+    '''
+
+    return (lattice["x0"] - lattice["dx"]/2, lattice["dx"], 0.0,
+            lattice["y0"] + (lattice["nrows"] - 0.5)*lattice["dy"], 0.0, -lattice["dy"])
+
+
+def lattice_to_array(values, lattice, nodata=np.nan, dtype="float32"):
+
+    '''
+    Scatter the values of lattice points into north-up raster bands, by index.
+
+    Inputs
+    ------
+    values (array or pandas DataFrame): one row per point, one column per band (or a single column)
+    lattice (dict): see `detect_lattice`
+    nodata (float): the value of cells without a point [default np.nan]
+    dtype (str or numpy dtype): the raster's data type [default "float32"]
+
+    Returns
+    -------
+    raster (numpy array): shape (bands, nrows, ncols), the first row northernmost
+
+    '''
+
+    values = np.asarray(values, dtype=dtype)
+    if(values.ndim == 1):
+        values = values[:, np.newaxis]
+
+    raster = np.full((values.shape[1], lattice["nrows"], lattice["ncols"]), nodata, dtype=dtype)
+    raster[:, lattice["nrows"] - 1 - lattice["row"], lattice["col"]] = values.T
+
+    return raster
+
+
+def interpolate_to_grid(x, y, values, cell_size=None, method="linear", nodata=np.nan, dtype="float32"):
+
+    '''
+    Interpolate the values of scattered points onto north-up raster bands (for layouts that are not a lattice).
+
+    Inputs
+    ------
+    x (array): eastings of the points
+    y (array): northings of the points
+    values (array or pandas DataFrame): one row per point, one column per band (or a single column)
+    cell_size (float): [optional] the raster's cell size [default: the spacing of as many points spread evenly]
+    method (str): "linear", "nearest" or "cubic"; see `scipy.interpolate.griddata` [default "linear"]
+    nodata (float): the value of cells outside the points' convex hull [default np.nan]
+    dtype (str or numpy dtype): the raster's data type [default "float32"]
+
+    Returns
+    -------
+    raster (numpy array): shape (bands, nrows, ncols), the first row northernmost
+    transform (tuple): the GDAL geotransform of the raster
+
+    '''
+
+    from scipy.interpolate import griddata
+
+    x = np.asarray(x, dtype="float64")
+    y = np.asarray(y, dtype="float64")
+
+    values = np.asarray(values, dtype="float64")
+    if(values.ndim == 1):
+        values = values[:, np.newaxis]
+
+    xmin, xmax, ymin, ymax = x.min(), x.max(), y.min(), y.max()
+
+    if(cell_size is None):
+        cell_size = np.sqrt(max((xmax - xmin)*(ymax - ymin), 1.0)/x.size)
+
+    ncols = int(np.floor((xmax - xmin)/cell_size)) + 1
+    nrows = int(np.floor((ymax - ymin)/cell_size)) + 1
+
+    # cell centers, the first row northernmost
+    cx, cy = np.meshgrid(xmin + cell_size*np.arange(ncols), ymin + cell_size*np.arange(nrows)[::-1])
+
+    raster = np.empty((values.shape[1], nrows, ncols), dtype=dtype)
+    for b in range(values.shape[1]):
+        raster[b] = griddata((x, y), values[:, b], (cx, cy), method=method, fill_value=nodata)
+
+    transform = (xmin - cell_size/2, cell_size, 0.0, ymax + cell_size/2, 0.0, -cell_size)
+
+    return raster, transform
+
+
+def write_geotiff(path, raster, transform, zone, band_names=None, nodata=np.nan, block_size=256, compress="DEFLATE"):
+
+    '''
+    Write raster bands to one tiled, compressed GeoTIFF in an NMSIM project's NAD83 / UTM zone.
+
+    The file is written a block of rows at a time, every band at once, so
+    GDAL compresses each tile once and never re-reads it.
+
+    Inputs
+    ------
+    path (str, path): the GeoTIFF (.tif) to write
+    raster (numpy array): shape (bands, nrows, ncols) or (nrows, ncols), the first row northernmost
+    transform (tuple): the GDAL geotransform, see `lattice_transform`
+    zone (int): the project's UTM zone
+    band_names (list of str): [optional] a description of each band, e.g. the metric's alias
+    nodata (float): the value of cells without data [default np.nan]
+    block_size (int): the width and height of the file's tiles (a multiple of 16) [default 256]
+    compress (str): the GDAL compression method [default "DEFLATE"]
+
+    Returns
+    -------
+    None
+
+    '''
+
+    from osgeo import gdal, osr
+
+    if(raster.ndim == 2):
+        raster = raster[np.newaxis]
+
+    raster = np.ascontiguousarray(raster, dtype="float32")
+    n_bands, nrows, ncols = raster.shape
+
+    options = ["TILED=YES",
+               "BLOCKXSIZE={0:d}".format(block_size),
+               "BLOCKYSIZE={0:d}".format(block_size),
+               "COMPRESS=" + compress,
+               "PREDICTOR=3",   # floating point prediction suits smooth sound level surfaces
+               "BIGTIFF=IF_SAFER"]
+
+    out = gdal.GetDriverByName("GTiff").Create(path, ncols, nrows, n_bands, gdal.GDT_Float32, options=options)
+
+    srs = osr.SpatialReference()
+    srs.SetFromUserInput(nad83_utm_crs(zone))
+
+    out.SetGeoTransform(transform)
+    out.SetProjection(srs.ExportToWkt())
+
+    for b in range(n_bands):
+
+        band = out.GetRasterBand(b + 1)
+        band.SetNoDataValue(float(nodata))
+
+        if(band_names is not None):
+            band.SetDescription(str(band_names[b]))
+
+    # one block of rows (every band) per write
+    for r0 in range(0, nrows, block_size):
+
+        block = np.ascontiguousarray(raster[:, r0:r0 + block_size, :])
+        out.WriteRaster(0, r0, ncols, block.shape[1], block.tobytes(), ncols, block.shape[1],
+                        gdal.GDT_Float32, list(range(1, n_bands + 1)))
+
+    out.FlushCache()
+    out = None
+
+
+def metrics_to_geotiff(path, x, y, values, zone, tolerance=0.1, cell_size=None, method="linear", block_size=256):
+
+    '''
+    Save metrics of grid points as a GeoTIFF with one band per metric: scattered by index when the points
+    sit on a lattice (as NMSIM's do), interpolated otherwise.
+
+    Inputs
+    ------
+    path (str, path): the GeoTIFF (.tif) to write
+    x (array): eastings of the points (e.g., `index["x"]` from `NMSIM_Results.index_tig`)
+    y (array): northings of the points
+    values (pandas DataFrame or Series): one row per point, one column per metric (e.g., `NMSIM_Metrics.grid_metrics`)
+    zone (int): the project's UTM zone
+    tolerance (float): see `detect_lattice` [default 0.1]
+    cell_size (float): [optional] cell size when interpolating, see `interpolate_to_grid`
+    method (str): interpolation method when the points are not a lattice [default "linear"]
+    block_size (int): see `write_geotiff` [default 256]
+
+    Returns
+    -------
+    layout (dict): "method" ("lattice" or the interpolation method), "transform", "nrows" and "ncols"
+
+    '''
+
+    if(isinstance(values, pd.Series)):
+        values = values.to_frame()
+
+    band_names = [str(c) for c in values.columns] if isinstance(values, pd.DataFrame) else None
+
+    lattice = detect_lattice(x, y, tolerance=tolerance)
+
+    if(lattice is not None):
+        raster = lattice_to_array(values, lattice)
+        transform = lattice_transform(lattice)
+        how = "lattice"
+    else:
+        raster, transform = interpolate_to_grid(x, y, values, cell_size=cell_size, method=method)
+        how = method
+
+    write_geotiff(path, raster, transform, zone, band_names=band_names, block_size=block_size)
+
+    return {"method": how, "transform": transform, "nrows": raster.shape[1], "ncols": raster.shape[2]}
@@ -0,0 +1,512 @@
+#-----------------------------------------------------------------------------#
+# NMSIM_Results.py
+#
+# NPS Natural Sounds Program
+#
+# This module reads the outputs of NMSIM into `numpy` arrays. See Appendix D
+# of the NMSIM manual for the file formats: a file header terminated by
+# '---End File Header---', followed by one time history per receiver.
+# Each time history has a short (nine line) header, then one row per time
+# step, and ends with '---End of This Data Section---'.
+#
+# Every row holds 37 values: the data position number, the arrival time,
+# the flat- and A-weighted levels, 32 one-third octave bands (10 Hz - 12.5 kHz)
+# and D-prime. Levels are stored by NMSIM in centibels; here they are
+# converted to decibels.
+#
+# History:
+#	D. Halyn Betchkal -- Created
+#
+#-----------------------------------------------------------------------------#
+
+# ================ Import Libraries =======================
+
+import mmap
+from itertools import islice, chain
+import numpy as np
+import pandas as pd
+
+
+# the 1/3rd octave band center frequencies NMSIM reports (bands 10 - 41)
+bands = ["10", "12.5", "15.8", "20", "25", "31.5", "40", "50", "63", "80", "100", "125", "160",
+         "200", "250", "315", "400", "500", "630", "800", "1000", "1250", "1600", "2000", "2500",
+         "3150", "4000", "5000", "6300", "8000", "10000", "12500"]
+
+# the column of every row in a time history
+columns = ["SP#", "TIME", "F", "A"] + bands + ["d'"]
+
+# the columns kept for each grid point of a .tig (the data position number is dropped)
+tig_columns = columns[1:]
+
+# the number of lines between a time history's first header line and its data
+site_header_len = 9
+
+
+# ===========================  Define functions  =======================================
+
+def read_site_header(f):
+
+    """
+    Read the nine header lines of one receiver's time history from an open file.
+
+    Inputs
+    ------
+    f (file object): positioned at the first line of a time history
+
+    Returns
+    -------
+    header (dict): "site" (the receiver name), "n_steps" (the number of time steps,
+                   or None if it could not be read), and "lines" (the raw header lines)
+
+    """
+
+    lines = [l.rstrip("\n") for l in islice(f, site_header_len)]
+
+    if(len(lines) < site_header_len):
+        raise ValueError("Unexpected end of file while reading a time history header.")
+
+    try:
+        n_steps = int(lines[1].split()[0])
+    except (IndexError, ValueError):
+        n_steps = None
+
+    return {"site": lines[0].split(":", 1)[-1].strip(),
+            "n_steps": n_steps,
+            "lines": lines}
+
+
+def read_tis_header(f):
+
+    """
+    Read the file header and the first time history header from an open .tis file.
+
+    Inputs
+    ------
+    f (file object): positioned at the start of the file
+
+    Returns
+    -------
+    header (dict): as for `read_site_header`, plus "file_header" (the raw file header lines)
+
+    """
+
+    file_header = []
+    for line in f:
+
+        if(line.strip() == "---End File Header---"):
+            break
+
+        file_header.append(line.rstrip("\n"))
+
+    else:
+        raise ValueError("No '---End File Header---' line was found.")
+
+    header = read_site_header(f)
+    header["file_header"] = file_header
+
+    return header
+
+
+def is_data_line(line):
+
+    """
+    True if a line is a row of numbers (rather than '---End of This Data Section---',
+    a blank line, or any other text).
+    """
+
+    s = line.lstrip()
+
+    return s[:1].isdigit() or (s[:1] == "-" and s[1:2].isdigit())
+
+
+def data_line_chunks(f, chunk_rows):
+
+    """
+    Yield lists of up to `chunk_rows` data lines from one time history,
+    stopping at the first line that is not data (which is consumed).
+
+    Lines are taken one at a time so that nothing past the end of this
+    time history is read; parsing, not this loop, dominates the cost.
+    """
+
+    lines = []
+    for line in f:
+
+        if(not is_data_line(line)):
+            break
+
+        lines.append(line)
+
+        if(len(lines) == chunk_rows):
+            yield lines
+            lines = []
+
+    if(len(lines) > 0):
+        yield lines
+
+
+def lines_to_levels(lines, dtype="float32", nodata=-99.9):
+
+    """
+    Convert time history rows to a 2D array, with levels in decibels.
+
+    Inputs
+    ------
+    lines (list of str): rows of a time history
+    dtype (str or numpy dtype): the output data type [default "float32"]
+    nodata (float): the value used for anything NMSIM did not compute (-999 cB) [default -99.9]
+
+    Returns
+    -------
+    levels (numpy array): shape (len(lines), 37); see `columns`
+
+    """
+
+    levels = np.loadtxt(lines, dtype=dtype, ndmin=2)
+
+    values = levels[:, 2:]
+    missing = values <= -999
+
+    # centibels to decibels (D-prime is likewise stored x10)
+    values *= 0.1
+    values[missing] = nodata
+
+    return levels
+
+
+def read_tis(tis_path, dtype="float32", nodata=-99.9, chunk_rows=65536):
+
+    """
+    Read the first receiver's time history from a site-based model (.tis) into memory.
+
+    The header is parsed once, then rows are loaded in large blocks into a
+    preallocated array. There is no limit on the duration of the simulation.
+
+    Inputs
+    ------
+    tis_path (str, path): an NMSIM site-based model result
+    dtype (str or numpy dtype): the output data type [default "float32"]
+    nodata (float): the value used for anything NMSIM did not compute [default -99.9]
+    chunk_rows (int): how many rows are parsed at once [default 65536]
+
+    Returns
+    -------
+    header (dict): see `read_tis_header`
+    levels (numpy array): shape (time steps, 37); see `columns`
+
+    """
+
+    with open(tis_path) as f:
+
+        header = read_tis_header(f)
+        levels = read_site_levels(f, header["n_steps"], dtype=dtype, nodata=nodata, chunk_rows=chunk_rows)
+
+    return header, levels
+
+
+def read_site_levels(f, n_steps, dtype="float32", nodata=-99.9, chunk_rows=65536):
+
+    """
+    Read the rows of one time history from an open file (positioned just past its header)
+    into a preallocated array, consuming its end line.
+
+    Inputs
+    ------
+    f (file object): positioned at the first row of a time history
+    n_steps (int): the number of rows the header promises (or None)
+    [`dtype`, `nodata` and `chunk_rows` as for `read_tis`]
+
+    Returns
+    -------
+    levels (numpy array): shape (time steps, 37); see `columns`
+
+    """
+
+    # NMSIM tells us how many rows to expect, so allocate them up front
+    n_expected = n_steps if n_steps is not None else chunk_rows
+    levels = np.empty((n_expected, len(columns)), dtype=dtype)
+
+    n = 0
+    for lines in data_line_chunks(f, chunk_rows):
+
+        chunk = lines_to_levels(lines, dtype=dtype, nodata=nodata)
+
+        # the header was wrong (or missing); grow geometrically
+        if(n + len(chunk) > len(levels)):
+            levels = np.resize(levels, (max(2*len(levels), n + len(chunk)), chunk.shape[1]))
+
+        levels[n:n+len(chunk)] = chunk
+        n += len(chunk)
+
+    return levels[:n]
+
+
+def iter_tis_sites(tis_path, sites=None, dtype="float32", nodata=-99.9, chunk_rows=65536):
+
+    """
+    Iterate over every receiver's time history in a multi-receiver site-based model (.tis),
+    in a single pass through the file.
+
+    Inputs
+    ------
+    tis_path (str, path): an NMSIM site-based model result
+    sites (list of str): [optional] the receivers wanted; the rows of any other are skipped unparsed
+                         [default every receiver]
+    [`dtype`, `nodata` and `chunk_rows` as for `read_tis`]
+
+    Returns
+    -------
+    sites (generator): (header, levels) pairs in file order; see `read_site_header` and `read_tis`
+
+    """
+
+    wanted = None if sites is None else set(sites)
+
+    with open(tis_path) as f:
+
+        header = read_tis_header(f)
+
+        while(True):
+
+            if((wanted is None) or (header["site"] in wanted)):
+                yield header, read_site_levels(f, header["n_steps"], dtype=dtype, nodata=nodata, chunk_rows=chunk_rows)
+            else:
+                for lines in data_line_chunks(f, chunk_rows):
+                    pass
+
+            # the next receiver's header, if there is one (blank lines are ignored)
+            for line in f:
+                if(line.strip() != ""):
+                    break
+            else:
+                return
+
+            header = read_site_header(chain([line], f))
+
+
+def split_tis(tis_path, sites=None, dtype="float32", nodata=-99.9, chunk_rows=65536):
+
+    """
+    Split a multi-receiver site-based model (.tis) into one array per receiver, in a single pass.
+
+    Inputs
+    ------
+    [as for `iter_tis_sites`]
+
+    Returns
+    -------
+    index (pandas DataFrame): one row per receiver read, with columns "site", "zone", "x", "y" (UTM) and "n_rows"
+    levels (dict): receiver name -> array of shape (time steps, 37); see `columns`
+
+    """
+
+    records = []
+    levels = {}
+    for header, site_levels in iter_tis_sites(tis_path, sites=sites, dtype=dtype, nodata=nodata, chunk_rows=chunk_rows):
+
+        zone, x, y = [parse_UTM_line(l) for l in header["lines"] if l.startswith("UTM")][0]
+
+        records.append({"site": header["site"], "zone": zone, "x": x, "y": y, "n_rows": len(site_levels)})
+        levels[header["site"]] = site_levels
+
+    return pd.DataFrame(records, columns=["site", "zone", "x", "y", "n_rows"]), levels
+
+
+def iter_tis(tis_path, chunk_rows=3600, dtype="float32", nodata=-99.9):
+
+    """
+    Iterate over the first receiver's time history in fixed-size chunks.
+
+    Only one chunk is held in memory at a time, so simulations of any length
+    can be processed. With trajectories densified to one point per second
+    the default chunk is roughly one hour.
+
+    Inputs
+    ------
+    tis_path (str, path): an NMSIM site-based model result
+    chunk_rows (int): rows per chunk [default 3600]
+    dtype (str or numpy dtype): the output data type [default "float32"]
+    nodata (float): the value used for anything NMSIM did not compute [default -99.9]
+
+    Returns
+    -------
+    chunks (generator): arrays of shape (≤ chunk_rows, 37); see `columns`
+
+    """
+
+    with open(tis_path) as f:
+
+        read_tis_header(f)
+
+        for lines in data_line_chunks(f, chunk_rows):
+
+            yield lines_to_levels(lines, dtype=dtype, nodata=nodata)
+
+
+def parse_UTM_line(line):
+
+    """
+    Return the UTM zone and (x, y) coordinates from the 'UTM' line of a time history header.
+    (The fixed column positions follow Damon Joyce's R function `ConvertTIG2RDATA`.)
+    """
+
+    zone = int(line.split("  ")[1])
+    x = float(line[27:33])
+    y = float(line[48:55])
+
+    return zone, x, y
+
+
+def index_tig(tig_path):
+
+    """
+    Locate every grid point's time history in a grid-based model (.tig) in one pass.
+
+    The file is memory-mapped and searched for header and end-of-section
+    markers at C speed; no data rows are parsed.
+
+    Inputs
+    ------
+    tig_path (str, path): an NMSIM grid-based model result
+
+    Returns
+    -------
+    index (pandas DataFrame): one row per grid point with columns "site" (the data position name),
+                              "zone", "x", "y" (UTM), "n_rows" (time steps), and the byte offsets
+                              "header_offset", "data_offset", "end_offset"
+
+    """
+
+    records = []
+    with open(tig_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+
+        pos = mm.find(b"---End File Header---")
+        if(pos < 0):
+            raise ValueError("No '---End File Header---' line was found.")
+
+        pos = mm.find(b"\n", pos) + 1
+
+        while(pos > 0):
+
+            header_offset = pos
+
+            # the short header of this time history
+            header = []
+            for i in range(site_header_len):
+
+                nl = mm.find(b"\n", pos)
+                if(nl < 0):
+                    break
+
+                header.append(mm[pos:nl].decode("utf-8", errors="replace").rstrip("\r"))
+                pos = nl + 1
+
+            # anything after the last time history (e.g., blank lines) is ignored
+            if((len(header) < site_header_len) or (header[0].strip() == "")):
+                break
+
+            zone, x, y = [parse_UTM_line(l) for l in header if l.startswith("UTM")][0]
+
+            data_offset = pos
+            end_offset = mm.find(b"---End", pos)
+            if(end_offset < 0):
+                end_offset = len(mm)
+
+            records.append({"site": header[0].split(":", 1)[-1].strip(),
+                            "zone": zone,
+                            "x": x,
+                            "y": y,
+                            "n_rows": mm[data_offset:end_offset].count(b"\n"),
+                            "header_offset": header_offset,
+                            "data_offset": data_offset,
+                            "end_offset": end_offset})
+
+            # skip past the '---End of This Data Section---' line
+            pos = mm.find(b"\n", end_offset) + 1
+
+    return pd.DataFrame(records, columns=["site", "zone", "x", "y", "n_rows",
+                                          "header_offset", "data_offset", "end_offset"])
+
+
+def iter_tig_blocks(tig_path, index=None, dtype="float32", nodata=np.nan):
+
+    """
+    Iterate over the time history of each grid point, decoding one at a time.
+
+    Inputs
+    ------
+    tig_path (str, path): an NMSIM grid-based model result
+    index (pandas DataFrame): [optional] the result of `index_tig`, if already computed
+    dtype (str or numpy dtype): the output data type [default "float32"]
+    nodata (float): the value used for anything NMSIM did not compute [default np.nan]
+
+    Returns
+    -------
+    blocks (generator): (site number, levels) pairs, where levels has shape (n_rows, 37); see `columns`
+
+    """
+
+    if(index is None):
+        index = index_tig(tig_path)
+
+    with open(tig_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+
+        for i, (start, end) in enumerate(zip(index["data_offset"], index["end_offset"])):
+
+            lines = mm[start:end].decode("utf-8").splitlines()
+
+            if(len(lines) == 0):
+                yield i, np.empty((0, len(columns)), dtype=dtype)
+            else:
+                yield i, lines_to_levels(lines, dtype=dtype, nodata=nodata)
+
+
+def read_tig(tig_path, out=None, dtype="float32", nodata=np.nan, index=None):
+
+    """
+    Read a grid-based model (.tig) into a (site, time step, column) array.
+
+    Grid points are decoded one at a time and written straight into `out`,
+    so when `out` is a file path the full result never has to fit in memory.
+
+    Inputs
+    ------
+    tig_path (str, path): an NMSIM grid-based model result
+    out (str, path, or array): [optional] where to write the result - a `.npy` path
+                               (opened as a `numpy` memory map), or an existing array
+                               of the right shape. By default a new in-memory array.
+    dtype (str or numpy dtype): the output data type [default "float32"]
+    nodata (float): the value used for anything NMSIM did not compute [default np.nan]
+    index (pandas DataFrame): [optional] the result of `index_tig`, if already computed
+
+    Returns
+    -------
+    index (pandas DataFrame): see `index_tig`
+    levels (numpy array or memmap): shape (sites, time steps, 36); see `tig_columns`.
+                                    Grid points with fewer time steps than the longest are padded with NaN.
+
+    """
+
+    if(index is None):
+        index = index_tig(tig_path)
+
+    shape = (len(index), int(index["n_rows"].max()) if len(index) > 0 else 0, len(tig_columns))
+
+    if(out is None):
+        levels = np.empty(shape, dtype=dtype)
+
+    elif(isinstance(out, str)):
+        levels = np.lib.format.open_memmap(out, mode="w+", dtype=dtype, shape=shape)
+
+    else:
+        levels = out
+
+    for i, block in iter_tig_blocks(tig_path, index=index, dtype=dtype, nodata=nodata):
+
+        levels[i, :len(block)] = block[:, 1:]
+        levels[i, len(block):] = np.nan
+
+    if(isinstance(levels, np.memmap)):
+        levels.flush()
+
+    return index, levels
@@ -0,0 +1,243 @@
+#-----------------------------------------------------------------------------#
+# NMSIM_Standin_Solver.py
+#
+# NPS Natural Sounds Program
+#
+# A stand-in for `Nord2000batch.exe` that runs anywhere Python does.
+# It reads an NMSIM batch file and its control file exactly as the real
+# program would, then writes a synthetic (but correctly formatted) site
+# output file (.tis) using simple spherical spreading from each trajectory
+# point to each receiver. It exists so that batching, scheduling and
+# parsing code can be exercised on Linux without NMSIM itself.
+#
+# A "grid" analysis writes a grid output file (.tig) instead. Where NMSIM
+# lays its grid over the elevation file, the stand-in takes the grid points
+# from the site file (named iiiijjjj, as `NMSIM_Grid` writes them), keeping
+# those inside the sub-grid the batch file sets.
+#
+# Usage:
+#	python NMSIM_Standin_Solver.py [--sleep SECONDS] [--exit-code N] batch.txt
+#
+# History:
+#	D. Halyn Betchkal -- Created
+#
+#-----------------------------------------------------------------------------#
+
+# ================ Import Libraries =======================
+
+import sys
+import time
+import argparse
+import numpy as np
+
+from NMSIM_Results import bands
+from NMSIM_Trajectories import read_trajectory
+
+
+# ===========================  Define functions  =======================================
+
+def read_batch_file(batch_path):
+
+    """
+    Return the control file, analysis keyword and output path (without extension) of a batch file.
+    """
+
+    with open(batch_path) as f:
+        lines = [l.strip() for l in f.readlines()]
+
+    return lines[1], lines[2], lines[3]
+
+
+def read_grid_spec(batch_path):
+
+    """
+    Return the grid size and sub-grid of a "grid" batch file (see `NMSIM_Batch.write_batch_file`),
+    or None if the batch file sets none.
+    """
+
+    with open(batch_path) as f:
+        lines = [l.strip() for l in f.readlines()]
+
+    grid = {}
+    for axis, (lo, hi) in [("ii", ("ii_left", "ii_right")), ("jj", ("jj_bottom", "jj_top"))]:
+
+        where = [i for i, l in enumerate(lines) if l.startswith(axis + ":")]
+        if(len(where) == 0):
+            return None
+
+        i = where[0]
+        grid[axis + "_max"] = int(lines[i].split(":")[1])
+        grid[lo], grid[hi] = [int(v) for v in lines[i + 1].split(":")[1].split()]
+
+    return grid
+
+
+def read_control_file(control_path):
+
+    """
+    Return the elevation, site, trajectory and source paths of a control file.
+    """
+
+    with open(control_path) as f:
+        lines = [l.strip() for l in f.readlines()]
+
+    return lines[0], lines[2], lines[3], lines[6]
+
+
+def read_site_file(site_path):
+
+    """
+    Return the names and (x, y) coordinates of every receiver in a site file.
+    """
+
+    with open(site_path) as f:
+        lines = f.readlines()
+
+    n_sites = int(lines[1])
+
+    names = []
+    xy = []
+    for line in lines[2:2+n_sites]:
+
+        tokens = line.split()
+        xy.append([float(tokens[0]), float(tokens[1])])
+        names.append(" ".join(tokens[3:]))
+
+    return names, np.array(xy)
+
+
+def read_trajectory_points(trj_path):
+
+    """
+    Return the (time, x, y, z) columns of a trajectory file.
+    """
+
+    header, trajectory = read_trajectory(trj_path)
+
+    return [trajectory[c].values for c in ["time_elapsed", "x", "y", "z"]]
+
+
+def synthetic_levels(distance_m):
+
+    """
+    Centibel levels [F, A, 32 bands, d'] for each distance, by spherical spreading.
+    """
+
+    distance_m = np.maximum(distance_m, 10.0)
+
+    A = 1100 - 200*np.log10(distance_m)
+
+    # a gently sloping spectrum, with more attenuation at high frequencies over distance
+    slope = np.linspace(0, -300, len(bands))[np.newaxis, :]*(distance_m[:, np.newaxis]/10000)
+    spectrum = (A[:, np.newaxis] - 100) + slope
+
+    levels = np.column_stack((A + 20, A, spectrum, (A - 300)/2))
+    levels[levels < -999] = -999
+
+    return np.round(levels).astype(int)
+
+
+def write_site_block(out, name, x, y, times, levels, zone=0):
+
+    """
+    Write one receiver's time history: a nine-line header, the data and an end line.
+    """
+
+    out.write(" Site: {0}\n".format(name))
+    out.write(" {0:8d}\n".format(len(times)))
+    out.write(" Lat/Long:     0.000000     0.000000\n")
+
+    # coordinates sit in fixed columns [27:33] and [48:55], as NMSIM writes them
+    out.write("UTM  {0:d}".format(zone).ljust(20) + "X (m): {0:6.0f}".format(x) + "      Y (m):".ljust(15) + "{0:7.0f}\n".format(y))
+    out.write(" Date: 01/01/2000  Time: 00:00:00\n")
+    out.write(" Not used\n")
+    out.write("\n")
+    out.write(" Echo\n")
+    out.write("   SP#     TIME     F     A" + "".join("{0:>6d}".format(b) for b in range(10, 42)) + "    d'\n")
+
+    for n, (t, row) in enumerate(zip(times, levels)):
+        out.write("{0:6d}{1:10.2f}".format(n + 1, t) + "".join("{0:6d}".format(v) for v in row) + "\n")
+
+    out.write("---End of This Data Section---\n")
+
+
+def standin_site_analysis(control_path, out_path):
+
+    """
+    Write a synthetic .tis for every receiver in the control file's site file.
+    """
+
+    elev_file, site_file, trj_file, source_path = read_control_file(control_path)
+
+    names, sites = read_site_file(site_file)
+    t, x, y, z = read_trajectory_points(trj_file)
+
+    with open(out_path + ".tis", 'w') as out:
+
+        out.write(" " + out_path + ".tis\n")
+        for f in [elev_file, "-", site_file, "-", "-"]:
+            out.write(" " + f + "\n")
+        out.write(" " + trj_file + "\n")
+        out.write(" " + source_path + "\n")
+        out.write("---End File Header---\n")
+
+        for name, (sx, sy) in zip(names, sites):
+
+            distance = np.sqrt((x - sx)**2 + (y - sy)**2 + z**2)
+            write_site_block(out, name, sx, sy, t + distance/343.0, synthetic_levels(distance))
+
+
+def standin_grid_analysis(control_path, out_path, grid):
+
+    """
+    Write a synthetic .tig for every grid point of the site file inside the batch file's sub-grid.
+    """
+
+    elev_file, site_file, trj_file, source_path = read_control_file(control_path)
+
+    names, sites = read_site_file(site_file)
+    t, x, y, z = read_trajectory_points(trj_file)
+
+    with open(out_path + ".tig", 'w') as out:
+
+        out.write(" " + out_path + ".tig\n")
+        for f in [elev_file, "-", site_file, "-", "-"]:
+            out.write(" " + f + "\n")
+        out.write("ii: {0:4d}  {1:4d}  {2:4d}\n".format(grid["ii_left"], grid["ii_right"], grid["ii_max"]))
+        out.write("jj: {0:4d}  {1:4d}  {2:4d}\n".format(grid["jj_bottom"], grid["jj_top"], grid["jj_max"]))
+        out.write(" " + trj_file + "\n")
+        out.write(" " + source_path + "\n")
+        out.write("---End File Header---\n")
+
+        for name, (sx, sy) in zip(names, sites):
+
+            ii, jj = int(name[:4]), int(name[4:8])
+            if((grid["ii_left"] <= ii <= grid["ii_right"]) and (grid["jj_bottom"] <= jj <= grid["jj_top"])):
+
+                distance = np.sqrt((x - sx)**2 + (y - sy)**2 + z**2)
+                write_site_block(out, name, sx, sy, t + distance/343.0, synthetic_levels(distance))
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="A stand-in for Nord2000batch.exe")
+    parser.add_argument("batch_file")
+    parser.add_argument("--sleep", type=float, default=0.0, help="seconds to wait before writing output")
+    parser.add_argument("--exit-code", type=int, default=0, help="exit with this code without writing output")
+    args = parser.parse_args()
+
+    time.sleep(args.sleep)
+
+    if(args.exit_code != 0):
+        print("stand-in solver: failing by request")
+        sys.exit(args.exit_code)
+
+    control_path, analysis, out_path = read_batch_file(args.batch_file)
+
+    print("stand-in solver: " + analysis + " analysis")
+    print(out_path)
+
+    if(analysis == "grid"):
+        standin_grid_analysis(control_path, out_path, read_grid_spec(args.batch_file))
+    else:
+        standin_site_analysis(control_path, out_path)
@@ -0,0 +1,333 @@
+#-----------------------------------------------------------------------------#
+# NMSIM_Sweep.py
+#
+# NPS Natural Sounds Program
+#
+# Sensitivity studies: run one NMSIM site analysis under every combination
+# of a set of scenario parameters, in one call, e.g.
+#
+#	project = sweep_project(out_dir, "UWBT", elev_file, trj_file, sites, source_path)
+#	results, runs = run_sweep(project, ["LAeq", "SEL"],
+#	                          source=[helicopter_src, fixed_wing_src],
+#	                          agl_offset=[-150, 0, 150, 300],
+#	                          site_height=[1.5, 10.0])
+#
+# The dimensions of a sweep (`sweep_dimensions`) are the noise source
+# (.src), an offset added to the trajectory's altitude (m), and the
+# receivers' height above ground (m). (Weather files are not swept: their
+# entry in an NMSIM control file is not documented in Appendix G.)
+#
+# A project holds the inputs every scenario shares (elevation, impedance,
+# trajectory, receivers) in memory, once. Each altitude offset becomes one
+# derived trajectory file and each receiver height one site file, however
+# many scenarios use it; scenarios resolving to identical inputs become one
+# solver job. Jobs run in a pool of solver processes (see `NMSIM_Batch`)
+# under a build manifest, so an interrupted sweep resumes where it stopped
+# and a repeated one only runs the scenarios that are new.
+#
+# Results are labelled by every dimension: a DataFrame indexed by
+# (source, agl_offset, site_height, site), one column per metric,
+# which `sweep_array` turns into a multi-dimensional array.
+#
+# History:
+#	D. Halyn Betchkal -- Created
+#
+#-----------------------------------------------------------------------------#
+
+# ================ Import Libraries =======================
+
+import os
+import json
+import hashlib
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+
+from NMSIM_Batch import write_site_file, solver_job, run_solver_jobs
+from NMSIM_Cache import cached_tig
+from NMSIM_Manifest import replace_if_changed
+from NMSIM_Metrics import grid_metrics
+from NMSIM_Timing import count
+from NMSIM_Trajectories import read_trajectory, write_trajectory
+
+
+# the dimensions of a scenario sweep, in the order results are indexed
+sweep_dimensions = ["source", "agl_offset", "site_height"]
+
+
+# ===========================  Define functions  =======================================
+
+def sweep_project(out_dir, name, elev_file, trj_file, sites, source_path, site_height=1.5,
+                  imped_file=None, contour_interval=500.0):
+
+    '''
+    Gather the inputs shared by every scenario of a sweep (the trajectory is read once, here).
+
+    Inputs
+    ------
+    out_dir (str, path): where derived trajectories, site files, outputs and the manifest are written
+    name (str): a name for the study (prefixes every file it writes)
+    elev_file (str, path): the elevation file (.flt)
+    trj_file (str, path): the trajectory file (.trj); altitude offsets are added to its z coordinates
+    sites (pandas DataFrame): the receivers, with columns "x", "y" (UTM, m) and "name"
+    source_path (str, path): the noise source file (.src) of scenarios that do not vary it
+    site_height (float): receiver height above ground (m) of scenarios that do not vary it [default 1.5]
+    imped_file (str, path): [optional] the impedance file
+    contour_interval (float): contour interval in meters [default 500.0]
+
+    Returns
+    -------
+    project (dict)
+
+    '''
+
+    header, trajectory = read_trajectory(trj_file)
+
+    return {"out_dir": out_dir,
+            "name": name,
+            "elev_file": elev_file,
+            "imped_file": imped_file,
+            "contour_interval": contour_interval,
+            "trj_file": trj_file,
+            "trj_header": header,
+            "trajectory": trajectory,
+            "sites": sites.reset_index(drop=True)[["x", "y", "name"]],
+            "manifest": os.path.join(out_dir, name + "_manifest.json"),
+            "defaults": {"source": source_path,
+                         "agl_offset": 0.0,
+                         "site_height": site_height}}
+
+
+def dimension_values(dimension, values):
+
+    '''
+    The distinct values of one sweep dimension, in the order given, as they are labelled in results.
+    '''
+
+    if((values is None) or isinstance(values, (str, int, float))):
+        values = [values]
+
+    if(dimension in ["agl_offset", "site_height"]):
+        labels = [float(v) for v in values]
+    else:
+        labels = [os.path.abspath(v) for v in values]
+
+    return list(dict.fromkeys(labels))
+
+
+def expand_scenarios(project, **dimensions):
+
+    '''
+    Every combination of the values given for each sweep dimension (each dimension not given
+    takes the project's value). Repeated values are dropped, so every scenario is distinct.
+
+    Inputs
+    ------
+    project (dict): see `sweep_project`
+    **dimensions: a value or a list of values for any of `sweep_dimensions`, e.g. agl_offset=[0, 150, 300]
+
+    Returns
+    -------
+    scenarios (pandas DataFrame): one row per scenario, one column per dimension
+
+    '''
+
+    unknown = set(dimensions) - set(sweep_dimensions)
+    if(len(unknown) > 0):
+        raise ValueError("Unknown sweep dimension(s): " + ", ".join(sorted(unknown)) +
+                         "; choose from " + ", ".join(sweep_dimensions))
+
+    values = [dimension_values(d, dimensions.get(d, project["defaults"][d])) for d in sweep_dimensions]
+
+    return pd.DataFrame(list(itertools.product(*values)), columns=sweep_dimensions)
+
+
+def offset_trajectory(project, offset):
+
+    '''
+    The trajectory file of one altitude offset (m), written once per sweep (no offset is the original).
+    '''
+
+    if(offset == 0):
+        return project["trj_file"]
+
+    header, trajectory = project["trj_header"], project["trajectory"]
+
+    trj_path = os.path.join(project["out_dir"], "trajectories", "{0}_agl{1:+.1f}m.trj".format(project["name"], offset))
+
+    def write(tmp):
+        write_trajectory(tmp, *[trajectory[c].values for c in ["time_elapsed", "x", "y"]],
+                         trajectory["z"].values + offset,
+                         *[trajectory[c].values for c in ["heading", "climb_angle", "speed"]],
+                         header["zone"], "{0} ({1:+.1f} m altitude)".format(header["title"], offset),
+                         power=trajectory["power"].values if "power" in trajectory else 95.0,
+                         roll=trajectory["roll"].values if "roll" in trajectory else 0.0,
+                         temperature=header["temperature"] if header["temperature"] is not None else 59.0,
+                         humidity=header["humidity"] if header["humidity"] is not None else 70.0)
+
+    return replace_if_changed(trj_path, write)
+
+
+def height_site_file(project, height):
+
+    '''
+    The site file of one receiver height (m), written once per sweep.
+    '''
+
+    sites = project["sites"]
+
+    site_path = os.path.join(project["out_dir"], "sites", "{0}_h{1:.2f}m.sit".format(project["name"], height))
+
+    def write(tmp):
+        write_site_file(tmp, sites["x"], sites["y"], height, sites["name"], project["elev_file"])
+
+    return replace_if_changed(site_path, write)
+
+
+def plan_sweep(project, scenarios):
+
+    '''
+    Write the derived inputs of a sweep and describe its distinct solver jobs.
+
+    Each altitude offset and each receiver height is written once, however many
+    scenarios share it, and scenarios with identical inputs share one job.
+
+    Inputs
+    ------
+    project (dict): see `sweep_project`
+    scenarios (pandas DataFrame): see `expand_scenarios`
+
+    Returns
+    -------
+    scenarios (pandas DataFrame): as given, plus each scenario's "job" (name) and "tis_path"
+    jobs (list of dict): one site solver job per distinct set of inputs, for `NMSIM_Batch.run_solver_jobs`
+
+    '''
+
+    for folder in ["trajectories", "sites", "outputs"]:
+        os.makedirs(os.path.join(project["out_dir"], folder), exist_ok=True)
+
+    trj_files = {offset: offset_trajectory(project, offset) for offset in scenarios["agl_offset"].unique()}
+    site_files = {height: height_site_file(project, height) for height in scenarios["site_height"].unique()}
+
+    scenarios = scenarios.copy()
+
+    jobs = {}
+    names = []
+    for s in scenarios.itertuples(index=False):
+
+        inputs = {"source": s.source,
+                  "trj_file": os.path.abspath(trj_files[s.agl_offset]),
+                  "site_file": os.path.abspath(site_files[s.site_height])}
+
+        # named by its inputs, so a job keeps its output from one sweep to the next
+        key = hashlib.sha1(json.dumps(inputs, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+        job_name = project["name"] + "_" + key
+
+        if(job_name not in jobs):
+            jobs[job_name] = solver_job(job_name, os.path.join(project["out_dir"], "outputs", job_name),
+                                        project["elev_file"], inputs["site_file"], inputs["trj_file"], inputs["source"],
+                                        imped_file=project["imped_file"], contour_interval=project["contour_interval"])
+        names.append(job_name)
+
+    scenarios["job"] = names
+    scenarios["tis_path"] = [jobs[n]["out_path"] + ".tis" for n in names]
+
+    return scenarios, list(jobs.values())
+
+
+def site_metrics(tis_path, metrics):
+
+    '''
+    Metrics of every receiver of a multi-receiver site analysis (.tis), indexed by receiver name.
+    '''
+
+    # (the time histories of a .tis are laid out as those of a .tig)
+    index, levels = cached_tig(tis_path)
+    values, meta = grid_metrics(levels, metrics)
+    values.index = pd.Index(index["site"].values, name="site")
+
+    return values
+
+
+def run_sweep(project, metrics, NMSIMpath=None, processes=None, timeout=None, retries=0, force=False, **dimensions):
+
+    '''
+    Run every scenario of a sweep and compute metrics at every receiver.
+
+    Inputs
+    ------
+    project (dict): see `sweep_project`
+    metrics (list of str): metric aliases, e.g. ["LAeq", "SEL", "TA35"]; see `NMSIM_Metrics.parse_alias`
+    NMSIMpath (str, path, or list): [optional] the solver command, see `NMSIM_Batch.find_Nord2000batch`
+    processes (int): solvers run (and outputs read) at once [default: the number of CPUs]
+    timeout (float): [optional] seconds before a job's attempt is killed
+    retries (int): how many times to re-run a failed job [default 0]
+    force (bool): run every job, even those already computed from identical inputs [default False]
+    **dimensions: the values of each sweep dimension, see `expand_scenarios`
+
+    Returns
+    -------
+    results (pandas DataFrame): indexed by (source, agl_offset, site_height, site), one column per
+                                metric (NaN for the receivers of scenarios whose job failed); see `sweep_array`
+    runs (pandas DataFrame): every scenario, its job, and the job's record from `NMSIM_Batch.run_solver_jobs`
+
+    '''
+
+    if(isinstance(metrics, str)):
+        metrics = [metrics]
+
+    scenarios, jobs = plan_sweep(project, expand_scenarios(project, **dimensions))
+
+    records = run_solver_jobs(jobs, NMSIMpath=NMSIMpath, processes=processes, timeout=timeout, retries=retries,
+                              manifest=project["manifest"], force=force)
+
+    count("scenarios", len(scenarios))
+
+    ok = records.loc[records["ok"], "name"].tolist()
+    tis_paths = [job["out_path"] + ".tis" for job in jobs if job["name"] in ok]
+
+    with ThreadPoolExecutor(max_workers=processes or os.cpu_count() or 1) as pool:
+        values = dict(zip(ok, pool.map(site_metrics, tis_paths, itertools.repeat(metrics))))
+
+    # a failed job leaves its scenarios' receivers without values, so every scenario has its rows
+    missing = pd.DataFrame(np.nan, index=pd.Index(project["sites"]["name"].values, name="site"), columns=metrics)
+
+    frames = []
+    for s in scenarios.itertuples(index=False):
+
+        frame = values.get(s.job, missing).reset_index()
+        for d in sweep_dimensions:
+            frame.insert(sweep_dimensions.index(d), d, getattr(s, d))
+        frames.append(frame)
+
+    results = pd.concat(frames, ignore_index=True).set_index(sweep_dimensions + ["site"])
+    runs = scenarios.merge(records.drop(columns=["out_path"]).rename(columns={"name": "job"}), on="job", how="left")
+
+    return results, runs
+
+
+def sweep_array(results, metric):
+
+    '''
+    One metric of a sweep as a dense array, one axis per sweep dimension and one for the receivers.
+
+    Inputs
+    ------
+    results (pandas DataFrame): see `run_sweep`
+    metric (str): one of its columns
+
+    Returns
+    -------
+    values (numpy array): shape (sources, offsets, heights, sites)
+    coords (dict): dimension -> the label of each position along that axis
+
+    '''
+
+    coords = {name: results.index.get_level_values(name).unique().tolist() for name in results.index.names}
+
+    full = pd.MultiIndex.from_product(list(coords.values()), names=list(coords.keys()))
+    values = results[metric].reindex(full).to_numpy().reshape([len(c) for c in coords.values()])
+
+    return values, coords
@@ -0,0 +1,317 @@
+#-----------------------------------------------------------------------------#
+# NMSIM_Timing.py
+#
+# NPS Natural Sounds Program
+#
+# Where does the time go in a run of hundreds of flights? Functions in this
+# repository time their stages (query, projection, densify, write, solve,
+# parse, match, compare) and count what they process (points, flights,
+# bytes) through this module. Each timing is a structured record, kept in
+# memory and, optionally, appended to a log of JSON lines; `summary` and
+# `report` total every stage and give percentiles of its durations.
+#
+# Instrumentation is off until `enable` is called. While it is off, `timed`
+# hands back one shared do-nothing context and `count` returns at once, so
+# instrumented code runs at full speed.
+#
+# Usage:
+#	enable("run_timing.jsonl")
+#	with timed("densify", flight=f_id):
+#	    ...
+#	count("points", len(tracks))
+#	print(report())
+#
+# History:
+#	D. Halyn Betchkal -- Created
+#
+#-----------------------------------------------------------------------------#
+
+# ================ Import Libraries =======================
+
+import os
+import json
+import time
+import threading
+import functools
+import contextlib
+import datetime as dt
+from collections import Counter
+import numpy as np
+import pandas as pd
+
+
+# the instrumentation of this process (see `enable`)
+state = {"enabled": False,
+         "log": None,
+         "records": [],
+         "counters": Counter(),
+         "lock": threading.Lock()}
+
+# handed out by `timed` while instrumentation is off
+untimed = contextlib.nullcontext()
+
+
+# ===========================  Define functions  =======================================
+
+def enable(log_path=None):
+
+    '''
+    Start recording stage timings and counters (forgetting any recorded before).
+
+    Inputs
+    ------
+    log_path (str, path): [optional] a file to which every record is appended as one line of JSON
+
+    Returns
+    -------
+    None
+
+    '''
+
+    disable()
+
+    with state["lock"]:
+
+        if(log_path is not None):
+            os.makedirs(os.path.dirname(os.path.abspath(log_path)), exist_ok=True)
+            state["log"] = open(log_path, "a", buffering=1)
+
+        state["records"] = []
+        state["counters"] = Counter()
+        state["enabled"] = True
+
+
+def disable():
+
+    '''
+    Stop recording and close the log (the records and counters so far are kept for `summary`).
+    '''
+
+    with state["lock"]:
+
+        state["enabled"] = False
+
+        if(state["log"] is not None):
+            state["log"].close()
+            state["log"] = None
+
+
+def is_enabled():
+
+    '''
+    True while instrumentation is recording.
+    '''
+
+    return state["enabled"]
+
+
+def to_json(value):
+
+    '''
+    Make a value JSON-serializable: `numpy` scalars as numbers, anything else as text.
+    '''
+
+    return value.item() if isinstance(value, np.generic) else str(value)
+
+
+def emit(record):
+
+    '''
+    Keep a record (a JSON-serializable dict) and append it to the log, if there is one.
+    '''
+
+    if(not state["enabled"]):
+        return
+
+    record = dict(record, time=dt.datetime.now().isoformat(timespec="milliseconds"), pid=os.getpid(),
+                  thread=threading.current_thread().name)
+
+    with state["lock"]:
+
+        state["records"].append(record)
+
+        if(state["log"] is not None):
+            state["log"].write(json.dumps(record, default=to_json) + "\n")
+
+
+def record_duration(stage, seconds, ok=True, **fields):
+
+    '''
+    Record a stage whose duration was measured elsewhere (e.g., by `NMSIM_Batch.run_solver_job`).
+    '''
+
+    if(not state["enabled"]):
+        return
+
+    emit(dict(fields, event="stage", stage=stage, seconds=float(seconds), ok=bool(ok)))
+
+
+@contextlib.contextmanager
+def stage_timer(stage, fields):
+
+    '''
+    Time the body of a `with` block as one record of a stage (see `timed`).
+    '''
+
+    t0 = time.perf_counter()
+    ok = False
+    try:
+        yield
+        ok = True
+    finally:
+        emit(dict(fields, event="stage", stage=stage, seconds=time.perf_counter() - t0, ok=ok))
+
+
+def timed(stage, **fields):
+
+    '''
+    A context manager timing the body of a `with` block as one record of a stage.
+
+    Inputs
+    ------
+    stage (str): the name of the stage, e.g. "densify"
+    **fields: anything else worth keeping with the record, e.g. flight=f_id
+
+    Returns
+    -------
+    context (context manager): does nothing at all while instrumentation is off
+
+    '''
+
+    if(not state["enabled"]):
+        return untimed
+
+    return stage_timer(stage, fields)
+
+
+def timer(stage):
+
+    '''
+    A decorator timing every call of a function as one record of a stage.
+    '''
+
+    def decorate(function):
+
+        @functools.wraps(function)
+        def timed_function(*args, **kwargs):
+
+            if(not state["enabled"]):
+                return function(*args, **kwargs)
+
+            with stage_timer(stage, {}):
+                return function(*args, **kwargs)
+
+        return timed_function
+
+    return decorate
+
+
+def count(counter, n=1):
+
+    '''
+    Add to a counter, e.g. count("points", len(tracks)).
+    '''
+
+    if(not state["enabled"]):
+        return
+
+    with state["lock"]:
+        state["counters"][counter] += n
+
+
+def counters():
+
+    '''
+    The counters so far, as a dict.
+    '''
+
+    with state["lock"]:
+        return dict(state["counters"])
+
+
+def read_log(log_path):
+
+    '''
+    Read the records of a JSON-lines log (e.g., of an earlier run) for `summary`.
+    '''
+
+    with open(log_path) as f:
+        return [json.loads(line) for line in f if line.strip() != ""]
+
+
+def summary(records=None):
+
+    '''
+    Total and percentiles of the time spent in each stage.
+
+    Inputs
+    ------
+    records (list of dict): [optional] timing records, e.g. from `read_log` [default those of this process]
+
+    Returns
+    -------
+    table (pandas DataFrame): one row per stage, most time first, with columns "calls", "failed",
+                              "total_s", "share" (of the time of all stages together; a stage run
+                              inside another is counted in both), "mean_s", "p50_s", "p90_s",
+                              "p99_s" and "max_s"
+
+    '''
+
+    if(records is None):
+        with state["lock"]:
+            records = list(state["records"])
+
+    stages = pd.DataFrame([r for r in records if r.get("event") == "stage"], columns=["stage", "seconds", "ok"])
+
+    rows = []
+    for stage, group in stages.groupby("stage"):
+
+        seconds = group["seconds"].to_numpy(dtype="float64")
+        p50, p90, p99 = np.percentile(seconds, [50, 90, 99])
+
+        rows.append({"stage": stage,
+                     "calls": len(seconds),
+                     "failed": int((~group["ok"].astype(bool)).sum()),
+                     "total_s": seconds.sum(),
+                     "mean_s": seconds.mean(),
+                     "p50_s": p50,
+                     "p90_s": p90,
+                     "p99_s": p99,
+                     "max_s": seconds.max()})
+
+    table = pd.DataFrame(rows, columns=["stage", "calls", "failed", "total_s", "mean_s", "p50_s", "p90_s", "p99_s", "max_s"])
+    table.insert(4, "share", table["total_s"]/table["total_s"].sum() if len(table) > 0 else [])
+
+    return table.sort_values("total_s", ascending=False).set_index("stage")
+
+
+def report(records=None, counts=None):
+
+    '''
+    A plain text report of a run: `summary` of every stage, then every counter.
+    The counters are also written to the log, if there is one.
+
+    Inputs
+    ------
+    records (list of dict): [optional] see `summary`
+    counts (dict): [optional] counters to report [default those of this process]
+
+    Returns
+    -------
+    text (str)
+
+    '''
+
+    if(counts is None):
+        counts = counters()
+        emit({"event": "counters", "counters": counts})
+
+    table = summary(records)
+
+    lines = ["time spent in each stage (s):",
+             table.to_string(float_format="{0:.3f}".format) if len(table) > 0 else "\t(nothing was timed)",
+             "",
+             "counters:"]
+    lines += ["\t{0}: {1:,}".format(k, v) for k, v in sorted(counts.items())]
+
+    return "\n".join(lines)
@@ -0,0 +1,317 @@
+#-----------------------------------------------------------------------------#
+# NMSIM_Track_Store.py
+#
+# NPS Natural Sounds Program
+#
+# A local store of GPS points from the Denali Overflights Database, so that
+# repeated (or overlapping) queries are answered from disk rather than over
+# the network. Points are kept as Parquet files partitioned by date:
+#
+#	store_dir/
+#		index.json                                   which areas have been fetched on which days
+#		aircraft_info=False/date=2019-06-01/tracks.parquet
+#		...
+#
+# A query for a range of dates within a mask polygon is answered locally
+# for every day on which a polygon covering the mask was already fetched;
+# only the remaining (contiguous runs of) days are requested from the
+# database, and then saved for next time.
+#
+# As from the database itself, the answer is every point of each flight
+# that has any point within the mask, not only the points inside it. A
+# flight that crosses midnight is stored in the partitions of both days,
+# so the days either side of a query are read for the rest of its flights.
+#
+# The database function is passed in (normally `query_tracks` from the DENA
+# overflights scripts), so any stand-in with the same signature can be used.
+#
+# History:
+#	D. Halyn Betchkal -- Created
+#
+#-----------------------------------------------------------------------------#
+
+# ================ Import Libraries =======================
+
+import os
+import json
+import datetime as dt
+import pandas as pd
+import geopandas as gpd
+from shapely import wkt
+
+
+# ===========================  Define functions  =======================================
+
+def mask_geometry(mask):
+
+    """
+    A single `shapely` geometry (in WGS84) from a mask given as a GeoDataFrame, GeoSeries or geometry.
+    """
+
+    if(isinstance(mask, (gpd.GeoDataFrame, gpd.GeoSeries))):
+
+        if(mask.crs is not None):
+            mask = mask.to_crs("EPSG:4326")
+
+        return mask.union_all()
+
+    return mask
+
+
+def load_index(store_dir):
+
+    """
+    Read the store's index: for each variant, the areas fetched per day (as WKT) and the column names.
+    """
+
+    path = os.path.join(store_dir, "index.json")
+
+    if(not os.path.exists(path)):
+        return {}
+
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_index(store_dir, index):
+
+    """
+    Write the store's index atomically.
+    """
+
+    path = os.path.join(store_dir, "index.json")
+
+    tmp = path + ".{0}.tmp".format(os.getpid())
+    with open(tmp, "w") as f:
+        json.dump(index, f, indent=1, sort_keys=True)
+
+    os.replace(tmp, path)
+
+
+def partition_path(store_dir, variant, day):
+
+    """
+    The Parquet file holding one day of points.
+    """
+
+    return os.path.join(store_dir, variant, "date=" + day, "tracks.parquet")
+
+
+def is_covered(index, variant, day, geometry):
+
+    """
+    True if a polygon covering `geometry` has already been fetched for `day`.
+    """
+
+    areas = index.get(variant, {}).get("days", {}).get(day, [])
+
+    return any(wkt.loads(a).covers(geometry) for a in areas)
+
+
+def add_coverage(index, variant, day, geometry):
+
+    """
+    Record that `geometry` was fetched for `day` (dropping any smaller areas it covers).
+    """
+
+    days = index.setdefault(variant, {}).setdefault("days", {})
+
+    areas = [a for a in days.get(day, []) if not geometry.covers(wkt.loads(a))]
+    days[day] = areas + [geometry.wkt]
+
+
+def contiguous_runs(days):
+
+    """
+    Group sorted 'YYYY-MM-DD' strings into (first, last) runs of consecutive days.
+    """
+
+    runs = []
+    for day in days:
+
+        d = dt.date.fromisoformat(day)
+
+        if((len(runs) > 0) and (d - runs[-1][1] == dt.timedelta(days=1))):
+            runs[-1][1] = d
+        else:
+            runs.append([d, d])
+
+    return [(first.isoformat(), last.isoformat()) for first, last in runs]
+
+
+def point_days(tracks, time_column):
+
+    """
+    The 'YYYY-MM-DD' day of every point.
+    """
+
+    return pd.to_datetime(tracks[time_column]).dt.strftime("%Y-%m-%d").values
+
+
+def write_partitions(store_dir, variant, tracks, days=None, time_column="ak_datetime", key=("flight_id", "ak_datetime")):
+
+    """
+    Merge newly fetched points into the day partitions they belong to.
+
+    Inputs
+    ------
+    store_dir (str, path): the store's folder
+    variant (str): the store's sub-folder for these query options
+    tracks (geopandas GeoDataFrame): points returned by the database
+    days (list of str): [optional] only the points of these days are kept [default every day the points fall on,
+                        so flights that cross midnight are stored whole]
+    time_column (str): the column that assigns points to days [default "ak_datetime"]
+    key (tuple): the columns identifying a unique point [default ("flight_id", "ak_datetime")]
+
+    Returns
+    -------
+    None
+
+    """
+
+    if(len(tracks) == 0):
+        return
+
+    labels = point_days(tracks, time_column)
+
+    if(days is None):
+        days = sorted(set(labels))
+
+    for day in days:
+
+        new = tracks[labels == day]
+        if(len(new) == 0):
+            continue
+
+        path = partition_path(store_dir, variant, day)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # the same point may already be stored (e.g., fetched earlier with a smaller mask)
+        if(os.path.exists(path)):
+            new = pd.concat([gpd.read_parquet(path), new]).drop_duplicates(subset=list(key), keep="last")
+
+        tmp = path + ".{0}.tmp".format(os.getpid())
+        new.to_parquet(tmp)
+        os.replace(tmp, path)
+
+
+def neighbouring_days(days):
+
+    """
+    The 'YYYY-MM-DD' days either side of `days` that are not among them.
+    """
+
+    near = set()
+    for day in days:
+
+        d = dt.date.fromisoformat(day)
+        near.update([(d - dt.timedelta(days=1)).isoformat(), (d + dt.timedelta(days=1)).isoformat()])
+
+    return sorted(near - set(days))
+
+
+def read_partitions(store_dir, variant, days, geometry, columns=None):
+
+    """
+    Read every stored point of each flight with a point within `geometry` on one of `days`
+    (including its points on the days either side, for flights that cross midnight).
+    """
+
+    parts = {}
+    for day in list(days) + neighbouring_days(days):
+
+        path = partition_path(store_dir, variant, day)
+        if(os.path.exists(path)):
+            parts[day] = gpd.read_parquet(path)
+
+    # the flights that enter the mask on the days asked for
+    flights = set()
+    for day in days:
+
+        if(day not in parts):
+            continue
+
+        # a quick bounding box test before the exact one
+        xmin, ymin, xmax, ymax = geometry.bounds
+        part = parts[day].cx[xmin:xmax, ymin:ymax]
+
+        flights.update(part.loc[part.within(geometry), "flight_id"])
+
+    # ...and all of their points, inside the mask or not
+    selected = [part[part["flight_id"].isin(flights)] for part in parts.values()]
+    selected = [part for part in selected if len(part) > 0]
+
+    if(len(selected) == 0):
+        return gpd.GeoDataFrame([], columns=columns if columns is not None else ["geometry"], crs="EPSG:4326")
+
+    return gpd.GeoDataFrame(pd.concat(selected, ignore_index=True), crs=selected[0].crs)
+
+
+def cached_query_tracks(query_tracks, store_dir, start_date, end_date, mask, aircraft_info=False,
+                        time_column="ak_datetime", **kwargs):
+
+    """
+    `query_tracks` through the local store: fetch only the days not already stored for this mask.
+
+    Stored points are assigned to days by `time_column`. Missing days are fetched
+    in contiguous runs, each padded by a day on either side so that the database's
+    own notion of a day (UTC or local) cannot clip a stored day short.
+
+    Inputs
+    ------
+    query_tracks (function): called as query_tracks(start_date=..., end_date=..., mask=...,
+                             aircraft_info=..., **kwargs); returns a GeoDataFrame of points
+    store_dir (str, path): the store's folder (created if need be)
+    start_date (str): first day, "YYYY-MM-DD"
+    end_date (str): last day (inclusive), "YYYY-MM-DD"
+    mask (geopandas GeoDataFrame or shapely geometry): the area of interest, in WGS84
+    aircraft_info (bool): passed to `query_tracks`; stored separately [default False]
+    time_column (str): the time of each point [default "ak_datetime"]
+    kwargs: passed to `query_tracks` (e.g., connection_txt)
+
+    Returns
+    -------
+    tracks (geopandas GeoDataFrame): every point of each flight with a point within the mask in the
+                                     date range, sorted by flight and time
+
+    """
+
+    os.makedirs(store_dir, exist_ok=True)
+
+    variant = "aircraft_info=" + str(bool(aircraft_info))
+    geometry = mask_geometry(mask)
+    index = load_index(store_dir)
+
+    days = [d.strftime("%Y-%m-%d") for d in pd.date_range(start_date, end_date, freq="D")]
+    missing = [d for d in days if not is_covered(index, variant, d, geometry)]
+
+    print("\tTrack store:", len(days) - len(missing), "of", len(days), "days available locally.")
+
+    for first, last in contiguous_runs(missing):
+
+        print("\tQuerying the database from", first, "to", last)
+
+        padded_start = (dt.date.fromisoformat(first) - dt.timedelta(days=1)).isoformat()
+        padded_end = (dt.date.fromisoformat(last) + dt.timedelta(days=1)).isoformat()
+
+        fetched = query_tracks(start_date=padded_start, end_date=padded_end, mask=mask,
+                               aircraft_info=aircraft_info, **kwargs)
+
+        run = [d for d in missing if first <= d <= last]
+
+        # (every point is kept, those of the padding days too, so flights are stored whole)
+        write_partitions(store_dir, variant, fetched, time_column=time_column)
+
+        # the index is only updated once the points are safely stored
+        index.setdefault(variant, {})["columns"] = list(fetched.columns)
+        for day in run:
+            add_coverage(index, variant, day, geometry)
+
+        save_index(store_dir, index)
+
+    tracks = read_partitions(store_dir, variant, days, geometry, columns=index.get(variant, {}).get("columns"))
+
+    if(len(tracks) > 0):
+        tracks = tracks.sort_values(["flight_id", time_column]).reset_index(drop=True)
+
+    return tracks
@@ -0,0 +1,373 @@
+#-----------------------------------------------------------------------------#
+# NMSIM_Trajectories.py
+#
+# NPS Natural Sounds Program
+#
+# This module contains array-based tools for preparing aircraft trajectories
+# for NMSIM. Every function here works on whole columns of a flight at once
+# (time, x, y, z, heading, speed) rather than one GPS fix at a time, so that
+# long flights can be processed without per-point Python overhead.
+#
+# History:
+#	D. Halyn Betchkal -- Created
+#
+#-----------------------------------------------------------------------------#
+
+# ================ Import Libraries =======================
+
+import os
+import numpy as np
+import pandas as pd
+
+
+# the columns of the data section of a trajectory file (.trj), in order
+trj_columns = ["time_elapsed", "x", "y", "z", "heading", "climb_angle", "speed", "power", "roll"]
+
+# ===========================  Define functions  =======================================
+
+def interpolate_headings(t, headings, t_new):
+
+    """
+    A vectorized version of `interpolate_heading` from `NMSIM_DENA_Flight_Tracks`.
+    Heading is periodic, so each segment is interpolated along the shortest
+    path around the compass (i.e., 350° -> 10° passes through 0°, not 180°).
+
+    Inputs
+    ------
+    t (numpy array): monotonically increasing times of the known headings
+    headings (numpy array): compass headings in degrees at each time in `t`
+    t_new (numpy array): the times at which headings are desired
+
+    Returns
+    -------
+    headings_new (numpy array): interpolated headings in degrees, on the interval [0, 360)
+
+    """
+
+    # unwrapping removes jumps > 180° so the sequence becomes linear
+    unwrapped = np.unwrap(np.asarray(headings, dtype="float"), period=360)
+
+    headings_new = np.interp(t_new, t, unwrapped) % 360
+
+    return headings_new
+
+
+def densify_trajectory(t, x, y, z, heading, speed, step=1.0, extra=None):
+
+    """
+    Resample a trajectory to a regular time step in a single pass.
+    Every original GPS fix is retained; new points are inserted between fixes
+    so that no gap is longer than `step` seconds.
+
+    Inputs
+    ------
+    t (numpy array): time elapsed in seconds, monotonically increasing
+    x (numpy array): x coordinate of each point (e.g., UTM easting in meters)
+    y (numpy array): y coordinate of each point (e.g., UTM northing in meters)
+    z (numpy array): z coordinate of each point (e.g., altitude in meters MSL)
+    heading (numpy array): compass heading of each point in degrees
+    speed (numpy array): speed of each point (e.g., knots)
+    step (float): the target time step of the output in seconds [default 1.0]
+    extra (dict): [optional] any additional {name: array} columns to interpolate linearly
+
+    Returns
+    -------
+    dense (pandas DataFrame): a columnar table with columns "time_elapsed", "x", "y", "z",
+                              "heading", "speed" and any `extra` columns
+
+    """
+
+    t = np.asarray(t, dtype="float")
+
+    if(t.size < 2):
+        raise ValueError("At least two points are required to densify a trajectory.")
+
+    if(np.any(np.diff(t) < 0)):
+        raise ValueError("Times must be monotonically increasing.")
+
+    # a regular grid of times, merged with the original fixes (`union1d` also sorts and de-duplicates)
+    t_new = np.union1d(t, np.arange(t[0], t[-1], step))
+
+    dense = {"time_elapsed": t_new}
+
+    # linear interpolation for every non-periodic column
+    for name, values in [("x", x), ("y", y), ("z", z)]:
+        dense[name] = np.interp(t_new, t, np.asarray(values, dtype="float"))
+
+    dense["heading"] = interpolate_headings(t, heading, t_new)
+    dense["speed"] = np.interp(t_new, t, np.asarray(speed, dtype="float"))
+
+    if(extra is not None):
+        for name, values in extra.items():
+            dense[name] = np.interp(t_new, t, np.asarray(values, dtype="float"))
+
+    return pd.DataFrame(dense)
+
+
+def closest_approaches(flight_id, t, x, y, site_x, site_y, z=None, site_z=None, radius_m=None):
+
+    """
+    Summarize the geometry of every flight relative to one site, all flights at once.
+
+    Points are sorted by flight (then time) a single time, and each summary
+    is a grouped reduction (`np.minimum.reduceat`, `np.add.reduceat`) over
+    the flights' contiguous runs of points; there is no loop over flights.
+
+    Inputs
+    ------
+    flight_id (numpy array): the flight each point belongs to
+    t (numpy array): the time of each point (seconds, or `numpy` datetime64)
+    x (numpy array): x coordinate of each point (e.g., UTM easting in meters)
+    y (numpy array): y coordinate of each point (e.g., UTM northing in meters)
+    site_x (float): x coordinate of the site
+    site_y (float): y coordinate of the site
+    z (numpy array): [optional] altitude of each point (meters MSL), for slant ranges
+    site_z (float): [optional] elevation of the site (meters MSL), for slant ranges
+    radius_m (float): [optional] a horizontal radius about the site, for time-in-radius
+
+    Returns
+    -------
+    approaches (pandas DataFrame): indexed by flight id, with columns
+        "n_points",
+        "closest_distance" (horizontal, km),
+        "closest_time" (the time of the closest point),
+        "closest_index" (the closest point's position in the input arrays),
+        "closest_slant_km" (minimum 3D range; NaN without `z` and `site_z`),
+        "time_in_radius_s" (seconds spent within `radius_m`; NaN without it)
+
+    """
+
+    flight_id = np.asarray(flight_id)
+    t = np.asarray(t)
+
+    if(flight_id.size == 0):
+        return pd.DataFrame([], columns=["n_points", "closest_distance", "closest_time", "closest_index",
+                                         "closest_slant_km", "time_in_radius_s"])
+
+    # sort once: by flight, then by time within each flight
+    order = np.lexsort((t, flight_id))
+    ids = flight_id[order]
+
+    # each flight is now a contiguous run of points beginning at `starts`
+    starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+    counts = np.diff(np.r_[starts, ids.size])
+    group = np.repeat(np.arange(starts.size), counts)
+
+    horizontal = np.hypot(np.asarray(x, dtype="float")[order] - site_x,
+                          np.asarray(y, dtype="float")[order] - site_y)
+
+    closest = np.minimum.reduceat(horizontal, starts)
+
+    # the first point of each flight attaining its minimum: sorting by (flight, distance)
+    # leaves every flight's runs in place, so each run's first element is its closest point
+    nearest = np.lexsort((horizontal, group))[starts]
+
+    approaches = {"n_points": counts,
+                  "closest_distance": closest/1000,
+                  "closest_time": t[order][nearest],
+                  "closest_index": order[nearest]}
+
+    if((z is not None) and (site_z is not None)):
+        slant = np.hypot(horizontal, np.asarray(z, dtype="float")[order] - site_z)
+        approaches["closest_slant_km"] = np.minimum.reduceat(slant, starts)/1000
+    else:
+        approaches["closest_slant_km"] = np.full(starts.size, np.nan)
+
+    if(radius_m is not None):
+
+        if(np.issubdtype(t.dtype, np.datetime64)):
+            seconds = (t[order] - t.min())/np.timedelta64(1, "s")
+        else:
+            seconds = t[order].astype("float")
+
+        # the time from each point to the next one in the same flight (zero for a flight's last point)
+        step = np.r_[np.diff(seconds), 0.0]
+        step[starts[1:] - 1] = 0.0
+
+        approaches["time_in_radius_s"] = np.add.reduceat(step*(horizontal <= radius_m), starts)
+
+    else:
+        approaches["time_in_radius_s"] = np.full(starts.size, np.nan)
+
+    return pd.DataFrame(approaches, index=pd.Index(ids[starts], name="flight_id"))
+
+
+def trim_window(t, x, y, z, sites_x, sites_y, cutoff_m, sites_z=None, pad_s=60.0, align_s=1.0):
+
+    """
+    The part of a trajectory worth simulating: from the first to the last point within
+    a propagation cutoff of any receiver, widened by some padding.
+
+    Beyond the cutoff an aircraft contributes nothing audible at the receivers, but
+    NMSIM still computes every point of a trajectory, so trimming a long flight
+    to its pass by the receivers saves solver time in proportion.
+
+    Inputs
+    ------
+    t (numpy array): time elapsed in seconds, monotonically increasing
+    x (numpy array): x coordinate of each point (e.g., UTM easting in meters)
+    y (numpy array): y coordinate of each point (e.g., UTM northing in meters)
+    z (numpy array): altitude of each point (meters MSL)
+    sites_x (array): x coordinate of each receiver
+    sites_y (array): y coordinate of each receiver
+    cutoff_m (float): the propagation cutoff, a slant range in meters
+    sites_z (array): [optional] elevation of each receiver (meters MSL); without it ranges are horizontal
+                     (never longer than the slant range, so nothing within the cutoff is lost)
+    pad_s (float): seconds kept before the first and after the last point within the cutoff [default 60.0]
+    align_s (float): the start is moved back to a whole multiple of this many seconds, so the trimmed
+                     trajectory's start time stays exact to the second [default 1.0]
+
+    Returns
+    -------
+    window (tuple): (start, end) in the units of `t`, or None if the trajectory never comes within the cutoff
+
+    """
+
+    t = np.asarray(t, dtype="float")
+    x = np.asarray(x, dtype="float")
+    y = np.asarray(y, dtype="float")
+
+    sites_x = np.atleast_1d(np.asarray(sites_x, dtype="float"))
+    sites_y = np.atleast_1d(np.asarray(sites_y, dtype="float"))
+    sites_z = None if sites_z is None else np.broadcast_to(np.asarray(sites_z, dtype="float"), sites_x.shape)
+
+    # the range from every point to its nearest receiver, one receiver at a time
+    nearest = np.full(t.size, np.inf)
+    for i in range(sites_x.size):
+
+        if(sites_z is None):
+            distance = np.hypot(x - sites_x[i], y - sites_y[i])
+        else:
+            distance = np.sqrt((x - sites_x[i])**2 + (y - sites_y[i])**2 + (np.asarray(z, dtype="float") - sites_z[i])**2)
+
+        np.minimum(nearest, distance, out=nearest)
+
+    within = np.flatnonzero(nearest <= cutoff_m)
+
+    if(within.size == 0):
+        return None
+
+    start = max(t[0], np.floor((t[within[0]] - pad_s)/align_s)*align_s)
+    end = min(t[-1], t[within[-1]] + pad_s)
+
+    return start, end
+
+
+def write_trajectory(trj_path, time_elapsed, x, y, z, heading, climb_angle, speed, zone, title,
+                     power=95.0, roll=0.0, temperature=59.0, humidity=70.0):
+
+    """
+    Write an NMSIM trajectory file (.trj) from columns, all at once.
+
+    The body is formatted into a single fixed-width buffer (nine 15-character
+    columns per row) and written at once. The file is written under a
+    temporary name and then renamed, so a reader (or a crash) can never
+    see a half-written trajectory.
+
+    Inputs
+    ------
+    trj_path (str, path): where the trajectory will be written
+    time_elapsed (numpy array): time in seconds from the reference time
+    x (numpy array): x coordinate (UTM)
+    y (numpy array): y coordinate (UTM)
+    z (numpy array): z coordinate in meters MSL
+    heading (numpy array): aircraft compass bearing in degrees
+    climb_angle (numpy array): aircraft climb angle in degrees
+    speed (numpy array): aircraft velocity in knots
+    zone (int): the UTM zone of the coordinates
+    title (str): follows "FLIGHT" in the header, e.g. "N74PS beginning 2019-06-10 17:33:26 UTC"
+    power (float or numpy array): % engine power [default 95.0]
+    roll (float or numpy array): bank angle (right wing down), degrees [default 0.0]
+    temperature (float): degrees F [default 59.0]
+    humidity (float): relative humidity (%) [default 70.0]
+
+    Returns
+    -------
+    None
+
+    """
+
+    n = len(time_elapsed)
+
+    data = np.empty((n, len(trj_columns)), dtype="float")
+    for i, values in enumerate([time_elapsed, x, y, z, heading, climb_angle, speed, power, roll]):
+        data[:, i] = values
+
+    # the header information [exactly as NMSIM expects!]
+    header = ["Flight track trajectory variable description:",
+              " time - time in seconds from the reference time",
+              " Xpos - x coordinate (UTM)",
+              " Ypos - y coordinate (UTM)",
+              " UTM Zone  " + str(zone),
+              " Zpos - z coordinate in meters MSL",
+              " heading - aircraft compass bearing in degrees",
+              " climbANG - aircraft climb angle in degrees",
+              " vel - aircraft velocity in knots",
+              " power - % engine power",
+              " roll - bank angle (right wing down), degrees",
+              "FLIGHT " + title,
+              "TEMP.  {0:.1f}".format(temperature),
+              "Humid.  {0:.1f}".format(humidity),
+              "",
+              "         time(s)        Xpos           Ypos           Zpos         heading        climbANG       Vel            power          rol"]
+
+    # the whole data section is formatted into one buffer from plain Python floats
+    # (one %-format per row; far cheaper than nine `str.format` calls on a pandas row)
+    row = "%15.3f"*len(trj_columns) + "\n"
+    body = "".join([row % tuple(r) for r in data.tolist()])
+
+    tmp_path = trj_path + ".{0}.tmp".format(os.getpid())
+    with open(tmp_path, 'w') as trajectory:
+        trajectory.write("\n".join(header) + "\n")
+        trajectory.write(body)
+
+    os.replace(tmp_path, trj_path)
+
+
+def read_trajectory(trj_path):
+
+    """
+    Read an NMSIM trajectory file (.trj) written by `write_trajectory` (or by NMSIM itself).
+
+    Inputs
+    ------
+    trj_path (str, path): a trajectory file
+
+    Returns
+    -------
+    header (dict): "zone" (int, or None), "title" (the text after "FLIGHT"),
+                   "temperature" and "humidity" (float, or None), and "lines" (the raw header)
+    trajectory (pandas DataFrame): one row per point, with the columns `trj_columns`
+
+    """
+
+    with open(trj_path) as f:
+
+        lines = []
+        for line in f:
+
+            lines.append(line.rstrip("\n"))
+
+            if(line.strip().startswith("time(s)")):
+                break
+
+        else:
+            raise ValueError("No 'time(s)' line was found; is this a trajectory file?")
+
+        data = np.loadtxt(f, dtype="float", ndmin=2)
+
+    header = {"zone": None, "title": None, "temperature": None, "humidity": None, "lines": lines}
+    for line in lines:
+
+        s = line.strip()
+
+        if(s.startswith("UTM Zone")):
+            header["zone"] = int(s.split()[-1])
+        elif(s.startswith("FLIGHT")):
+            header["title"] = s[len("FLIGHT"):].strip()
+        elif(s.startswith("TEMP.")):
+            header["temperature"] = float(s.split()[-1])
+        elif(s.startswith("Humid.")):
+            header["humidity"] = float(s.split()[-1])
+
+    return header, pd.DataFrame(data[:, :len(trj_columns)], columns=trj_columns[:data.shape[1]])
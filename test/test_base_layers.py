@@ -0,0 +1,104 @@
+#-----------------------------------------------------------------------------#
+# test_base_layers.py
+#
+# NPS Natural Sounds Program
+#
+# The tile cache behind the elevation base layer: a study area is covered
+# by tiles of a fixed, aligned grid, each cached under a key of everything
+# that determines its cells, and a regional DEM is hashed only once.
+# (Building a layer needs GDAL, so only the parts that do not are tested.)
+#
+# Usage:
+#	python -m pytest -q test
+#
+# History:
+#	D. Halyn Betchkal -- Created
+#
+#-----------------------------------------------------------------------------#
+
+# ================ Import Libraries =======================
+
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import NMSIM_Manifest
+from NMSIM_Base_Layers import (tile_grid, tile_key, source_fingerprint, DEM_selector, study_area_bounds,
+                               make_NMSIM_project_dir, project_subfolders)
+
+
+# ===========================  Define functions  =======================================
+
+def test_tile_grid():
+
+    # 100 cells of 10 m: tiles 1 km on a side, aligned to whole kilometers
+    tiles = tile_grid((1500.0, 2200.0, 3000.0, 2900.0), 10.0, 100)
+
+    assert [(i, j) for i, j, bounds in tiles] == [(1, 2), (2, 2)]
+    assert tiles[0][2] == (1000.0, 2000.0, 2000.0, 3000.0)
+
+    # every tile is on the same grid, whatever the study area
+    for i, j, (xmin, ymin, xmax, ymax) in tile_grid((-1234.5, 678.9, 4321.0, 5432.1), 10.0, 100):
+        assert (xmin, ymin, xmax - xmin, ymax - ymin) == (1000.0*i, 1000.0*j, 1000.0, 1000.0)
+
+    # a box ending on a tile edge needs no tile beyond it
+    assert len(tile_grid((0.0, 0.0, 1000.0, 1000.0), 10.0, 100)) == 1
+    assert len(tile_grid((0.0, 0.0, 1000.1, 1000.0), 10.0, 100)) == 2
+
+
+def test_tile_key():
+
+    key = tile_key("abc", "EPSG:4269", 0.001, 256, "near", 3, 4)
+
+    assert key == tile_key("abc", "EPSG:4269", 0.001, 256, "near", 3, 4)
+
+    # anything that changes a tile's cells changes its key
+    others = [tile_key("abd", "EPSG:4269", 0.001, 256, "near", 3, 4),
+              tile_key("abc", "EPSG:26906", 0.001, 256, "near", 3, 4),
+              tile_key("abc", "EPSG:4269", 0.002, 256, "near", 3, 4),
+              tile_key("abc", "EPSG:4269", 0.001, 512, "near", 3, 4),
+              tile_key("abc", "EPSG:4269", 0.001, 256, "bilinear", 3, 4),
+              tile_key("abc", "EPSG:4269", 0.001, 256, "near", 4, 3)]
+
+    assert len(set(others + [key])) == 7
+
+
+def test_source_fingerprint(tmp_path, monkeypatch):
+
+    dem = str(tmp_path / "AKR_DEM.TIF")
+    with open(dem, "wb") as f:
+        f.write(b"\x00"*1000)
+
+    hashed = []
+    file_hash = NMSIM_Manifest.file_hash
+    monkeypatch.setattr(NMSIM_Manifest, "file_hash", lambda path: hashed.append(path) or file_hash(path))
+
+    cache_dir = str(tmp_path / "cache")
+    os.makedirs(cache_dir)
+
+    # the DEM is hashed once, then remembered in the cache
+    assert source_fingerprint(dem, cache_dir) == source_fingerprint(dem, cache_dir)
+    assert len(hashed) == 1
+    assert os.path.exists(os.path.join(cache_dir, "sources.json"))
+
+    with pytest.raises(FileNotFoundError, match="regional DEM"):
+        source_fingerprint(str(tmp_path / "missing.TIF"), cache_dir)
+
+
+def test_project_layout(tmp_path):
+
+    assert DEM_selector("DENA", "rasters") == os.path.join("rasters", "AKR_DEM.TIF")
+
+    with pytest.raises(KeyError, match="XXXX"):
+        DEM_selector("XXXX", "rasters")
+
+    # bounds given directly need no vector file (or GDAL)
+    assert study_area_bounds((-150, 63, -149.5, 63.5)) == ((-150.0, 63.0, -149.5, 63.5), None)
+
+    project_dir = str(tmp_path / "DENATEST")
+    make_NMSIM_project_dir(project_dir)
+    make_NMSIM_project_dir(project_dir)
+
+    assert all(os.path.isdir(os.path.join(project_dir, folder)) for folder in project_subfolders)
@@ -0,0 +1,136 @@
+#-----------------------------------------------------------------------------#
+# test_cache.py
+#
+# NPS Natural Sounds Program
+#
+# The on-disk cache of parsed NMSIM outputs: a second read is a hit, a
+# re-run (a new modification time) is a miss, the least recently used
+# entries are evicted first, and an entry still being written is never
+# evicted from under its writer.
+#
+# Usage:
+#	python -m pytest -q test
+#
+# History:
+#	D. Halyn Betchkal -- Created
+#
+#-----------------------------------------------------------------------------#
+
+# ================ Import Libraries =======================
+
+import os
+import sys
+import json
+import types
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import NMSIM_Cache
+from NMSIM_Cache import cached, cached_tis, evict
+from NMSIM_Results import read_tis
+from test_tis_sites import write_multisite_tis
+
+
+# ===========================  Define functions  =======================================
+
+def array_entry(source_path, cache_dir, n=1000, **kwargs):
+
+    '''
+    Cache an array of `n` float64 values for `source_path`; returns (metadata, array, number of parses).
+    '''
+
+    parses = []
+
+    def parse(npy_path):
+        parses.append(npy_path)
+        np.save(npy_path, np.arange(n, dtype="float64"))
+        return {"n": n}
+
+    meta, levels = cached(source_path, "test", parse, cache_dir=cache_dir, **kwargs)
+
+    return meta, levels, len(parses)
+
+
+def test_hit_and_invalidation(tmp_path, monkeypatch):
+
+    tis_path = str(tmp_path / "N123.tis")
+    write_multisite_tis(tis_path, ["DENATRLA"])
+    header, levels = read_tis(tis_path)
+
+    parses = []
+    monkeypatch.setattr(NMSIM_Cache, "read_tis", lambda *args, **kwargs: parses.append(args) or read_tis(*args, **kwargs))
+
+    for n in range(2):
+        cached_header, cached_levels = cached_tis(tis_path)
+        assert np.array_equal(cached_levels, levels)
+        assert cached_header["site"] == header["site"]
+
+    # parsed once, then read from the cache
+    assert len(parses) == 1
+
+    # NMSIM runs again: a new modification time is a new entry
+    write_multisite_tis(tis_path, ["DENAWEFO"])
+    os.utime(tis_path, ns=(os.stat(tis_path).st_atime_ns, os.stat(tis_path).st_mtime_ns + 10**9))
+
+    cached_header, cached_levels = cached_tis(tis_path)
+    assert len(parses) == 2
+    assert cached_header["site"] == "DENAWEFO"
+
+
+def test_least_recently_used_evicted(tmp_path):
+
+    cache_dir = str(tmp_path / "cache")
+    sources = []
+    for name in ["a", "b", "c"]:
+        sources.append(str(tmp_path / name))
+        with open(sources[-1], "w") as f:
+            f.write(name)
+
+    for source in sources:
+        array_entry(source, cache_dir)
+
+    entry_bytes = sum(os.path.getsize(os.path.join(cache_dir, f)) for f in os.listdir(cache_dir))/3
+
+    # "a" was used most recently, "b" least
+    now = os.stat(cache_dir).st_mtime
+    for source, age in zip(sources, [0, 200, 100]):
+        key = NMSIM_Cache.cache_key(source, "test")
+        for ext in [".json", ".npy"]:
+            os.utime(os.path.join(cache_dir, key + ext), (now - age, now - age))
+
+    evicted = evict(cache_dir, max_bytes=2.5*entry_bytes)
+    assert evicted == [NMSIM_Cache.cache_key(sources[1], "test")]
+
+    # the others are still hits
+    assert array_entry(sources[0], cache_dir)[2] == 0
+    assert array_entry(sources[2], cache_dir)[2] == 0
+    assert array_entry(sources[1], cache_dir)[2] == 1
+
+
+def test_evict_while_writing(tmp_path, monkeypatch):
+
+    cache_dir = str(tmp_path / "cache")
+    old, new = str(tmp_path / "old"), str(tmp_path / "new")
+    for source in [old, new]:
+        with open(source, "w") as f:
+            f.write(source)
+
+    array_entry(old, cache_dir)
+
+    # another thread evicts everything it can just as this entry's files are written
+    def dump(meta, f):
+        json.dump(meta, f)
+        f.flush()
+        evict(cache_dir, max_bytes=0)
+
+    monkeypatch.setattr(NMSIM_Cache, "json", types.SimpleNamespace(dump=dump, dumps=json.dumps, load=json.load))
+
+    meta, levels, parses = array_entry(new, cache_dir)
+
+    assert (meta, parses) == ({"n": 1000}, 1)
+    assert np.array_equal(levels, np.arange(1000))
+
+    # only the finished entry was evicted, and nothing temporary is left behind
+    key = NMSIM_Cache.cache_key(new, "test")
+    assert sorted(os.listdir(cache_dir)) == [key + ".json", key + ".npy"]
@@ -0,0 +1,130 @@
+#-----------------------------------------------------------------------------#
+# test_compare.py
+#
+# NPS Natural Sounds Program
+#
+# Comparing a modelled event with its measurement: the lag is positive when
+# the measurement is later, and level statistics are taken only over the
+# seconds the model predicts sound and the measurement exists.
+#
+# Usage:
+#	python -m pytest -q test
+#
+# History:
+#	D. Halyn Betchkal -- Created
+#
+#-----------------------------------------------------------------------------#
+
+# ================ Import Libraries =======================
+
+import os
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from NMSIM_Results import bands
+from NMSIM_Metrics import silent
+from NMSIM_Compare import best_lags, shift, level_statistics, compare_event, comparison_columns
+
+
+# ===========================  Define functions  =======================================
+
+def pass_by(n, peak, level=60.0, width=15.0):
+
+    '''
+    `n` seconds of an aircraft passing by, loudest at second `peak`, over a quiet background.
+    '''
+
+    t = np.arange(n)
+
+    return np.maximum(level - 20*np.log10(1 + ((t - peak)/width)**2), 20.0)
+
+
+def test_best_lags_sign():
+
+    model = np.column_stack([pass_by(300, 100), pass_by(300, 100), pass_by(300, 100)])
+    measured = np.column_stack([pass_by(300, 112), pass_by(300, 90), pass_by(300, 100)])
+
+    # the measurement is 12 s later, 10 s earlier, and on time
+    lags = best_lags(model, measured, max_lag=60)
+    assert lags.tolist() == [12, -10, 0]
+
+    # and shifting the model by its lag lines the peaks up
+    for column, lag in enumerate(lags):
+        assert np.nanargmax(shift(model, lag)[:, column]) == np.argmax(measured[:, column])
+
+    # a lag beyond the largest considered is not found
+    assert abs(best_lags(model[:, :1], measured[:, :1], max_lag=5)[0]) <= 5
+
+
+def test_best_lags_nothing_to_correlate():
+
+    model = np.column_stack([pass_by(120, 60), np.full(120, np.nan)])
+    measured = np.column_stack([np.full(120, 40.0), pass_by(120, 70)])
+
+    # a flat measurement, or a model with no energy, gives no lag
+    assert best_lags(model, measured, max_lag=30).tolist() == [0, 0]
+
+
+def test_level_statistics():
+
+    n = 20
+    model = np.full((n, 3), silent)
+    measured = np.full((n, 3), 30.0)
+
+    # column 0: the model predicts 50 dB for 10 s, 3 dB above the measurement
+    model[5:15, 0] = 50.0
+    measured[5:15, 0] = 47.0
+
+    # column 1: 6 s predicted, one of which was not measured; errors of +2 and -2 dB
+    model[0:6, 1] = 40.0
+    measured[0:6, 1] = [38.0, 42.0, 38.0, 42.0, 38.0, np.nan]
+
+    # column 2: the model predicts nothing at all
+
+    statistics = level_statistics(model, measured)
+
+    assert statistics["n_seconds"].tolist() == [10, 5, 0]
+
+    assert statistics["model_SEL"][0] == pytest.approx(60.0)
+    assert statistics["measured_SEL"][0] == pytest.approx(57.0)
+    assert statistics["SEL_error"][0] == pytest.approx(3.0)
+    assert statistics["Lmax_error"][0] == pytest.approx(3.0)
+    assert (statistics["mean_difference"][0], statistics["rms_difference"][0]) == pytest.approx((3.0, 3.0))
+
+    assert statistics["measured_Lmax"][1] == 42.0
+    assert statistics["mean_difference"][1] == pytest.approx(0.4)
+    assert statistics["rms_difference"][1] == pytest.approx(2.0)
+
+    # nothing to compare
+    for key in ["model_SEL", "measured_SEL", "SEL_error", "model_Lmax", "Lmax_error", "mean_difference", "rms_difference"]:
+        assert np.isnan(statistics[key][2]), key
+
+
+def test_compare_event():
+
+    index = pd.date_range("2019-06-10 10:00:00", periods=600, freq="1s")
+
+    # the model is 3 dB loud in every band, and 8 s early
+    measured = pd.DataFrame({b: pass_by(600, 300) - 0.5*i for i, b in enumerate(bands)}, index=index)
+    model = pd.DataFrame({b: pass_by(600, 292) + 3 - 0.5*i for i, b in enumerate(bands)}, index=index)
+
+    comparison = compare_event({"event": "N123", "model": model, "measured": measured}, max_lag_s=60)
+
+    assert list(comparison.columns) == comparison_columns
+    assert comparison["band"].tolist() == bands + ["A"]
+    assert (comparison["event"] == "N123").all()
+
+    a = comparison.set_index("band").loc["A"]
+    assert a["lag_s"] == 8
+
+    # once aligned, what is left is the level error
+    assert comparison["SEL_error"].values == pytest.approx(3.0, abs=1e-6)
+    assert comparison["mean_difference"].values == pytest.approx(3.0, abs=1e-6)
+
+    # unaligned, the timing error shows in the levels too
+    unaligned = compare_event({"event": "N123", "model": model, "measured": measured}, max_lag_s=60, align=False)
+    assert (unaligned["rms_difference"] > 3.0).all()
@@ -0,0 +1,91 @@
+#-----------------------------------------------------------------------------#
+# test_coverage.py
+#
+# NPS Natural Sounds Program
+#
+# How much of each flight the acoustic record covers: hourly files merge
+# into intervals, and a flight that runs into a gap in the record is only
+# partly covered.
+#
+# Usage:
+#	python -m pytest -q test
+#
+# History:
+#	D. Halyn Betchkal -- Created
+#
+#-----------------------------------------------------------------------------#
+
+# ================ Import Libraries =======================
+
+import os
+import sys
+import datetime as dt
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from NMSIM_NVSPL import coverage_index, covered_seconds, coverage_fraction
+
+
+# ===========================  Define functions  =======================================
+
+def hours(*hs):
+
+    '''
+    The start times of hourly files on 10 June 2019.
+    '''
+
+    return pd.Series([dt.datetime(2019, 6, 10, h) for h in hs])
+
+
+def at(h, m=0):
+
+    '''
+    A time on 10 June 2019.
+    '''
+
+    return pd.Timestamp(2019, 6, 10, h, m)
+
+
+def test_coverage_index():
+
+    # files from 08:00 to 11:00 (one listed twice), then a gap, then 14:00 to 16:00
+    index = coverage_index(hours(10, 8, 9, 9, 15, 14))
+
+    assert list(pd.to_datetime(index["lo"])) == [at(8), at(14)]
+    assert list(pd.to_datetime(index["hi"])) == [at(11), at(16)]
+    assert list(index["before"]) == [0, pd.Timedelta(hours=3).value]
+
+    empty = coverage_index(hours())
+    assert empty["lo"].size == 0
+    assert coverage_fraction(empty, [at(8)], [at(9)]).tolist() == [0.0]
+
+
+def test_flights_straddling_a_gap():
+
+    index = coverage_index(hours(8, 9, 10, 14, 15))
+
+    start = [at(9, 30),    # inside the record
+             at(10, 30),   # half before the gap at 11:00, half in it
+             at(13, 30),   # starts in the gap, ends in the record
+             at(10, 30),   # spans the whole gap
+             at(12),       # entirely in the gap
+             at(16, 30)]   # after the last file
+    end = [at(10, 30), at(11, 30), at(14, 30), at(14, 30), at(13), at(17)]
+
+    assert covered_seconds(index, start, end).tolist() == [3600.0, 1800.0, 1800.0, 3600.0, 0.0, 0.0]
+    assert coverage_fraction(index, start, end) == pytest.approx([1.0, 0.5, 0.5, 0.25, 0.0, 0.0])
+
+    # a flight of a single instant is either covered or not (the end of a file is not)
+    assert coverage_fraction(index, [at(9, 30), at(11), at(12)], [at(9, 30), at(11), at(12)]).tolist() == [1.0, 0.0, 0.0]
+
+
+def test_time_zones_are_dropped():
+
+    index = coverage_index(hours(8))
+
+    local = pd.Series([at(8, 15), at(8, 45)]).dt.tz_localize("US/Alaska")
+
+    assert coverage_fraction(index, local[:1], local[1:]).tolist() == [1.0]
@@ -0,0 +1,142 @@
+#-----------------------------------------------------------------------------#
+# test_elevation.py
+#
+# NPS Natural Sounds Program
+#
+# Sampling a GridFloat elevation file (.flt/.hdr) without GDAL: a tilted
+# plane is interpolated exactly between cell centers, and nothing is
+# returned off the raster or beside a NODATA cell.
+#
+# Usage:
+#	python -m pytest -q test
+#
+# History:
+#	D. Halyn Betchkal -- Created
+#
+#-----------------------------------------------------------------------------#
+
+# ================ Import Libraries =======================
+
+import os
+import sys
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from NMSIM_Elevation import read_hdr, open_elevation, extent, sample_elevation, terrain_profile, altitude_AGL
+
+
+# the lower-left corner and cell size of every test raster
+xll, yll, cellsize = 400000.0, 7000000.0, 30.0
+
+
+# ===========================  Define functions  =======================================
+
+def plane(x, y):
+
+    '''
+    The terrain of the test raster: rising to the east, falling to the north.
+    '''
+
+    return 500.0 + 0.1*(x - xll) - 0.05*(y - yll)
+
+
+def write_plane(flt_path, shape=(40, 60), byteorder="LSBFIRST", center=False):
+
+    '''
+    Write `plane` as a GridFloat file sampled at its cell centers (north row first).
+    '''
+
+    nrows, ncols = shape
+    x = xll + cellsize*(np.arange(ncols) + 0.5)
+    y = yll + cellsize*(nrows - np.arange(nrows) - 0.5)
+
+    z = plane(x[np.newaxis, :], y[:, np.newaxis])
+    z.astype("<f4" if byteorder == "LSBFIRST" else ">f4").tofile(flt_path)
+
+    with open(flt_path[:-4] + ".hdr", "w") as hdr:
+        hdr.write("ncols {0:d}\nnrows {1:d}\n".format(ncols, nrows))
+        if(center):
+            hdr.write("xllcenter {0!r}\nyllcenter {1!r}\n".format(xll + cellsize/2, yll + cellsize/2))
+        else:
+            hdr.write("xllcorner {0!r}\nyllcorner {1!r}\n".format(xll, yll))
+        hdr.write("cellsize {0!r}\nNODATA_value -9999\nbyteorder {1}\n".format(cellsize, byteorder))
+
+    return flt_path
+
+
+def test_read_hdr(tmp_path):
+
+    corner = read_hdr(write_plane(str(tmp_path / "corner.flt"))[:-4] + ".hdr")
+    center = read_hdr(write_plane(str(tmp_path / "center.flt"), center=True)[:-4] + ".hdr")
+
+    assert (corner["ncols"], corner["nrows"], corner["nodata"]) == (60, 40, -9999.0)
+
+    # a header giving cell centers describes the same raster
+    assert (center["xllcorner"], center["yllcorner"]) == (corner["xllcorner"], corner["yllcorner"]) == (xll, yll)
+
+
+@pytest.mark.parametrize("byteorder", ["LSBFIRST", "MSBFIRST"])
+def test_sample_elevation(tmp_path, byteorder):
+
+    elevation = open_elevation(write_plane(str(tmp_path / "elevation.flt"), byteorder=byteorder))
+
+    xmin, xmax, ymin, ymax = extent(elevation)
+    assert (xmin, xmax, ymin, ymax) == (xll, xll + 60*cellsize, yll, yll + 40*cellsize)
+
+    # between cell centers a plane is interpolated exactly, in any chunking
+    rng = np.random.default_rng(0)
+    x = rng.uniform(xmin + cellsize/2, xmax - cellsize/2, 1000)
+    y = rng.uniform(ymin + cellsize/2, ymax - cellsize/2, 1000)
+
+    z = sample_elevation(elevation, x, y)
+    assert z == pytest.approx(plane(x, y), abs=1e-3)
+    assert np.array_equal(sample_elevation(elevation, x, y, chunk_points=37), z)
+
+    # arrays of any shape keep it
+    assert sample_elevation(elevation, x.reshape(20, 50), y.reshape(20, 50)).shape == (20, 50)
+
+    # the outer half cell is held at the edge value; beyond the raster there is no elevation
+    edge = sample_elevation(elevation, [xmin + 1.0, xmax + 1.0, xmin + 100.0], [ymin + 100.0, ymin + 100.0, ymax + 0.5])
+    assert edge[0] == pytest.approx(plane(xmin + cellsize/2, ymin + 100.0), abs=1e-3)
+    assert np.isnan(edge[1:]).all()
+
+
+def test_sample_elevation_nodata(tmp_path):
+
+    flt_path = write_plane(str(tmp_path / "elevation.flt"))
+
+    # one cell of NODATA, 10 rows down and 20 columns in
+    data = np.fromfile(flt_path, dtype="<f4").reshape(40, 60)
+    data[10, 20] = -9999
+    data.tofile(flt_path)
+
+    elevation = open_elevation(flt_path)
+
+    cell_x = xll + cellsize*20.5
+    cell_y = yll + cellsize*(40 - 10.5)
+
+    z = sample_elevation(elevation, [cell_x + 10.0, cell_x - 10.0, cell_x + 40.0], [cell_y, cell_y - 10.0, cell_y])
+
+    # every point interpolated from that cell has no elevation; a cell further on is unaffected
+    assert np.isnan(z[:2]).all()
+    assert z[2] == pytest.approx(plane(cell_x + 40.0, cell_y), abs=1e-3)
+
+
+def test_terrain_profile_and_AGL(tmp_path):
+
+    elevation = open_elevation(write_plane(str(tmp_path / "elevation.flt")))
+
+    start = (xll + 100.0, yll + 100.0)
+    end = (xll + 400.0, yll + 500.0)
+
+    profile = terrain_profile(elevation, start, end)
+
+    # a 500 m line sampled every cell
+    assert len(profile) == int(np.ceil(500/cellsize)) + 1
+    assert profile["distance"].iloc[-1] == pytest.approx(500.0)
+    assert profile["elevation"].values == pytest.approx(plane(profile["x"].values, profile["y"].values), abs=1e-3)
+
+    AGL = altitude_AGL(elevation, profile["x"], profile["y"], np.full(len(profile), 1000.0))
+    assert AGL == pytest.approx(1000.0 - profile["elevation"].values, abs=1e-6)
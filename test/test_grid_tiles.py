@@ -0,0 +1,122 @@
+#-----------------------------------------------------------------------------#
+# test_grid_tiles.py
+#
+# NPS Natural Sounds Program
+#
+# A grid analysis run as tiles with the stand-in solver: merged, the tiles
+# give the same result as the whole grid run at once, every point in its
+# global place, with nothing where no tile computed.
+#
+# Usage:
+#	python -m pytest -q test
+#
+# History:
+#	D. Halyn Betchkal -- Created
+#
+#-----------------------------------------------------------------------------#
+
+# ================ Import Libraries =======================
+
+import os
+import sys
+import glob
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from NMSIM_Grid import grid_points, grid_spec, simulate_grid, merge_grid_tiles
+from NMSIM_Elevation import open_elevation, extent
+from NMSIM_Trajectories import write_trajectory
+from test_elevation import write_plane, xll, yll
+
+
+test_dir = os.path.dirname(os.path.abspath(__file__))
+repo_dir = os.path.dirname(test_dir)
+
+standin = os.path.join(repo_dir, "NMSIM_Standin_Solver.py")
+
+# grid points across and up the full grid
+ii_max, jj_max = 5, 4
+
+
+# ===========================  Define functions  =======================================
+
+@pytest.fixture
+def project(tmp_path):
+
+    '''
+    An elevation file and a two-minute flight across it.
+    '''
+
+    elev_file = write_plane(str(tmp_path / "elevation.flt"))
+
+    t = np.arange(0, 120, 1.0)
+    trj_file = str(tmp_path / "N123.trj")
+    write_trajectory(trj_file, t, xll + 15*t, yll + 600.0, np.full(t.size, 900.0), 90.0, 0.0, 100.0,
+                     zone=6, title="N123")
+
+    source = sorted(glob.glob(os.path.join(repo_dir, "NMSIM", "Sources", "AirTourFixedWingSources", "*.src")))[0]
+
+    return str(tmp_path), elev_file, trj_file, source
+
+
+def test_tiles_match_whole_grid(project):
+
+    out_dir, elev_file, trj_file, source = project
+
+    runs, index, levels = simulate_grid(os.path.join(out_dir, "whole"), "TEST", elev_file, trj_file, source,
+                                        ii_max, jj_max, tile_ii=ii_max, tile_jj=jj_max, NMSIMpath=standin, processes=1)
+    assert len(runs) == 1
+
+    # 3 x 2 tiles, the last column and row of them partial
+    manifest = os.path.join(out_dir, "manifest.json")
+    tiled_runs, tiled_index, tiled_levels = simulate_grid(os.path.join(out_dir, "tiles"), "TEST", elev_file, trj_file, source,
+                                                          ii_max, jj_max, tile_ii=2, tile_jj=3, NMSIMpath=standin,
+                                                          processes=2, manifest=manifest)
+    assert len(tiled_runs) == 6
+    assert tiled_runs["ok"].all()
+
+    # every point in its global place...
+    points = grid_points(extent(open_elevation(elev_file)), grid_spec(ii_max, jj_max))
+    assert tiled_index["site"].tolist() == points["site"].tolist()
+    assert np.allclose(tiled_index[["x", "y"]].values, points[["x", "y"]].values, atol=1)
+    assert tiled_index["tile"].nunique() == 6
+
+    # ...with the same levels as the whole grid
+    assert tiled_levels.shape == levels.shape == (ii_max*jj_max, 120, 36)
+    assert np.isfinite(levels[:, :, 2]).all()
+    assert np.array_equal(tiled_levels, levels, equal_nan=True)
+    assert (tiled_index["n_rows"] == 120).all()
+
+    # tiles already computed from the same inputs are not run again
+    again = simulate_grid(os.path.join(out_dir, "tiles"), "TEST", elev_file, trj_file, source,
+                          ii_max, jj_max, tile_ii=2, tile_jj=3, NMSIMpath=standin, processes=2, manifest=manifest)[0]
+    assert again["skipped"].all()
+
+
+def test_merge_missing_and_overlapping_tiles(project):
+
+    out_dir, elev_file, trj_file, source = project
+
+    runs, index, levels = simulate_grid(out_dir, "TEST", elev_file, trj_file, source, ii_max, jj_max, tile_ii=2, tile_jj=3,
+                                        NMSIMpath=standin, processes=2)
+
+    tig_paths = sorted(glob.glob(os.path.join(out_dir, "TEST_tile_*.tig")))
+    assert len(tig_paths) == 6
+
+    # without the first tile (ii 1-2, jj 1-3) those points have nothing, written straight to a .npy
+    npy_path = os.path.join(out_dir, "merged.npy")
+    partial_index, partial_levels = merge_grid_tiles(tig_paths[1:], ii_max, jj_max, out=npy_path)
+
+    missing = (partial_index["ii"] <= 2) & (partial_index["jj"] <= 3)
+    assert missing.sum() == 6
+    assert (partial_index.loc[missing, "n_rows"] == 0).all()
+    assert partial_index.loc[missing, ["x", "y", "tile"]].isna().all().all()
+    assert np.isnan(partial_levels[missing.values]).all()
+
+    assert np.array_equal(np.load(npy_path)[~missing.values], levels[~missing.values], equal_nan=True)
+
+    # the same tile twice is refused
+    with pytest.raises(ValueError, match="more than one tile"):
+        merge_grid_tiles(tig_paths + tig_paths[:1], ii_max, jj_max)
@@ -0,0 +1,141 @@
+#-----------------------------------------------------------------------------#
+# test_metrics.py
+#
+# NPS Natural Sounds Program
+#
+# Grid metrics computed in one sweep agree with the formulas of the .tig
+# notebook they replace, site by site, however the sites are blocked and
+# whatever a site's number of time steps.
+#
+# Usage:
+#	python -m pytest -q test
+#
+# History:
+#	D. Halyn Betchkal -- Created
+#
+#-----------------------------------------------------------------------------#
+
+# ================ Import Libraries =======================
+
+import os
+import sys
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from NMSIM_Results import bands, tig_columns
+from NMSIM_Metrics import grid_metrics, LAx, LTx, TimeAbove, SEL, Leq
+
+
+# ===========================  Define functions  =======================================
+
+def synthetic_grid(n_sites=7, n_steps=120, seed=0):
+
+    '''
+    Levels for `n_sites` receivers laid out as `tig_columns`, with slightly uneven
+    time steps, a few bands NMSIM did not compute, and the last site shorter than the rest.
+    '''
+
+    rng = np.random.default_rng(seed)
+
+    levels = np.empty((n_sites, n_steps, len(tig_columns)), dtype="float32")
+    levels[:, :, 0] = np.cumsum(rng.uniform(0.9, 1.1, (n_sites, n_steps)), axis=1)
+    levels[:, :, 1] = rng.uniform(20, 60, (n_sites, n_steps))
+    levels[:, :, 2] = levels[:, :, 1] - rng.uniform(0, 10, (n_sites, n_steps))
+    levels[:, :, 3:35] = rng.uniform(-10, 40, (n_sites, n_steps, len(bands)))
+    levels[:, :, 35] = rng.uniform(0, 10, (n_sites, n_steps))
+
+    levels[:, ::7, 10:14] = np.nan
+
+    # padding past the last site's final time step
+    levels[-1, n_steps//2:] = np.nan
+
+    return levels
+
+
+def notebook_metrics(site):
+
+    '''
+    The .tig notebook's formulas for one site's (unpadded) rows.
+    '''
+
+    time_s = site[:, tig_columns.index("TIME")]
+    LAeq = site[:, tig_columns.index("A")].astype("float")
+    durations = np.diff(time_s)
+
+    pressures = np.power(10, site[:, tig_columns.index("12.5"):tig_columns.index("1250")+1].astype("float")/10)
+    with np.errstate(divide="ignore"):
+        truncated = np.nan_to_num(10*np.log10(np.nansum(pressures, axis=1)), neginf=-99.9)
+
+    return {"LA50": np.nanpercentile(LAeq, 50),
+            "LA90": np.nanpercentile(LAeq, 10),
+            "LT90": np.nanpercentile(truncated, 10),
+            "TA35": np.sum(durations[(LAeq >= 35)[:-1]]),
+            "TA35_percent": 100*np.sum(durations[(LAeq >= 35)[:-1]])/np.sum(durations),
+            "SEL": 10*np.log10(np.sum(durations*np.power(10, LAeq[:-1]/10)))}
+
+
+def test_grid_metrics_match_notebook():
+
+    levels = synthetic_grid()
+    aliases = ["LA50", "LA90", "LT90", "TA35", "TA35_percent", "SEL"]
+
+    values, meta = grid_metrics(levels, aliases)
+
+    assert list(values.columns) == aliases
+    assert values.index.tolist() == list(range(1, len(levels) + 1))
+    assert meta["LA50"]["full"] == "50th percentile $LA_{eq,*}$"
+
+    for i, site in enumerate(levels):
+
+        # (the last site's padding is dropped, as the notebook never saw it)
+        site = site[~np.isnan(site[:, 0])]
+
+        for alias, expected in notebook_metrics(site).items():
+            assert values.loc[i + 1, alias] == pytest.approx(expected, rel=1e-4, abs=1e-3), (i, alias)
+
+
+def test_grid_metrics_in_blocks():
+
+    levels = synthetic_grid()
+    aliases = ["LA50", "LT90", "TA35", "SEL", "LAeq", "LFeq"]
+
+    values, meta = grid_metrics(levels, aliases)
+
+    # a block at a time gives the same values...
+    assert grid_metrics(levels, aliases, chunk_sites=3)[0].equals(values)
+
+    # ...as does one metric at a time
+    assert np.array_equal(LAx(levels, 50)[0], values["LA50"])
+    assert np.array_equal(LTx(levels, 90)[0], values["LT90"])
+    assert np.array_equal(TimeAbove(levels, 35.0)[0], values["TA35"])
+    assert np.array_equal(SEL(levels)[0], values["SEL"])
+    assert np.array_equal(Leq(levels, "F")[0], values["LFeq"])
+
+    # an equivalent level is the exposure spread over the model's duration
+    duration = np.nansum(np.diff(levels[:, :, 0], axis=1), axis=1)
+    assert values["LAeq"].values == pytest.approx(values["SEL"].values - 10*np.log10(duration), abs=1e-3)
+
+
+def test_grid_metrics_fill():
+
+    levels = synthetic_grid()
+
+    # a site NMSIM computed nothing for
+    levels[2, :, 1:] = np.nan
+
+    filled = grid_metrics(levels, ["LA50", "TA35"])[0]
+    unfilled = grid_metrics(levels, ["LA50", "TA35"], fill=False)[0]
+
+    assert np.isnan(unfilled.loc[3, "LA50"])
+    assert filled.loc[3, "LA50"] == unfilled["LA50"].min()
+
+    # time above is a duration, and never filled
+    assert filled.loc[3, "TA35"] == 0
+
+
+def test_unknown_metric():
+
+    with pytest.raises(ValueError, match="LZ50"):
+        grid_metrics(synthetic_grid(), ["LA50", "LZ50"])
@@ -0,0 +1,131 @@
+#-----------------------------------------------------------------------------#
+# test_pipeline_years.py
+#
+# NPS Natural Sounds Program
+#
+# Two years of one site share a project directory. Each deployment must
+# simulate and compare only the flights of its own year, run with the
+# stand-in solver.
+#
+# Usage:
+#	python -m pytest -q test
+#
+# History:
+#	D. Halyn Betchkal -- Created
+#
+#-----------------------------------------------------------------------------#
+
+# ================ Import Libraries =======================
+
+import os
+import sys
+import types
+import ntpath
+import datetime as dt
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import NMSIM_DENA_Flight_Tracks as DENA
+import NMSIM_Pipeline as Pipeline
+from test_trajectory_trimming import write_elevation, geographic_prj
+
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# ===========================  Define functions  =======================================
+
+class Archive:
+
+    '''
+    An acoustic archive holding hourly NVSPL files on 10 June of every year.
+    '''
+
+    def nvspl(self, unit=None, site=None, year=None):
+        return [types.SimpleNamespace(year=str(year), month="06", day="10", hour="{0:02d}".format(h))
+                for h in range(24)]
+
+
+def flight(flight_id, start):
+
+    '''
+    A two-hour flight due east past the site, one point every ten seconds.
+    '''
+
+    seconds = np.arange(0, 7200, 10)
+
+    points = pd.DataFrame({"id": flight_id,
+                           "flight_id": flight_id,
+                           "registration": "N123",
+                           "ak_datetime": pd.to_datetime([start + dt.timedelta(seconds=int(s)) for s in seconds]),
+                           "longitude": -152.0 + 4.0*seconds/7200,
+                           "latitude": 63.55,
+                           "altitude_ft": 3000.0,
+                           "heading": 90.0,
+                           "knots": 100.0})
+    points["utc_datetime"] = points["ak_datetime"] + pd.Timedelta(hours=8)
+
+    return points
+
+
+def test_deployments_keep_to_their_year(tmp_path, monkeypatch):
+
+    gpd = pytest.importorskip("geopandas")
+    pytest.importorskip("pyproj")
+
+    # the project's paths are built for Windows (a separator, then a backslashed folder);
+    # with Windows' separator and file names they are consistent elsewhere too
+    monkeypatch.setattr(os, "sep", "\\")
+    monkeypatch.setattr(os.path, "basename", ntpath.basename)
+
+    project_dir = str(tmp_path / "DENATEST")
+    os.makedirs(project_dir)
+    write_elevation(project_dir, "elevation_nad83_utm6", geographic_prj, -153.0, 62.5, 0.01, (200, 600))
+
+    metadata = str(tmp_path / "metadata.txt")
+    pd.DataFrame({"code": ["TEST", "TEST"], "year": [2018, 2019], "lat": [63.5, 63.5], "long": [-150.0, -150.0],
+                  "microphone_height": [1.5, 1.5]}).to_csv(metadata, sep="\t", index=False)
+
+    # the same aircraft flies past the site on 10 June of both years
+    database = pd.concat([flight(1, dt.datetime(2018, 6, 10, 10, 0, 0)),
+                          flight(2, dt.datetime(2019, 6, 10, 10, 0, 0))], ignore_index=True)
+    database = gpd.GeoDataFrame(database, geometry=gpd.points_from_xy(database["longitude"], database["latitude"]),
+                                crs="EPSG:4326")
+
+    def query_tracks(connection_txt=None, start_date=None, end_date=None, mask=None, aircraft_info=False):
+        days = database["ak_datetime"].dt.strftime("%Y-%m-%d")
+        return database[(days >= start_date) & (days <= end_date)].copy()
+
+    config = dict(DENA.config)
+    DENA.configure(metadata=metadata, RDS=str(tmp_path))
+    DENA.connections.update({"query_tracks": query_tracks, "archive": Archive()})
+
+    source = os.path.join(repo_dir, "NMSIM", "Sources", "AirTourFixedWingSources", "C182.src")
+    settings = {"track_store": None, "default_source": source, "solver_processes": 1,
+                "NMSIMpath": os.path.join(repo_dir, "NMSIM_Standin_Solver.py")}
+
+    try:
+        records = Pipeline.run_pipeline([("DENA", "TEST", 2018), ("DENA", "TEST", 2019)], str(tmp_path / "checkpoints"),
+                                        projects_root=str(tmp_path), settings=settings,
+                                        stages=[stage for stage in Pipeline.default_stages if stage[0] != "compare"])
+    finally:
+        DENA.configure(**config)
+
+    assert (records["status"] == "done").all(), records["error"].dropna().tolist()
+
+    for year in [2018, 2019]:
+
+        summaries = dict(records.loc[records["year"] == year, ["stage", "summary"]].values)
+
+        # one trajectory written, and one simulated, for each year...
+        assert [os.path.basename(t)[:9] for t in summaries["tracks"]["trajectories"]] == ["N123_" + str(year)]
+        assert summaries["simulate"]["runs"] == 1
+
+        # ...and only its own result compared
+        deployment = {"project_dir": project_dir, "year": year, "summaries": summaries}
+        events = Pipeline.deployment_events(deployment, dict(Pipeline.default_settings))
+
+        assert [startdate.year for startdate, trj, tis in events] == [year]
@@ -0,0 +1,54 @@
+#-----------------------------------------------------------------------------#
+# test_project_files.py
+#
+# NPS Natural Sounds Program
+#
+# A project's UTM zone comes from its elevation file; a project without
+# one, or with one that names no zone, is reported as such.
+#
+# Usage:
+#	python -m pytest -q test
+#
+# History:
+#	D. Halyn Betchkal -- Created
+#
+#-----------------------------------------------------------------------------#
+
+# ================ Import Libraries =======================
+
+import os
+import re
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import NMSIM_DENA_Flight_Tracks as DENA
+from test_trajectory_trimming import write_elevation, geographic_prj, utm_prj
+
+
+# ===========================  Define functions  =======================================
+
+def test_get_utm_zone(tmp_path):
+
+    # from the projection...
+    projected = str(tmp_path / "projected")
+    write_elevation(projected, "elevation", utm_prj, 400000.0, 7000000.0, 100.0, (10, 10))
+    assert DENA.get_utm_zone(projected) == 6
+
+    # ...or, for a geographic file, its name
+    named = str(tmp_path / "named")
+    write_elevation(named, "elevation_nad83_utm13", geographic_prj, -105.0, 40.0, 0.01, (10, 10))
+    assert DENA.get_utm_zone(named) == 13
+
+
+def test_get_utm_zone_errors(tmp_path):
+
+    unnamed = str(tmp_path / "unnamed")
+    flt_path = write_elevation(unnamed, "elevation", geographic_prj, -105.0, 40.0, 0.01, (10, 10))
+
+    with pytest.raises(ValueError, match="UTM zone of " + re.escape(flt_path)):
+        DENA.get_utm_zone(unnamed)
+
+    with pytest.raises(ValueError, match="No elevation file"):
+        DENA.get_utm_zone(str(tmp_path / "empty"))
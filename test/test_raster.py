@@ -0,0 +1,129 @@
+#-----------------------------------------------------------------------------#
+# test_raster.py
+#
+# NPS Natural Sounds Program
+#
+# Grid points written by NMSIM (coordinates rounded to the meter, some
+# perhaps missing) are recognised as a lattice and scattered into a
+# north-up raster by index; points that are not a lattice are not.
+#
+# Usage:
+#	python -m pytest -q test
+#
+# History:
+#	D. Halyn Betchkal -- Created
+#
+#-----------------------------------------------------------------------------#
+
+# ================ Import Libraries =======================
+
+import os
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from NMSIM_Raster import detect_lattice, lattice_to_array, lattice_transform
+
+
+# ===========================  Define functions  =======================================
+
+def lattice_points(ncols=6, nrows=4, x0=400123.4, y0=7000045.6, dx=250.3, dy=199.7, seed=0):
+
+    '''
+    The points of a lattice as NMSIM writes them: rounded to the meter, in no particular order.
+    '''
+
+    col, row = np.meshgrid(np.arange(ncols), np.arange(nrows))
+
+    points = pd.DataFrame({"col": col.ravel(), "row": row.ravel()})
+    points["x"] = np.round(x0 + dx*points["col"])
+    points["y"] = np.round(y0 + dy*points["row"])
+
+    return points.sample(frac=1, random_state=seed).reset_index(drop=True)
+
+
+def test_detect_lattice():
+
+    points = lattice_points()
+
+    lattice = detect_lattice(points["x"], points["y"])
+
+    assert (lattice["ncols"], lattice["nrows"]) == (6, 4)
+    assert (lattice["x0"], lattice["y0"]) == (400123.0, 7000046.0)
+    assert (lattice["dx"], lattice["dy"]) == pytest.approx((250.3, 199.7), abs=0.5)
+
+    assert lattice["col"].tolist() == points["col"].tolist()
+    assert lattice["row"].tolist() == points["row"].tolist()
+
+
+def test_detect_lattice_missing_points():
+
+    points = lattice_points()
+
+    # a whole column (a tile that was not computed) and a corner point are missing
+    kept = points[(points["col"] != 3) & ~((points["col"] == 5) & (points["row"] == 3))]
+
+    lattice = detect_lattice(kept["x"], kept["y"])
+
+    assert (lattice["ncols"], lattice["nrows"]) == (6, 4)
+    assert lattice["col"].tolist() == kept["col"].tolist()
+    assert lattice["row"].tolist() == kept["row"].tolist()
+
+    # a single row takes its cell size from its spacing along the row
+    row = points[points["row"] == 2]
+    single = detect_lattice(row["x"], row["y"])
+    assert (single["nrows"], single["ncols"]) == (1, 6)
+    assert single["dy"] == single["dx"]
+
+
+def test_not_a_lattice():
+
+    rng = np.random.default_rng(0)
+
+    # scattered points...
+    assert detect_lattice(rng.uniform(0, 1000, 50), rng.uniform(0, 1000, 50)) is None
+
+    # ...points farther from their lines than the tolerance...
+    points = lattice_points()
+    x = points["x"].values.copy()
+    x[0] += 0.3*250
+    assert detect_lattice(x, points["y"]) is None
+
+    # ...two points in one cell, and too few points to tell
+    doubled = pd.concat([points, points.iloc[:1].assign(x=points["x"].iloc[0] + 5)])
+    assert detect_lattice(doubled["x"], doubled["y"]) is None
+    assert detect_lattice([400000.0], [7000000.0]) is None
+
+
+def test_lattice_to_array():
+
+    points = lattice_points()
+    kept = points[(points["col"] != 3)]
+
+    lattice = detect_lattice(kept["x"], kept["y"])
+
+    values = pd.DataFrame({"LA50": 10.0*kept["col"] + kept["row"], "SEL": -1.0*kept["col"]})
+    raster = lattice_to_array(values, lattice)
+
+    assert raster.shape == (2, 4, 6)
+    assert raster.dtype == np.float32
+
+    # the first row is northernmost; each point lands in its own cell, and a missing one is empty
+    assert raster[0, 0].tolist()[:3] == [3.0, 13.0, 23.0]
+    assert raster[0, -1].tolist()[:3] == [0.0, 10.0, 20.0]
+    assert raster[1, :, 5].tolist() == [-5.0]*4
+    assert np.isnan(raster[:, :, 3]).all()
+    assert np.isfinite(np.delete(raster, 3, axis=2)).all()
+
+    # a single column of values is one band
+    assert lattice_to_array(values["LA50"], lattice, nodata=-9999).shape == (1, 4, 6)
+    assert (lattice_to_array(values["LA50"], lattice, nodata=-9999)[0, :, 3] == -9999).all()
+
+    # cells are centered on the points, the origin at the top left
+    left, dx, _, top, _, dy = lattice_transform(lattice)
+    assert left == pytest.approx(lattice["x0"] - dx/2)
+    assert top == pytest.approx(lattice["y0"] + 3.5*lattice["dy"])
+    assert dy == -lattice["dy"]
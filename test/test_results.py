@@ -0,0 +1,208 @@
+#-----------------------------------------------------------------------------#
+# test_results.py
+#
+# NPS Natural Sounds Program
+#
+# Reading NMSIM's site-based (.tis) and grid-based (.tig) results into
+# arrays: levels in decibels, nothing computed where NMSIM wrote -999, and
+# the same rows whether read at once, in chunks or grid point by grid point.
+#
+# Usage:
+#	python -m pytest -q test
+#
+# History:
+#	D. Halyn Betchkal -- Created
+#
+#-----------------------------------------------------------------------------#
+
+# ================ Import Libraries =======================
+
+import os
+import sys
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from NMSIM_Results import columns, tig_columns, read_tis, iter_tis, index_tig, read_tig
+from NMSIM_Standin_Solver import write_site_block, synthetic_levels
+
+
+# ===========================  Define functions  =======================================
+
+def centibels(n):
+
+    '''
+    `n` rows of centibel levels [F, A, 32 bands, d'], the last row not computed.
+    '''
+
+    levels = synthetic_levels(np.linspace(500.0, 5000.0, n))
+    levels[-1:] = -999
+
+    return levels
+
+
+def write_tis(tis_path, times, levels, site="DENATRLA"):
+
+    '''
+    A single-receiver .tis, as NMSIM writes it.
+    '''
+
+    with open(tis_path, "w") as out:
+
+        out.write(" " + tis_path + "\n")
+        out.write(" elevation.flt\n")
+        out.write("---End File Header---\n")
+        write_site_block(out, site, 400000.0, 7000000.0, times, levels, zone=6)
+
+
+def test_read_tis(tmp_path):
+
+    tis_path = str(tmp_path / "N123.tis")
+    times = np.arange(0, 100, 1.0)
+    write_tis(tis_path, times, centibels(100))
+
+    header, levels = read_tis(tis_path)
+
+    assert (header["site"], header["n_steps"]) == ("DENATRLA", 100)
+    assert header["file_header"][1].strip() == "elevation.flt"
+
+    assert levels.shape == (100, len(columns))
+    assert levels.dtype == np.float32
+
+    # position number and time as written; levels from centibels to decibels
+    assert np.array_equal(levels[:, 0], np.arange(1, 101))
+    assert np.array_equal(levels[:, 1], times)
+    assert np.allclose(levels[:-1, 2:], 0.1*centibels(100)[:-1], atol=1e-4)
+
+    # and anything NMSIM did not compute is `nodata`
+    assert (levels[-1, 2:] == np.float32(-99.9)).all()
+    assert np.isnan(read_tis(tis_path, nodata=np.nan)[1][-1, 2:]).all()
+
+
+def test_read_tis_in_chunks(tmp_path):
+
+    tis_path = str(tmp_path / "N123.tis")
+    write_tis(tis_path, np.arange(0, 100, 1.0), centibels(100))
+
+    header, levels = read_tis(tis_path, dtype="float64")
+
+    # small chunks give the same rows as one read...
+    assert np.array_equal(read_tis(tis_path, dtype="float64", chunk_rows=7)[1], levels)
+
+    chunks = list(iter_tis(tis_path, chunk_rows=30, dtype="float64"))
+    assert [len(c) for c in chunks] == [30, 30, 30, 10]
+    assert np.array_equal(np.concatenate(chunks), levels)
+
+
+def test_read_tis_wrong_row_count(tmp_path):
+
+    tis_path = str(tmp_path / "N123.tis")
+    write_tis(tis_path, np.arange(0, 100, 1.0), centibels(100))
+
+    # a header that promises fewer rows than follow
+    with open(tis_path) as f:
+        text = f.read()
+    with open(tis_path, "w") as f:
+        f.write(text.replace(" {0:8d}\n".format(100), " {0:8d}\n".format(10), 1))
+
+    header, levels = read_tis(tis_path, chunk_rows=16)
+
+    assert header["n_steps"] == 10
+    assert len(levels) == 100
+
+
+def test_read_tis_errors(tmp_path):
+
+    tis_path = str(tmp_path / "N123.tis")
+    with open(tis_path, "w") as f:
+        f.write(" N123.tis\n elevation.flt\n")
+
+    with pytest.raises(ValueError, match="End File Header"):
+        read_tis(tis_path)
+
+
+def write_tig(tig_path, points):
+
+    '''
+    A .tig of one time history per grid point [(name, x, y, n_rows)], as NMSIM writes it.
+    '''
+
+    with open(tig_path, "w") as out:
+
+        out.write(" " + tig_path + "\n")
+        out.write("ii:    1     3     3\n")
+        out.write("jj:    1     1     1\n")
+        out.write("---End File Header---\n")
+
+        for name, x, y, n in points:
+            write_site_block(out, name, x, y, np.arange(n, dtype="float"), centibels(n), zone=6)
+
+        out.write("\n")
+
+
+def test_index_tig(tmp_path):
+
+    tig_path = str(tmp_path / "N123.tig")
+    points = [("00010001", 400000.0, 7000000.0, 40), ("00020001", 400500.0, 7000000.0, 25),
+              ("00030001", 401000.0, 7000250.0, 0)]
+    write_tig(tig_path, points)
+
+    index = index_tig(tig_path)
+
+    assert index["site"].tolist() == [p[0] for p in points]
+    assert (index["zone"] == 6).all()
+    assert index[["x", "y"]].values.tolist() == [[p[1], p[2]] for p in points]
+    assert index["n_rows"].tolist() == [40, 25, 0]
+
+    # the offsets point at each grid point's header and rows
+    with open(tig_path, "rb") as f:
+        tig = f.read()
+
+    for site, header_offset, data_offset, end_offset in index[["site", "header_offset", "data_offset", "end_offset"]].values:
+        assert tig[header_offset:].startswith(b" Site: " + site.encode())
+        assert tig[end_offset:].startswith(b"---End of This Data Section---")
+        assert tig[header_offset:data_offset].count(b"\n") == 9
+
+    first = index.iloc[0]
+    assert tig[first["data_offset"]:].startswith(b"     1      0.00")
+
+
+def test_read_tig(tmp_path):
+
+    tig_path = str(tmp_path / "N123.tig")
+    write_tig(tig_path, [("00010001", 400000.0, 7000000.0, 40), ("00020001", 400500.0, 7000000.0, 25)])
+
+    index, levels = read_tig(tig_path)
+
+    assert levels.shape == (2, 40, len(tig_columns))
+
+    # each grid point's rows as a .tis would give them, without the position number...
+    tis_path = str(tmp_path / "N123.tis")
+    for i, n in enumerate([40, 25]):
+
+        write_tis(tis_path, np.arange(n, dtype="float"), centibels(n))
+        header, expected = read_tis(tis_path, nodata=np.nan)
+
+        assert np.array_equal(levels[i, :n], expected[:, 1:], equal_nan=True)
+
+    # ...and padded with NaN past its last time step
+    assert np.isnan(levels[1, 25:]).all()
+    assert np.isnan(levels[0, 39, 1:]).all()
+
+    # written straight into a memory-mapped .npy, with the same result
+    npy_path = str(tmp_path / "N123.npy")
+    index, mapped = read_tig(tig_path, out=npy_path, index=index)
+
+    assert isinstance(mapped, np.memmap)
+    assert np.array_equal(np.load(npy_path), levels, equal_nan=True)
+
+
+def test_index_tig_errors(tmp_path):
+
+    tig_path = str(tmp_path / "N123.tig")
+    with open(tig_path, "w") as f:
+        f.write(" N123.tig\n")
+
+    with pytest.raises(ValueError, match="End File Header"):
+        index_tig(tig_path)
@@ -0,0 +1,41 @@
+#-----------------------------------------------------------------------------#
+# test_solver_jobs.py
+#
+# NPS Natural Sounds Program
+#
+# A solver that cannot be started fails its own jobs, each recorded with
+# the reason, without stopping the rest of the batch.
+#
+# Usage:
+#	python -m pytest -q test
+#
+# History:
+#	D. Halyn Betchkal -- Created
+#
+#-----------------------------------------------------------------------------#
+
+# ================ Import Libraries =======================
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from NMSIM_Batch import solver_job, run_solver_jobs
+
+
+# ===========================  Define functions  =======================================
+
+def test_missing_solver(tmp_path):
+
+    jobs = [solver_job("N123_" + str(n), str(tmp_path / ("N123_" + str(n))), "elev.flt", "site.sit",
+                       "N123_" + str(n) + ".trj", "source.src") for n in range(3)]
+
+    results = run_solver_jobs(jobs, NMSIMpath=str(tmp_path / "Nord2000batch.exe"), processes=2,
+                              retries=1, scratch_dir=str(tmp_path))
+
+    assert len(results) == 3
+    assert not results["ok"].any()
+    assert results["exit_code"].isna().all()
+    assert (results["attempts"] == 2).all()
+    assert all("Nord2000batch.exe" in " ".join(m) for m in results["messages"])
@@ -0,0 +1,68 @@
+#-----------------------------------------------------------------------------#
+# test_sweep.py
+#
+# NPS Natural Sounds Program
+#
+# A scenario sweep run with the stand-in solver: one job per distinct set of
+# inputs, results labelled by every dimension, and nothing re-run when the
+# same sweep is repeated.
+#
+# Usage:
+#	python -m pytest -q test
+#
+# History:
+#	D. Halyn Betchkal -- Created
+#
+#-----------------------------------------------------------------------------#
+
+# ================ Import Libraries =======================
+
+import os
+import sys
+import glob
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from NMSIM_Sweep import sweep_dimensions, sweep_project, run_sweep, sweep_array
+from NMSIM_Trajectories import read_trajectory
+
+
+test_dir = os.path.dirname(os.path.abspath(__file__))
+repo_dir = os.path.dirname(test_dir)
+
+standin = os.path.join(repo_dir, "NMSIM_Standin_Solver.py")
+
+
+# ===========================  Define functions  =======================================
+
+def test_run_sweep(tmp_path):
+
+    trj_file = sorted(glob.glob(os.path.join(test_dir, "BAND002", "Input_Data", "03_TRAJECTORY", "*.trj")))[0]
+    sources = sorted(glob.glob(os.path.join(repo_dir, "NMSIM", "Sources", "AirTourFixedWingSources", "*.src")))[:2]
+
+    header, trajectory = read_trajectory(trj_file)
+    sites = pd.DataFrame({"x": [trajectory["x"].mean(), trajectory["x"].mean() + 2000],
+                          "y": [trajectory["y"].mean()]*2,
+                          "name": ["A", "B"]})
+
+    project = sweep_project(str(tmp_path), "TEST", "elevation.flt", trj_file, sites, sources[0])
+
+    for repeat in [False, True]:
+
+        results, runs = run_sweep(project, ["LAeq"], NMSIMpath=standin, processes=2,
+                                  source=sources, agl_offset=[0, 150, 150], site_height=1.5)
+
+        # 2 sources x 2 distinct offsets x 1 height, each its own job
+        assert runs["job"].nunique() == 4
+        assert runs["ok"].all()
+        assert runs["skipped"].all() == repeat
+
+    assert list(results.index.names) == sweep_dimensions + ["site"]
+
+    values, coords = sweep_array(results, "LAeq")
+    assert values.shape == (2, 2, 1, 2)
+    assert coords["agl_offset"] == [0.0, 150.0]
+
+    # the stand-in's levels fall with distance, so flying higher is quieter
+    assert (values[:, 1] < values[:, 0]).all()
@@ -0,0 +1,129 @@
+#-----------------------------------------------------------------------------#
+# test_timing.py
+#
+# NPS Natural Sounds Program
+#
+# Stage timing: nothing is recorded (and nothing is done) until it is
+# enabled, and `summary` totals each stage with percentiles of its
+# durations, whether from this process or a log of an earlier run.
+#
+# Usage:
+#	python -m pytest -q test
+#
+# History:
+#	D. Halyn Betchkal -- Created
+#
+#-----------------------------------------------------------------------------#
+
+# ================ Import Libraries =======================
+
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import NMSIM_Timing as Timing
+from NMSIM_Timing import enable, disable, timed, timer, count, counters, summary, report, read_log
+
+
+# ===========================  Define functions  =======================================
+
+@pytest.fixture(autouse=True)
+def instrumentation_off():
+
+    '''
+    Leave this process's instrumentation off, with nothing recorded, after every test.
+    '''
+
+    yield
+
+    disable()
+    Timing.state["records"] = []
+    Timing.state["counters"].clear()
+
+
+def test_disabled_is_a_no_op():
+
+    @timer("decorated")
+    def double(x):
+        return 2*x
+
+    # the same do-nothing context every time, and nothing recorded
+    assert timed("densify", flight=1) is timed("solve") is Timing.untimed
+
+    with timed("densify", flight=1):
+        pass
+
+    count("points", 100)
+
+    assert double(21) == 42
+    assert Timing.state["records"] == []
+    assert counters() == {}
+    assert len(summary()) == 0
+    assert "(nothing was timed)" in report()
+
+
+def test_enabled_records(tmp_path):
+
+    log_path = str(tmp_path / "logs" / "run_timing.jsonl")
+    enable(log_path)
+
+    @timer("decorated")
+    def double(x):
+        return 2*x
+
+    with timed("densify", flight=7):
+        pass
+
+    with pytest.raises(RuntimeError):
+        with timed("solve"):
+            raise RuntimeError("solver failed")
+
+    assert double(21) == 42
+    count("points", 100)
+    count("points", 20)
+
+    assert counters() == {"points": 120}
+
+    table = summary()
+    assert sorted(table.index) == ["decorated", "densify", "solve"]
+    assert table.loc["solve", "failed"] == 1
+    assert table.loc["densify", "failed"] == 0
+
+    # the log holds the same records, and the counters once reported
+    text = report()
+    assert "points: 120" in text
+    disable()
+
+    records = read_log(log_path)
+    assert summary(records)[["calls", "failed"]].equals(table[["calls", "failed"]])
+    assert [r for r in records if r["event"] == "stage" and r["stage"] == "densify"][0]["flight"] == 7
+    assert (records[-1]["event"], records[-1]["counters"]) == ("counters", {"points": 120})
+
+    # stopping keeps what was recorded
+    assert len(summary()) == 3
+
+
+def test_summary_percentiles():
+
+    records = [{"event": "stage", "stage": "solve", "seconds": float(s), "ok": s != 100} for s in range(1, 101)]
+    records += [{"event": "stage", "stage": "parse", "seconds": 2.0, "ok": True} for n in range(3)]
+    records += [{"event": "counters", "counters": {"points": 5}}]
+
+    table = summary(records)
+
+    # most time first
+    assert table.index.tolist() == ["solve", "parse"]
+
+    solve = table.loc["solve"]
+    assert (solve["calls"], solve["failed"]) == (100, 1)
+    assert solve["total_s"] == 5050
+    assert solve["share"] == pytest.approx(5050/5056)
+    assert (solve["mean_s"], solve["max_s"]) == (50.5, 100)
+    assert (solve["p50_s"], solve["p90_s"], solve["p99_s"]) == pytest.approx((50.5, 90.1, 99.01))
+
+    parse = table.loc["parse"]
+    assert (parse["calls"], parse["total_s"], parse["p50_s"], parse["p99_s"]) == (3, 6.0, 2.0, 2.0)
+
+    assert len(summary([])) == 0
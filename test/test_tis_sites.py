@@ -0,0 +1,105 @@
+#-----------------------------------------------------------------------------#
+# test_tis_sites.py
+#
+# NPS Natural Sounds Program
+#
+# Results computed for a site file of many receivers: each .tis is paired
+# with the trajectory that made it whatever the site file is called, and
+# one receiver's levels read through the cache match a direct read.
+#
+# Usage:
+#	python -m pytest -q test
+#
+# History:
+#	D. Halyn Betchkal -- Created
+#
+#-----------------------------------------------------------------------------#
+
+# ================ Import Libraries =======================
+
+import os
+import sys
+import ntpath
+import datetime as dt
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import NMSIM_DENA_Flight_Tracks as DENA
+from NMSIM_Cache import cached_tis_site
+from NMSIM_Results import split_tis
+from NMSIM_Standin_Solver import write_site_block, synthetic_levels
+
+
+# ===========================  Define functions  =======================================
+
+def write_multisite_tis(tis_path, sites):
+
+    '''
+    A .tis holding one synthetic time history per receiver, as NMSIM writes them.
+    '''
+
+    times = np.arange(0, 30, 1.0)
+
+    with open(tis_path, "w") as out:
+
+        out.write(" " + tis_path + "\n---End File Header---\n")
+        for n, name in enumerate(sites):
+            write_site_block(out, name, 400000.0 + 1000*n, 7000000.0, times, synthetic_levels(500.0 + 1000*n + 10*times))
+
+
+def test_pair_trj_to_tis_results_multisite(tmp_path, monkeypatch):
+
+    project_dir = str(tmp_path)
+
+    # (the project's paths are Windows-style; elsewhere they are simply part of a file name,
+    #  so file names are taken from them as Windows would)
+    monkeypatch.setattr(os.path, "basename", ntpath.basename)
+    open(project_dir + os.sep + "Input_Data\\05_SITES\\DENA_2019.sit", "w").close()
+
+    trajectories = ["N123_20190610_180000", "N45678_20190611_093000"]
+    for trj in trajectories:
+        write_multisite_tis(project_dir + os.sep + "Output_Data\\TIG_TIS\\DENA_2019_" + trj + ".tis", ["DENATRLA", "DENAWEFO"])
+
+    pairs = sorted(DENA.pair_trj_to_tis_results(project_dir))
+
+    assert [os.path.basename(trj) for trj, tis in pairs] == [t + ".trj" for t in trajectories]
+    assert [os.path.basename(tis)[-len(t) - 4:] for (trj, tis), t in zip(pairs, trajectories)] == [t + ".tis" for t in trajectories]
+
+
+def test_cached_tis_site(tmp_path):
+
+    tis_path = str(tmp_path / "DENA_2019_N123_20190610_180000.tis")
+    write_multisite_tis(tis_path, ["DENATRLA", "DENAWEFO"])
+
+    index, levels = split_tis(tis_path, dtype="float64")
+
+    cache_dir = str(tmp_path / "cache")
+    for site in ["DENAWEFO", "DENATRLA", "DENAWEFO"]:
+
+        row, cached_levels = cached_tis_site(tis_path, site, dtype="float64", cache_dir=cache_dir)
+
+        assert row["site"] == site
+        assert np.array_equal(cached_levels, levels[site])
+
+    # one entry (an array and its index row) per receiver
+    assert len(os.listdir(cache_dir)) == 4
+
+
+def test_tis_resampler(tmp_path):
+
+    tis_path = str(tmp_path / "DENA_2019_N123_20190610_180000.tis")
+    write_multisite_tis(tis_path, ["DENATRLA", "DENAWEFO"])
+
+    start = dt.datetime(2019, 6, 10, 18, 0, 0)
+    index, levels = split_tis(tis_path, dtype="float64")
+
+    for cache in [False, True]:
+
+        clean_tis = DENA.tis_resampler(tis_path, start, utc_offset=-8, cache=cache, site="DENAWEFO")
+
+        # one row a second, in local time, from the chosen receiver
+        assert clean_tis.index[0] == pd.Timestamp("2019-06-10 10:00:00")
+        assert (np.diff(clean_tis.index.values) == np.timedelta64(1, "s")).all()
+        assert np.allclose(clean_tis["A"].values, levels["DENAWEFO"][:, 3])
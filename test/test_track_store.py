@@ -0,0 +1,90 @@
+#-----------------------------------------------------------------------------#
+# test_track_store.py
+#
+# NPS Natural Sounds Program
+#
+# The local track store must answer a query as the Overflights Database
+# does: every point of each flight that enters the mask, including flights
+# that cross midnight, whether the answer comes from the database or disk.
+#
+# Usage:
+#	python -m pytest -q test
+#
+# History:
+#	D. Halyn Betchkal -- Created
+#
+#-----------------------------------------------------------------------------#
+
+# ================ Import Libraries =======================
+
+import os
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+
+gpd = pytest.importorskip("geopandas")
+pytest.importorskip("pyarrow")
+from shapely.geometry import box
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from NMSIM_Track_Store import cached_query_tracks
+
+
+# ===========================  Define functions  =======================================
+
+def flight_points(flight_id, start, minutes, lon0, lon1, lat):
+
+    '''
+    A flight due east, one point a minute.
+    '''
+
+    n = minutes + 1
+    return pd.DataFrame({"flight_id": flight_id,
+                         "ak_datetime": pd.date_range(start, periods=n, freq="min"),
+                         "longitude": np.linspace(lon0, lon1, n),
+                         "latitude": lat})
+
+
+# two flights through the mask (the second crossing midnight into 2019-06-11) and one that misses it
+database = pd.concat([flight_points(1, "2019-06-10 10:00", 120, -152.0, -148.0, 63.5),
+                      flight_points(2, "2019-06-10 23:00", 120, -152.0, -148.0, 63.5),
+                      flight_points(3, "2019-06-10 12:00", 60, -152.0, -148.0, 60.0)], ignore_index=True)
+database = gpd.GeoDataFrame(database, geometry=gpd.points_from_xy(database["longitude"], database["latitude"]),
+                            crs="EPSG:4326")
+
+
+def query_tracks(start_date=None, end_date=None, mask=None, aircraft_info=False):
+
+    '''
+    As the database does: every point of each flight with a point in the mask and the date range.
+    '''
+
+    geometry = mask.union_all() if isinstance(mask, gpd.GeoDataFrame) else mask
+    days = database["ak_datetime"].dt.strftime("%Y-%m-%d")
+    inside = database.within(geometry) & (days >= start_date) & (days <= end_date)
+
+    return database[database["flight_id"].isin(database.loc[inside, "flight_id"])].copy()
+
+
+def test_store_returns_whole_flights(tmp_path):
+
+    mask = gpd.GeoDataFrame(geometry=[box(-150.5, 63.0, -149.5, 64.0)], crs="EPSG:4326")
+    store = str(tmp_path / "store")
+
+    direct = query_tracks("2019-06-11", "2019-06-11", mask)
+
+    fetched = cached_query_tracks(query_tracks, store, "2019-06-11", "2019-06-11", mask)
+    stored = cached_query_tracks(query_tracks, store, "2019-06-11", "2019-06-11", mask)
+
+    # flight 2 enters the mask after midnight; all of it is returned, its points before midnight too
+    assert sorted(direct["flight_id"].unique()) == [2]
+    for tracks in [fetched, stored]:
+        assert len(tracks) == len(direct)
+        assert tracks["ak_datetime"].min() == pd.Timestamp("2019-06-10 23:00")
+
+    # a day both flights enter: whole flights, not just the points inside the mask
+    tracks = cached_query_tracks(query_tracks, store, "2019-06-10", "2019-06-10", mask)
+    assert sorted(tracks["flight_id"].unique()) == [1, 2]
+    assert len(tracks) == 2*121
@@ -0,0 +1,114 @@
+#-----------------------------------------------------------------------------#
+# test_trajectories.py
+#
+# NPS Natural Sounds Program
+#
+# Densifying a trajectory keeps every GPS fix, fills each gap to the time
+# step and turns through north the short way round. A written trajectory
+# reads back as it was written.
+#
+# Usage:
+#	python -m pytest -q test
+#
+# History:
+#	D. Halyn Betchkal -- Created
+#
+#-----------------------------------------------------------------------------#
+
+# ================ Import Libraries =======================
+
+import os
+import sys
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from NMSIM_Trajectories import interpolate_headings, densify_trajectory, write_trajectory, read_trajectory, trj_columns
+
+
+# ===========================  Define functions  =======================================
+
+def test_headings_wrap_through_north():
+
+    # 350° to 10° turns 20° clockwise; 10° to 350° turns back again
+    headings = interpolate_headings([0, 4, 8], [350, 10, 350], [0, 1, 2, 3, 4, 6, 8])
+
+    assert headings == pytest.approx([350, 355, 0, 5, 10, 0, 350])
+    assert ((headings >= 0) & (headings < 360)).all()
+
+
+def test_densify_trajectory():
+
+    t = np.array([0.0, 2.5, 6.0])
+    x = np.array([0.0, 25.0, 60.0])
+
+    dense = densify_trajectory(t, x, 2*x, [100, 200, 300], [350, 10, 30], [90, 100, 110],
+                               extra={"climb_angle": [0, 2, 4]})
+
+    # every fix is kept, and no gap is longer than the step
+    assert set(t) <= set(dense["time_elapsed"])
+    assert np.diff(dense["time_elapsed"]).max() <= 1.0
+    assert dense["time_elapsed"].tolist() == [0, 1, 2, 2.5, 3, 4, 5, 6]
+
+    # the straight line is followed exactly...
+    assert dense["x"].tolist() == pytest.approx((10*dense["time_elapsed"]).tolist())
+    assert dense["y"].tolist() == pytest.approx((20*dense["time_elapsed"]).tolist())
+    assert dense["climb_angle"].iloc[-1] == 4
+
+    # ...and the heading turns through north between the first two fixes
+    assert dense["heading"].iloc[1] == pytest.approx(358)
+    assert dense["heading"].iloc[2] == pytest.approx(6)
+
+
+def test_densify_trajectory_errors():
+
+    with pytest.raises(ValueError, match="two points"):
+        densify_trajectory([0], [0], [0], [0], [0], [0])
+
+    with pytest.raises(ValueError, match="increasing"):
+        densify_trajectory([0, 2, 1], [0, 0, 0], [0, 0, 0], [0, 0, 0], [0, 0, 0], [0, 0, 0])
+
+
+def test_trajectory_round_trip(tmp_path):
+
+    trj_path = str(tmp_path / "N123_20190610_180000.trj")
+
+    n = 50
+    t = np.arange(n, dtype="float")
+    columns = {"time_elapsed": t,
+               "x": 400000.0 + 51.444*t,
+               "y": 7000000.0 - 0.125*t,
+               "z": 914.4 + 0.5*t,
+               "heading": (355.0 + t) % 360,
+               "climb_angle": np.where(t < 25, 1.5, -1.5),
+               "speed": 100.0}
+
+    write_trajectory(trj_path, zone=6, title="N123 beginning 2019-06-10 18:00:00 UTC", power=np.linspace(80, 90, n),
+                     temperature=50.0, **columns)
+
+    header, trajectory = read_trajectory(trj_path)
+
+    assert (header["zone"], header["title"]) == (6, "N123 beginning 2019-06-10 18:00:00 UTC")
+    assert (header["temperature"], header["humidity"]) == (50.0, 70.0)
+
+    # every column comes back, to the file's three decimal places
+    assert list(trajectory.columns) == trj_columns
+    assert len(trajectory) == n
+    for name, values in columns.items():
+        assert np.allclose(trajectory[name], values, atol=5e-4), name
+    assert np.allclose(trajectory["power"], np.linspace(80, 90, n), atol=5e-4)
+    assert (trajectory["roll"] == 0).all()
+
+    # nothing temporary is left behind
+    assert os.listdir(str(tmp_path)) == ["N123_20190610_180000.trj"]
+
+
+def test_read_trajectory_errors(tmp_path):
+
+    not_trj = str(tmp_path / "notes.txt")
+    with open(not_trj, "w") as f:
+        f.write("Flight track trajectory variable description:\n 1 2 3\n")
+
+    with pytest.raises(ValueError, match="time\\(s\\)"):
+        read_trajectory(not_trj)
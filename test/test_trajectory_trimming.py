@@ -0,0 +1,171 @@
+#-----------------------------------------------------------------------------#
+# test_trajectory_trimming.py
+#
+# NPS Natural Sounds Program
+#
+# Trimming trajectories to the part of a flight near the microphone, as
+# `tracks_within` does with `trim_within_km`: the microphone's elevation
+# is read from the project's elevation file, and a trimmed trajectory
+# keeps its absolute start time in its header.
+#
+# Usage:
+#	python -m pytest -q test
+#
+# History:
+#	D. Halyn Betchkal -- Created
+#
+#-----------------------------------------------------------------------------#
+
+# ================ Import Libraries =======================
+
+import os
+import sys
+import glob
+import types
+import datetime as dt
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import NMSIM_DENA_Flight_Tracks as DENA
+from NMSIM_Pipeline import trj_start_time
+from NMSIM_Trajectories import read_trajectory
+
+
+# a geographic elevation file around the site (named for its project's UTM zone, as the ArcGIS tool does)
+geographic_prj = 'GEOGCS["GCS_North_American_1983",DATUM["D_North_American_1983",SPHEROID["GRS_1980",6378137.0,298.257222101]],PRIMEM["Greenwich",0.0],UNIT["Degree",0.0174532925199433]]'
+
+utm_prj = 'PROJCS["NAD_1983_UTM_Zone_6N",GEOGCS["GCS_North_American_1983"]]'
+
+
+# ===========================  Define functions  =======================================
+
+def write_elevation(project_dir, name, prj, xll, yll, cellsize, shape, ground=600.0):
+
+    '''
+    Write a flat GridFloat elevation file where `get_utm_zone` and `site_elevation` look for it.
+    '''
+
+    # (the project's paths are Windows-style; elsewhere they are simply part of a file name)
+    flt_path = project_dir + os.sep + "Input_Data\\01_ELEVATION\\" + name + ".flt"
+    os.makedirs(os.path.dirname(flt_path), exist_ok=True)
+
+    np.full(shape, ground, dtype="<f4").tofile(flt_path)
+
+    with open(flt_path[:-4] + ".hdr", "w") as hdr:
+        hdr.write("ncols {0:d}\nnrows {1:d}\n".format(shape[1], shape[0]))
+        hdr.write("xllcorner {0!r}\nyllcorner {1!r}\ncellsize {2!r}\n".format(xll, yll, cellsize))
+        hdr.write("NODATA_value -99999\nbyteorder LSBFIRST\n")
+
+    with open(flt_path[:-4] + ".prj", "w") as f:
+        f.write(prj)
+
+    return flt_path
+
+
+def test_site_elevation_projected(tmp_path):
+
+    project_dir = str(tmp_path)
+    write_elevation(project_dir, "elevation_nad83_utm6", utm_prj, 400000.0, 7000000.0, 100.0, (10, 10))
+
+    site_z = DENA.site_elevation(project_dir, -150.0, 63.0, 400550.0, 7000450.0, 1.5)
+
+    assert isinstance(site_z, float)
+    assert site_z == pytest.approx(601.5)
+
+    # off the raster, ranges fall back on horizontal distance
+    assert DENA.site_elevation(project_dir, -150.0, 63.0, 0.0, 0.0, 1.5) is None
+
+
+def test_site_elevation_geographic(tmp_path):
+
+    project_dir = str(tmp_path)
+    write_elevation(project_dir, "elevation_nad83_utm6", geographic_prj, -151.0, 63.0, 0.01, (100, 200))
+
+    site_z = DENA.site_elevation(project_dir, -150.0, 63.5, 400000.0, 7000000.0, 3.0)
+
+    assert site_z == pytest.approx(603.0)
+
+
+class Archive:
+
+    '''
+    An acoustic archive holding one day of hourly NVSPL files.
+    '''
+
+    def __init__(self, day):
+        self.day = day
+
+    def nvspl(self, **kwargs):
+        return [types.SimpleNamespace(year=str(self.day.year), month="{0:02d}".format(self.day.month),
+                                      day="{0:02d}".format(self.day.day), hour="{0:02d}".format(h))
+                for h in range(24)]
+
+
+def test_tracks_within_trims_to_cutoff(tmp_path):
+
+    gpd = pytest.importorskip("geopandas")
+    pytest.importorskip("shapely")
+    pytest.importorskip("pyproj")
+
+    project_dir = str(tmp_path / "DENATEST")
+    write_elevation(project_dir, "elevation_nad83_utm6", geographic_prj, -153.0, 62.5, 0.01, (200, 600))
+
+    metadata = str(tmp_path / "metadata.txt")
+    pd.DataFrame({"code": ["TEST"], "year": [2019], "lat": [63.5], "long": [-150.0],
+                  "microphone_height": [1.5]}).to_csv(metadata, sep="\t", index=False)
+
+    # a two-hour flight due east at 3000 ft, passing 5.5 km north of the site halfway through
+    start = dt.datetime(2019, 6, 10, 10, 0, 0)
+    seconds = np.arange(0, 7200, 10)
+    longitude = -152.0 + 4.0*seconds/7200
+
+    flight = pd.DataFrame({"id": 1,
+                           "flight_id": 1,
+                           "registration": "N123",
+                           "ak_datetime": pd.to_datetime([start + dt.timedelta(seconds=int(s)) for s in seconds]),
+                           "longitude": longitude,
+                           "latitude": 63.55,
+                           "altitude_ft": 3000.0,
+                           "heading": 90.0,
+                           "knots": 100.0})
+    flight["utc_datetime"] = flight["ak_datetime"] + pd.Timedelta(hours=8)
+    flight = gpd.GeoDataFrame(flight, geometry=gpd.points_from_xy(flight["longitude"], flight["latitude"]), crs="EPSG:4326")
+
+    def query_tracks(connection_txt=None, start_date=None, end_date=None, mask=None, aircraft_info=False):
+        return flight.copy()
+
+    config = dict(DENA.config)
+    DENA.configure(metadata=metadata, RDS=str(tmp_path))
+    DENA.connections["query_tracks"] = query_tracks
+
+    try:
+        tracks = DENA.tracks_within(Archive(start), "TEST", 2019, search_within_km=25, NMSIM_proj_dir=project_dir,
+                                    track_store=None, trim_within_km=10, trim_pad_s=60.0, show=False)
+    finally:
+        DENA.configure(**config)
+
+    trj_paths = glob.glob(project_dir + os.sep + r"Input_Data\03_TRAJECTORY" + os.sep + "*.trj")
+    assert len(trj_paths) == 1
+
+    header, trajectory = read_trajectory(trj_paths[0])
+    offset = tracks["trim_offset_s"].iloc[0]
+
+    # only the pass by the site is kept, starting again from zero...
+    assert offset > 0
+    assert trajectory["time_elapsed"].iloc[0] == 0
+    assert trajectory["time_elapsed"].iloc[-1] < 7200 - offset
+    assert len(trajectory) < 0.5*7200
+
+    # ...and the header's start time is the flight's, moved on by the time trimmed
+    assert trj_start_time(trj_paths[0]) == flight["utc_datetime"].iloc[0] + pd.Timedelta(seconds=offset)
+
+    # the file keeps the flight's name
+    assert os.path.basename(trj_paths[0]) == "N123_20190610_180000.trj"
+
+    # the closest range is a slant range, from 3000 ft down to the microphone (600 m ground + 1.5 m)
+    closest = tracks.iloc[0]
+    assert np.isfinite(closest["closest_slant_km"])
+    assert closest["closest_slant_km"] == pytest.approx(np.hypot(closest["closest_distance"], (914.4 - 601.5)/1000))